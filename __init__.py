@@ -34,7 +34,8 @@ import pkgutil
 # That way our FPGA projects can import this without having to set anything up
 __all__ = []
 for loader, module_name, is_pkg in pkgutil.walk_packages(__path__):
-    if "utils" in module_name:
+    if "utils" in module_name or module_name == "setup":
+        # setup.py would run setuptools against our caller's argv
         continue
     __all__.append(module_name)
     _module = loader.find_module(module_name).load_module(module_name)
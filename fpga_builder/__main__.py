@@ -0,0 +1,110 @@
+# Copyright (c) 2022, Intrepid Control Systems, Inc.
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice, this
+#    list of conditions and the following disclaimer.
+#
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+#    this list of conditions and the following disclaimer in the documentation
+#    and/or other materials provided with the distribution.
+#
+# 3. Neither the name of the copyright holder nor the names of its
+#    contributors may be used to endorse or promote products derived from
+#    this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+# OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+
+"""
+Copyright 2022 Intrepid Control Systems
+
+Command line tools that aren't tied to a project's run.py
+i.e. `python -m fpga_builder logs build/device_a/output`
+
+"""
+
+import argparse
+
+from . import farm
+from . import logstore
+from . import metrics
+from . import sweep
+from . import toolchain
+
+
+def get_parser():
+    """
+    Gets a parser for the program
+
+    Args:
+        None
+
+    Returns:
+        An unparsed argparse instance
+
+    """
+    parser = argparse.ArgumentParser(
+        "fpga_builder", formatter_class=argparse.ArgumentDefaultsHelpFormatter
+    )
+    subparsers = parser.add_subparsers(help="sub-command help", dest="command")
+    logs_parser = subparsers.add_parser(
+        "logs",
+        help="Query the messages of a build",
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+    )
+    logstore.setup_logs_parser(logs_parser)
+    logs_parser.set_defaults(func=logstore.logs_main)
+    metrics_parser = subparsers.add_parser(
+        "metrics",
+        help="Check the latest build of a device for regressions",
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+    )
+    metrics.setup_metrics_parser(metrics_parser)
+    metrics_parser.set_defaults(func=metrics.metrics_main)
+    toolchains_parser = subparsers.add_parser(
+        "toolchains",
+        help="List the Xilinx tools in the toolchain registry",
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+    )
+    toolchain.setup_toolchains_parser(toolchains_parser)
+    toolchains_parser.set_defaults(func=toolchain.toolchains_main)
+    blocks_parser = subparsers.add_parser(
+        "blocks",
+        help="Build many blocks through implementation and tabulate the results",
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+    )
+    farm.setup_blocks_parser(blocks_parser)
+    blocks_parser.set_defaults(func=farm.blocks_main)
+    sweep_parser = subparsers.add_parser(
+        "sweep",
+        help="Build every generics combination of blocks and rank the results",
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+    )
+    sweep.setup_sweep_parser(sweep_parser)
+    sweep_parser.set_defaults(func=sweep.sweep_main)
+    return parser
+
+
+def main():
+    parser = get_parser()
+    args = parser.parse_args()
+    if args.command is None:
+        parser.print_help()
+        exit(1)
+    args.func(args)
+
+
+if __name__ == "__main__":
+    main()
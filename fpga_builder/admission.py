@@ -0,0 +1,261 @@
+# Copyright (c) 2022, Intrepid Control Systems, Inc.
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice, this
+#    list of conditions and the following disclaimer.
+#
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+#    this list of conditions and the following disclaimer in the documentation
+#    and/or other materials provided with the distribution.
+#
+# 3. Neither the name of the copyright holder nor the names of its
+#    contributors may be used to endorse or promote products derived from
+#    this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+# OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+"""
+Copyright 2022 Intrepid Control Systems
+
+Memory aware admission control for builds sharing a host
+Every build reserves the peak memory its device needed before, in a state file
+shared by all builder processes, and waits until the host has room for it
+Relies on /proc and file locks, so builds are never held back on other platforms
+
+"""
+
+import json
+import os
+import socket
+import time
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+from .utils import get_lock_dir, info, warning
+from . import logstore
+from . import metrics
+from . import procmon
+
+STATE_FILE = "memory.json"
+LOCK_FILE = "memory.lock"
+
+# Peaks grow a little between builds, reserve a bit more than the worst seen
+ESTIMATE_MARGIN = 1.1
+ESTIMATE_WINDOW = 5
+
+POLL_SECONDS = 10
+WAIT_MESSAGE_SECONDS = 60
+
+GB = 1024**3
+
+
+def get_estimates(device):
+    """
+    Estimates the peak memory of each stage of a device from its earlier builds
+
+    Args:
+        device: The device name
+
+    Returns:
+        A dictionary of stage name to bytes, empty if never built
+
+    """
+    peaks = metrics.get_memory_peaks(device, ESTIMATE_WINDOW)
+    return {stage: int(peak * ESTIMATE_MARGIN) for stage, peak in peaks.items()}
+
+
+def get_remaining_peak(estimates, stage=None):
+    """
+    Gets the most memory the rest of a build can need
+
+    Args:
+        estimates: Stage estimates from `get_estimates`
+        stage:     The running stage, None if not started
+
+    Returns:
+        The bytes needed by the largest stage from this one on
+
+    """
+    stages = logstore.STAGES
+    if stage in stages:
+        stages = stages[stages.index(stage) :]
+    return max([estimates.get(name, 0) for name in stages], default=0)
+
+
+def _alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        # Someone else's process, but it exists
+        return True
+    return True
+
+
+@contextmanager
+def _locked_state():
+    """
+    Holds the host wide lock while the shared state is read and updated
+
+    Yields:
+        The state dictionary of pid to reservation, written back on exit
+
+    """
+    lock_dir = get_lock_dir()
+    with open(lock_dir / LOCK_FILE, "a") as lock:
+        try:
+            # Every user's builds need to take it
+            os.chmod(lock.name, 0o666)
+        except OSError:
+            pass
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        state_file = lock_dir / STATE_FILE
+        try:
+            state = json.loads(state_file.read_text())
+        except (OSError, ValueError):
+            state = {}
+        # Holders that died never released their memory
+        state = {pid: entry for pid, entry in state.items() if _alive(int(pid))}
+        yield state
+        tmp_file = state_file.with_name(f"{STATE_FILE}.{os.getpid()}")
+        tmp_file.write_text(json.dumps(state, indent=2))
+        tmp_file.chmod(0o666)
+        tmp_file.replace(state_file)
+
+
+class MemoryReservation:
+    """
+    Memory set aside on this host for one build, held while the build runs
+    """
+
+    def __init__(self, device, estimates, headroom_gb=2, enabled=True):
+        self.device = device
+        self.estimates = estimates
+        self.headroom = int(headroom_gb * GB)
+        self.enabled = enabled and fcntl is not None and bool(estimates)
+        self.pid = str(os.getpid())
+        self.reserved = get_remaining_peak(estimates)
+
+    def get_free(self, state):
+        """
+        Gets the memory that isn't in use or promised to another build
+
+        Args:
+            state: The shared state, see `_locked_state`
+
+        Returns:
+            Free bytes, None if unknown
+
+        """
+        available = procmon.get_available_memory()
+        if available is None:
+            return None
+        for pid, entry in state.items():
+            if pid == self.pid:
+                continue
+            # Whatever a build already uses is gone from MemAvailable
+            in_use = procmon.get_tree_rss(int(pid))
+            available -= max(0, entry["bytes"] - in_use)
+        return available
+
+    def acquire(self):
+        """
+        Waits until the host has room for the build, then reserves it
+
+        Returns:
+            None
+
+        """
+        if not self.enabled:
+            return
+        last_message = 0
+        while True:
+            with _locked_state() as state:
+                free = self.get_free(state)
+                others = [pid for pid in state if pid != self.pid]
+                # Nobody else to wait for, so waiting could never help
+                if free is None or not others or free >= self.reserved + self.headroom:
+                    state[self.pid] = {
+                        "device": self.device,
+                        "host": socket.gethostname(),
+                        "bytes": self.reserved,
+                        "ts": time.time(),
+                    }
+                    return
+            if time.time() - last_message >= WAIT_MESSAGE_SECONDS:
+                last_message = time.time()
+                warning(
+                    f"Waiting for {self.reserved / GB:.1f} GB of memory for {self.device}, "
+                    f"{max(free, 0) / GB:.1f} GB free with {len(others)} other builds running"
+                )
+            time.sleep(POLL_SECONDS)
+
+    def update(self, stage):
+        """
+        Shrinks the reservation to what the rest of the build needs
+
+        Args:
+            stage: The stage that just started
+
+        Returns:
+            None
+
+        """
+        if not self.enabled:
+            return
+        reserved = get_remaining_peak(self.estimates, stage)
+        if reserved == self.reserved:
+            return
+        self.reserved = reserved
+        with _locked_state() as state:
+            if self.pid in state:
+                state[self.pid]["bytes"] = reserved
+
+    def release(self):
+        if not self.enabled:
+            return
+        with _locked_state() as state:
+            state.pop(self.pid, None)
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, *exc):
+        self.release()
+
+
+def reserve(device, headroom_gb=2, enabled=True):
+    """
+    Gets a reservation sized from a device's earlier builds
+
+    Args:
+        device:      The device name
+        headroom_gb: Memory to always leave free, in GB
+        enabled:     Reserve at all, otherwise the reservation does nothing
+
+    Returns:
+        A MemoryReservation, use as a context manager
+
+    """
+    estimates = get_estimates(device) if enabled else {}
+    reservation = MemoryReservation(device, estimates, headroom_gb, enabled)
+    if reservation.enabled:
+        info(f"{device} is expected to need {reservation.reserved / GB:.1f} GB")
+    return reservation
@@ -34,9 +34,6 @@ General script for building FPGA designs
 
 """
 
-from manifest_reader.vivado_util import generate_filelist
-
-
 import subprocess
 import argparse
 from pathlib import Path
@@ -45,7 +42,6 @@ import socket
 import sys
 from pprint import pprint
 from os import environ
-import tarfile
 import platform
 
 from .utils import (
@@ -62,9 +58,28 @@ from .utils import (
     caller_dir,
     XILINX_BIN_EXTENSION,
     check_vitis,
-    check_output,
 )
 from . import deployer
+from .gitinfo import get_snapshot
+from . import scheduler
+from . import cache
+from . import stages
+from . import daemon
+from . import logstore
+from . import metrics
+from . import packager
+from . import toolchain
+from . import srcindex
+from . import vhdl_deps
+from . import filelists
+from . import tuning
+from . import admission
+from . import telemetry
+from . import tracing
+from . import progress
+from . import watchdog
+from . import preflight
+from . import hostlock
 import os
 
 THIS_DIR = Path(__file__).parent
@@ -83,6 +98,17 @@ ZYNQ_7020_2 = "xc7z020clg400-2"
 ZYNQ_7035_2 = "xc7z035fbg676-2"
 ZYNQ_7030_2 = "xc7z030fbg676-2"
 
+# Tried in this order when exploring with --impl-strategies N
+IMPL_STRATEGIES = [
+    "Performance_Explore",
+    "Performance_ExplorePostRoutePhysOpt",
+    "Performance_ExtraTimingOpt",
+    "Performance_NetDelay_high",
+    "Congestion_SpreadLogic_high",
+    "Performance_RefinePlacement",
+    "Performance_Retiming",
+]
+
 
 def build_default(
     device_names,
@@ -94,6 +120,7 @@ def build_default(
     other_files=None,
     and_tar=False,
     design_versions=None,
+    top_levels=None,
 ):
     """
     Parses arguments and runs the build on the selected device
@@ -107,6 +134,7 @@ def build_default(
         tcl_arg_dict:   tcl args to provide to each build
         deploy_hw_dirs: Dirs to put the deployment in, defaults to hw
         vivado_versions: Versions of vivado to use, defaults to 2019.1
+        top_levels:     Top level entities, used to prune other_files with --prune-sources
 
     """
     parser = get_parser(device_names)
@@ -143,7 +171,9 @@ def build_default(
         project = projects[0]
         open_vivado_gui(project, vivado_version, run_dir)
         exit()
-    clean, output = repo_clean()
+    run_trace = tracing.Tracer("fpga_builder")
+    with run_trace.span("repo_clean"):
+        clean, output = repo_clean()
     if not clean:
         if do_deploy and args.commit:
             err(
@@ -171,14 +201,15 @@ def build_default(
     if do_deploy:
         print(f"Deploying devices: {devices}")
 
+    proj_dir = caller_dir()
+    build_jobs = {}
     for device in devices:
         if do_build:
-            print(f"Building {device}...")
             run_tcl = tcl_scripts[device]
             if run_dirs:
                 run_dir = run_dirs[device]
             else:
-                run_dir = caller_dir() / "build" / device
+                run_dir = proj_dir / "build" / device
             if tcl_arg_dict:
                 tcl_args = tcl_arg_dict[device]
             else:
@@ -194,38 +225,102 @@ def build_default(
                 print(design_version)
             else:
                 design_version = "0.0.0.0"
-            build(
-                run_tcl,
-                args,
-                run_dir,
-                tcl_args,
-                vivado_version,
-                and_tar,
-                device,
+            build_jobs[device] = dict(
+                run_tcl=run_tcl,
+                run_dir=run_dir,
+                tcl_args=tcl_args,
+                vivado_version=vivado_version,
+                and_tar=and_tar,
+                device_name=device,
                 usr_access=usr_access,
                 design_version=design_version,
                 other_files=other_files,
-                proj_dir=caller_dir()
-            )
-        if do_deploy:
-            print(f"Deploying {device}...")
-            # Deploy stuff
-            if deploy_hw_dirs:
-                output_dir = deploy_hw_dirs[device]
-            else:
-                output_dir = None
-            if vivado_versions:
-                vivado_version = vivado_versions[device]
-            else:
-                vivado_version = None
-            deployer.deploy(
-                args,
-                device,
-                caller_dir(),
-                output_dir,
-                vivado_version=vivado_version,
+                proj_dir=proj_dir,
+                top_level=top_levels[device] if top_levels else None,
             )
 
+    if do_build and len(devices) > 1:
+        # Single builds already have their own trace
+        run_trace.path = get_run_trace_file(build_jobs.values())
+
+    with tracing.activate(run_trace):
+        if do_build and len(devices) > 1 and int(args.jobs) > 1:
+            # Build everything up front, then deploy whatever passed
+            with run_trace.span("build devices", jobs=int(args.jobs)):
+                results = scheduler.build_devices(list(build_jobs.values()), args)
+            # Each build was traced in its own worker process
+            for job in build_jobs.values():
+                run_trace.merge(job["run_dir"] / "output" / tracing.TRACE_FILE)
+            all_passed = scheduler.print_summary(results)
+            if do_deploy:
+                passed = [result["device"] for result in results if result["passed"]]
+                for device in devices:
+                    if device in passed:
+                        with run_trace.span(f"deploy {device}"):
+                            deploy_device(
+                                args, device, proj_dir, deploy_hw_dirs, vivado_versions
+                            )
+            if not all_passed:
+                exit(1)
+            return
+
+        for device in devices:
+            if do_build:
+                print(f"Building {device}...")
+                with tracing.span(f"build {device}"):
+                    build(args=args, **build_jobs[device])
+            if do_deploy:
+                with run_trace.span(f"deploy {device}"):
+                    deploy_device(
+                        args, device, proj_dir, deploy_hw_dirs, vivado_versions
+                    )
+
+
+def get_run_trace_file(jobs):
+    """
+    Gets where to put the trace of a run of several devices
+
+    Args:
+        jobs: The build job dictionaries of the run
+
+    Returns:
+        A Path next to the run directories, i.e. build/trace.json
+
+    """
+    run_dirs = [str(Path(job["run_dir"]).parent) for job in jobs]
+    return Path(os.path.commonpath(run_dirs)) / tracing.TRACE_FILE
+
+
+def deploy_device(args, device, proj_dir, deploy_hw_dirs=None, vivado_versions=None):
+    """
+    Deploys a single device that was built from proj_dir
+
+    Args:
+        args:            The arguments, at least from `get_parser().parse_args()`
+        device:          The device name to deploy
+        proj_dir:        The directory the build was run from
+        deploy_hw_dirs:  Dirs to put the deployment in, defaults to hw
+        vivado_versions: Versions of vivado to use, defaults to 2019.1
+
+    """
+    print(f"Deploying {device}...")
+    # Deploy stuff
+    if deploy_hw_dirs:
+        output_dir = deploy_hw_dirs[device]
+    else:
+        output_dir = None
+    if vivado_versions:
+        vivado_version = vivado_versions[device]
+    else:
+        vivado_version = None
+    deployer.deploy(
+        args,
+        device,
+        proj_dir,
+        output_dir,
+        vivado_version=vivado_version,
+    )
+
 
 def open_vivado_gui(project, vivado_version, run_dir):
     vivado_cmd = get_vivado_cmd(vivado_version)
@@ -244,7 +339,9 @@ def build(
     usr_access=0,
     design_version="0.0.0.0",
     other_files=None,
-    proj_dir=None
+    proj_dir=None,
+    log_prefix=None,
+    top_level=None,
 ):
     """
     R the build on the selected device
@@ -254,28 +351,63 @@ def build(
         args:           The arguments, at least from `get_parser().parse_args()`
         run_dir:        Optionally specify where to run the build
         vivado_version: Vivado version to use, defaults to 2019.1
+        log_prefix:     Optional string to put in front of each line of vivado output
+        top_level:      Top level entity, needed to prune other_files
 
     """
     if not run_dir:
         run_dir = Path(run_tcl).parent
-    run_vivado(
-        run_tcl,
-        run_dir,
-        args,
-        tcl_args,
-        vivado_version,
-        and_tar,
-        device_name,
-        usr_access,
-        design_version,
-        other_files=other_files,
-        proj_dir=proj_dir
-    )
-    stats = get_stats(run_dir, args.num_threads)
-    print(stats)
+    device = device_name or run_dir.name
+    # run_vivado picks the path once it has cleared the output directory
+    with tracing.trace(f"build {device}"):
+        with tracing.span("tune threads"):
+            args = tuning.resolve(args, device)
+        with tracing.span("run_vivado", device=device):
+            ran = run_vivado(
+                run_tcl,
+                run_dir,
+                args,
+                tcl_args,
+                vivado_version,
+                and_tar,
+                device_name,
+                usr_access,
+                design_version,
+                other_files=other_files,
+                proj_dir=proj_dir,
+                log_prefix=log_prefix,
+                top_level=top_level,
+            )
+        stats = get_stats(run_dir, args.num_threads)
+        print(stats)
+        partial = args.bd_only or args.synth_only or args.impl_only or args.incremental
+        if ran and not partial:
+            # Restored outputs would just repeat an earlier build, and partial or
+            # resumed builds would skew the baselines, thread choice and estimates
+            with tracing.span("record metrics"):
+                record_metrics(device, run_dir, args.num_threads)
     success("Done!")
 
 
+def record_metrics(device, run_dir, num_threads):
+    """
+    Stores the stats of a finished build and warns about any regressions
+
+    Args:
+        device:      The device name
+        run_dir:     The run directory of the build
+        num_threads: The number of threads the build used
+
+    """
+    try:
+        commit_hash = deployer.get_current_commit_hash()
+    except (subprocess.CalledProcessError, OSError):
+        commit_hash = None
+    stats_file = get_stats_file(run_dir, num_threads)
+    metrics.record_build(device, stats_file, num_threads, commit_hash)
+    metrics.check_regressions(device, num_threads)
+
+
 def set_bits(input, which_bits, val):
     if type(which_bits) is not tuple:
         # Tuplify bits
@@ -331,7 +463,9 @@ def run_vivado(
     usr_access=0,
     design_version="0.0.0.0",
     other_files=None,
-    proj_dir=None
+    proj_dir=None,
+    log_prefix=None,
+    top_level=None,
 ):
     """
     Runs vivado to run the build of the selected run directory
@@ -345,12 +479,14 @@ def run_vivado(
         impl_only:   Only implement, don't generate bitstream
         force:       Force delete of existing project
         version:     Vivado version to use, defaults to 2019.1
+        log_prefix:  Optional string to put in front of each line of output
+        top_level:   Top level entity, needed to prune other_files
 
     Raises:
         Exception if the build fails
 
     Returns:
-        None
+        True if vivado ran, False if the outputs were restored or up to date
 
     """
     if version is None:
@@ -358,17 +494,64 @@ def run_vivado(
     vivado_cmd = get_vivado_cmd(version)
     stats_file = get_stats_file(run_dir, build_args.num_threads)
     output_dir = run_dir / "output"
-    if run_dir.exists():
-        if not build_args.force:
-            err(f"{run_dir} already exists, provide --force to delete")
-            exit(1)
+    incremental = build_args.incremental
+    if run_dir.exists() and not incremental and not build_args.force:
+        err(f"{run_dir} already exists, provide --force to delete")
+        exit(1)
+    if other_files and build_args.prune_sources:
+        if top_level:
+            with tracing.span("prune sources"):
+                other_files = vhdl_deps.prune_other_files(other_files, [top_level])
+        else:
+            warning("WARNING: No top level given, not pruning sources")
+    if other_files and not build_args.no_preflight:
+        # Before anything is deleted, so a typo leaves the last build alone
+        with tracing.span("preflight"):
+            preflight.check(
+                other_files,
+                complete=proj_dir is None or not (proj_dir / "blocks.yaml").exists(),
+                vivado_cmd=vivado_cmd if build_args.preflight_xvhdl else None,
+            )
+    if run_dir.exists() and not incremental:
         shutil.rmtree(run_dir)
-    output_dir.mkdir(parents=True)
+    output_dir.mkdir(parents=True, exist_ok=True)
+    tracing.set_path(output_dir / tracing.TRACE_FILE)
     if other_files or (proj_dir / "blocks.yaml").exists():
         print("Doing a filelist", other_files, proj_dir)
-        generate_filelist(proj_dir, run_dir, other_files=other_files)
+        with tracing.span("generate filelist"):
+            filelists.generate(
+                proj_dir,
+                run_dir,
+                other_files=other_files,
+                use_cache=not build_args.no_cache,
+            )
     else:
         print("No file : ", proj_dir , "/blocks.yaml")
+    tcl_utils = THIS_DIR / "utils.tcl"
+    impl_strategies = get_impl_strategies(build_args)
+    stage_fingerprints = stages.get_fingerprints(
+        build_tcl,
+        tcl_utils,
+        run_dir / "filelist.tcl",
+        version,
+        tcl_args,
+        usr_access,
+        design_version,
+        impl_strategies,
+    )
+    wanted_stages = stages.get_completed_stages(build_args)
+    resume_stage = stages.STAGES[0]
+    if incremental:
+        resume_stage = stages.get_resume_stage(
+            run_dir, stage_fingerprints, wanted_stages
+        )
+        if resume_stage is None:
+            success(f"All stages of {run_dir} are up to date, nothing to build")
+            return False
+        info(f"Resuming {run_dir} from the {resume_stage} stage")
+        # Everything in here gets regenerated, don't leave stale outputs around
+        shutil.rmtree(output_dir)
+        output_dir.mkdir()
     log = output_dir / "vivado.log"
     version_file = output_dir / "version.txt"
 
@@ -377,9 +560,9 @@ def run_vivado(
     bd_only_arg = 1 if build_args.bd_only else 0
     synth_only_arg = 1 if build_args.synth_only else 0
     impl_only_arg = 1 if build_args.impl_only else 0
-    force_arg = 1 if build_args.force else 0
+    # Incremental builds may still need to recreate the project
+    force_arg = 1 if build_args.force or incremental else 0
     use_vitis_arg = check_vitis(version)
-    tcl_utils = THIS_DIR / "utils.tcl"
     environ["LD_PRELOAD"] = "/lib/x86_64-linux-gnu/libudev.so.1"
     default_args = [
         tcl_utils,
@@ -391,6 +574,9 @@ def run_vivado(
         force_arg,
         use_vitis_arg,
         usr_access,
+        resume_stage,
+        ",".join(impl_strategies) if impl_strategies else 0,
+        build_args.num_jobs or build_args.num_threads,
     ]
     default_args = [str(arg) for arg in default_args]
     args = []
@@ -414,37 +600,188 @@ def run_vivado(
     print("Running:", cmd_string)
     print(f"cwd will be {run_dir}")
 
+    console = logstore.ConsoleFilter(build_args.quiet, build_args.max_repeats)
+
     def line_handler(line):
-        if line.startswith("ERROR:"):
-            err(line)
-        if line.startswith("CRITICAL WARNING:"):
-            critical_warning(line)
-        elif line.startswith("WARNING:"):
-            warning(line)
-        else:
-            info(line)
+        log_index.add(line)
+        phases.update(line)
+        build_progress.update(log_index.tracker.stage)
+        shown = console.filter(line)
+        if shown is not None:
+            # Severity comes from the raw line, the prefix is just for display
+            text = log_prefix + shown if log_prefix else shown
+            if shown.startswith("ERROR:"):
+                err(text)
+            if shown.startswith("CRITICAL WARNING:"):
+                critical_warning(text)
+            elif shown.startswith("WARNING:"):
+                warning(text)
+            else:
+                info(text)
+        # After printing, so a fatal line shows before the watchdog's message
+        build_watchdog.feed(line, log_index.tracker.stage)
+
+    def on_start(pid):
+        sampler.attach(pid)
+        build_watchdog.attach(pid)
+
+    def run_one_shot():
+        # Killing a worker makes it look like it died, don't rerun the job
+        build_watchdog.raise_if_tripped()
+        return run_cmd(
+            cmd_string,
+            cwd=run_dir,
+            line_handler=line_handler,
+            on_start=on_start,
+        )
+
+    def run_vivado_cmd():
+        if not build_args.daemon:
+            return run_one_shot()
+        return daemon.run_job_or_fallback(
+            run_one_shot,
+            vivado_cmd,
+            script_path,
+            args,
+            run_dir,
+            line_handler=line_handler,
+            log=log,
+            on_start=on_start,
+            max_jobs=build_args.daemon_max_jobs,
+            max_rss_gb=build_args.daemon_max_mem,
+        )
 
-    run_cmd(cmd_string, cwd=run_dir, line_handler=line_handler)
     any_only = build_args.bd_only or build_args.synth_only or build_args.impl_only
-    if and_tar and not any_only:
-        pin_txt = get_changeset_numbers()
-        pin_file = output_dir / "pin.txt"
-        pin_file.write_text(pin_txt)
-        branch = (
-            deployer.get_current_branch()
-            if build_args.branch is None
-            else build_args.branch
+    # Partial builds aren't worth caching, only full outputs are restored
+    use_cache = not any_only and not build_args.no_cache
+    restored = False
+    if use_cache:
+        build_key = cache.get_build_key(
+            build_tcl,
+            tcl_utils,
+            run_dir / "filelist.tcl",
+            version,
+            tcl_args,
+            usr_access,
+            design_version,
+            impl_strategies,
+        )
+        with tracing.span("cache restore"):
+            restored = cache.restore(build_key, output_dir, stats_file)
+    if restored:
+        success("Build inputs unchanged, skipped vivado")
+    else:
+        # Project is in flux until vivado finishes, never resume from a failed build
+        stages.clear(run_dir)
+        log_index = logstore.LogIndex(output_dir / logstore.INDEX_FILE)
+        phases = tracing.VivadoPhases()
+        device = device_name or run_dir.name
+        reservation = admission.reserve(
+            device, build_args.mem_headroom, enabled=not build_args.no_mem_wait
+        )
+        # Follows vivado or its worker once started, not the python around it
+        sampler = telemetry.ResourceSampler(
+            None,
+            lambda: log_index.tracker.stage,
+            reservation.update,
+            build_args.telemetry_interval,
+        )
+        build_progress = progress.BuildProgress(
+            device,
+            progress.get_estimates(device, build_args.num_threads),
+            progress.get_expected_stages(
+                build_args, resume_stage if incremental else None
+            ),
+        )
+        monitor = progress.ProgressMonitor(
+            build_progress,
+            build_args.progress_interval,
+            enabled=not build_args.no_progress,
+        )
+        build_watchdog = watchdog.Watchdog(
+            run_dir,
+            build_args.fatal_id,
+            build_args.stall_timeout * 60,
+            watchdog.parse_stage_timeouts(build_args.stage_timeout),
         )
-        # Sad path noises
-        branch = branch.replace("/", "|")
-        tar_name = f"{get_app_name()}-{device_name}-{branch}.{deployer.get_current_commit_hash()[:8]}.tar.xz"
-        tar_target = output_dir / tar_name
+        try:
+            # Time in here outside the vivado span is spent waiting for the host
+            with tracing.span("run vivado"), hostlock.slot(
+                "vivado", build_args.max_vivado
+            ), reservation:
+                sampler.start()
+                monitor.start()
+                build_watchdog.start()
+                with tracing.span("vivado", cat="vivado"):
+                    run_vivado_cmd()
+        except Exception:
+            # Say why vivado died, not just its return code
+            build_watchdog.raise_if_tripped()
+            raise
+        finally:
+            build_watchdog.stop()
+            monitor.stop()
+            sampler.stop()
+            log_index.close()
+            phases.close()
+            hidden = console.get_hidden()
+            if hidden:
+                counts = ", ".join(f"[{key}] {count}" for key, count in hidden.items())
+                info(f"Repeated messages hidden from the console: {counts}")
+                info(
+                    f"List them with: python -m fpga_builder logs {output_dir} --id <id>"
+                )
+            if sampler.peaks:
+                metrics.record_memory(device, sampler.peaks)
+                info(f"Resource usage by stage:\n{sampler.save(output_dir)}")
+            build_watchdog.report(output_dir)
+        stages.save(run_dir, stage_fingerprints, wanted_stages)
+        if use_cache:
+            with tracing.span("cache store"):
+                cache.store(build_key, output_dir, stats_file, build_args.cache_size)
+    if and_tar and not any_only:
+        with tracing.span("git"):
+            pin_txt = get_changeset_numbers()
+            pin_file = output_dir / "pin.txt"
+            pin_file.write_text(pin_txt)
+            branch = (
+                deployer.get_current_branch()
+                if build_args.branch is None
+                else build_args.branch
+            )
+            # Sad path noises
+            branch = branch.replace("/", "|")
+            tar_name = f"{get_app_name()}-{device_name}-{branch}.{deployer.get_current_commit_hash()[:8]}"
         files = []
         for ext in (".rpt", ".hdf", ".xsa", ".bit", ".log", ".txt", ".ltx", ".json"):
             files.extend(list(output_dir.glob(f"*{ext}")))
-        with tarfile.open(tar_target, "w:xz") as tar:
-            for file in files:
-                tar.add(file, arcname=file.name)
+        with tracing.span("tar", files=len(files)):
+            packager.make_tarball(
+                files,
+                output_dir / tar_name,
+                build_args.tar_compression,
+                build_args.deterministic_tar,
+            )
+    return not restored
+
+
+def get_impl_strategies(build_args):
+    """
+    Gets the implementation strategies to explore alongside the default run
+
+    Args:
+        build_args: The arguments, at least from `get_build_parser().parse_args()`
+
+    Returns:
+        A list of strategy names, empty if not exploring
+
+    """
+    strategies = build_args.impl_strategies
+    if not strategies:
+        return []
+    if strategies.isdigit():
+        return IMPL_STRATEGIES[: int(strategies)]
+    return [strategy.strip() for strategy in strategies.split(",")]
 
 
 def get_app_name():
@@ -453,13 +790,7 @@ def get_app_name():
 
 
 def get_submodule_commits():
-    raw_output = check_output("git submodule status --recursive")
-    ret = {}
-    for line in raw_output.split("\n"):
-        line = line.strip()
-        commit, name, _ = line.split(" ")
-        ret[name] = commit
-    return ret
+    return dict(get_snapshot().submodule_commits)
 
 
 def get_changeset_numbers():
@@ -473,7 +804,7 @@ def get_changeset_numbers():
 def get_vivado_cmd(version):
     """
     Determines the command to be used to run the requested vivado version
-    Search order is PATH, FPGA_BUILDER_VIVADO_{VERSION}_INSTALL_DIR, default Xilinx Path
+    Search order is PATH, FPGA_BUILDER_VIVADO_{VERSION}_INSTALL_DIR, toolchain registry
     {VERSION} for "2019.1" would be "2019_1"
 
     Args:
@@ -507,9 +838,9 @@ def get_vivado_cmd(version):
             )
             exit(1)
 
-    # Last chance, try guessing off the usual install path
-    vivado_cmd = Path(f"C:/Xilinx/Vivado/{version}/bin/vivado{XILINX_BIN_EXTENSION}")
-    if vivado_cmd.exists():
+    # Last chance, look through the usual install paths
+    vivado_cmd = toolchain.find_tool("vivado", version)
+    if vivado_cmd is not None:
         return vivado_cmd
 
     # Couldn't find anything, die :(
@@ -628,7 +959,34 @@ def _add_build_args(parser):
         "-p",
         "--num-threads",
         default=5,
-        help="The number of threads to use for the test(s)",
+        help="The number of threads to use for the test(s), "
+        "or auto to pick from the cores, memory and other builds on this host",
+    )
+    group.add_argument(
+        "--num-jobs",
+        default=None,
+        type=int,
+        help="The number of runs vivado launches at once, defaults to the thread count",
+    )
+    group.add_argument(
+        "--learn-threads",
+        default=False,
+        action="store_true",
+        help="With --num-threads auto, use the thread count that has built each "
+        "device fastest on this host",
+    )
+    group.add_argument(
+        "-j",
+        "--jobs",
+        default=1,
+        type=int,
+        help="The number of devices to build at once when building all",
+    )
+    group.add_argument(
+        "--total-threads",
+        default=None,
+        type=int,
+        help="Threads shared between all concurrent builds, defaults to the number of cores",
     )
     group.add_argument(
         "--bd-only",
@@ -655,6 +1013,147 @@ def _add_build_args(parser):
         action="store_true",
         help="Force delete of existing project",
     )
+    group.add_argument(
+        "-i",
+        "--incremental",
+        default=False,
+        action="store_true",
+        help="Reuse an existing project, rerunning only the stages whose inputs changed",
+    )
+    group.add_argument(
+        "--daemon",
+        default=False,
+        action="store_true",
+        help="Run builds in a long lived vivado worker instead of starting vivado for each",
+    )
+    group.add_argument(
+        "--daemon-max-jobs",
+        default=10,
+        type=int,
+        help="Restart a vivado worker after it has run this many builds",
+    )
+    group.add_argument(
+        "--daemon-max-mem",
+        default=None,
+        type=float,
+        help="Restart a vivado worker once it uses more than this many GB",
+    )
+    group.add_argument(
+        "--prune-sources",
+        default=False,
+        action="store_true",
+        help="Only pass vivado the VHDL sources the top level needs, in compile order",
+    )
+    group.add_argument(
+        "--max-vivado",
+        default=None,
+        type=int,
+        help="Most vivado builds to run at once on this host, across every builder, "
+        "defaults to FPGA_BUILDER_MAX_VIVADO or unlimited",
+    )
+    group.add_argument(
+        "--no-mem-wait",
+        default=False,
+        action="store_true",
+        help="Start vivado right away, even if other builds on this host need the memory",
+    )
+    group.add_argument(
+        "--mem-headroom",
+        default=2,
+        type=float,
+        help="GB of memory to leave free when waiting for other builds",
+    )
+    group.add_argument(
+        "-q",
+        "--quiet",
+        default=False,
+        action="store_true",
+        help="Only show vivado's warnings and errors, the full log is still in vivado.log",
+    )
+    group.add_argument(
+        "--max-repeats",
+        default=100,
+        type=int,
+        help="Stop showing a vivado message ID after this many, 0 for no limit",
+    )
+    group.add_argument(
+        "--no-preflight",
+        default=False,
+        action="store_true",
+        help="Don't check the VHDL sources before clearing the last build and starting vivado",
+    )
+    group.add_argument(
+        "--preflight-xvhdl",
+        default=False,
+        action="store_true",
+        help="Also analyze changed VHDL sources with xvhdl before the build",
+    )
+    group.add_argument(
+        "--fatal-id",
+        default=None,
+        action="append",
+        help="Kill vivado as soon as it logs this message ID, i.e. 'Synth 8-439', can be repeated",
+    )
+    group.add_argument(
+        "--stall-timeout",
+        default=0,
+        type=float,
+        help="Kill vivado after this many minutes without output from it or its runs, 0 to wait forever",
+    )
+    group.add_argument(
+        "--stage-timeout",
+        default=None,
+        action="append",
+        help="Kill vivado if a stage runs longer than this, i.e. 'impl=120' in minutes, can be repeated",
+    )
+    group.add_argument(
+        "--no-progress",
+        default=False,
+        action="store_true",
+        help="Don't show build progress and the time left",
+    )
+    group.add_argument(
+        "--progress-interval",
+        default=progress.LINE_SECONDS,
+        type=float,
+        help="Seconds between progress lines when not on a terminal, i.e. in CI",
+    )
+    group.add_argument(
+        "--telemetry-interval",
+        default=telemetry.SAMPLE_SECONDS,
+        type=float,
+        help="Seconds between samples of vivado's CPU, memory and disk usage",
+    )
+    group.add_argument(
+        "--no-cache",
+        default=False,
+        action="store_true",
+        help="Always run vivado and regenerate the filelist, even if cached with these exact inputs",
+    )
+    group.add_argument(
+        "--cache-size",
+        default=20,
+        type=float,
+        help="Size in GB the build cache is trimmed to, least recently used first",
+    )
+    group.add_argument(
+        "--tar-compression",
+        default="xz",
+        choices=list(packager.COMPRESSORS),
+        help="Compression for the release tarball",
+    )
+    group.add_argument(
+        "--deterministic-tar",
+        default=False,
+        action="store_true",
+        help="Normalize timestamps and owners so identical outputs make identical tarballs",
+    )
+    group.add_argument(
+        "--impl-strategies",
+        default=None,
+        help="Also implement with these comma separated strategies (or place:<directive>), "
+        "or the first N of a built in list, and keep the run that meets timing first",
+    )
     group.add_argument(
         "--gui",
         default=False,
@@ -686,16 +1185,13 @@ def get_other_files(from_dir, already_have=None, recursive=True, files_93=None):
     if not from_dir.exists():
         err(f"{from_dir} does not exist!")
         exit(1)
-    search_func = from_dir.rglob if recursive else from_dir.glob
     files = already_have["vhdl"] if already_have else {}
-    for file in search_func("*.vhd"):
-        lib_name = file.parent.name
-        if lib_name == "dsn":
-            lib_name = file.parents[2].name
+    # Same normalization as the index, .. included
+    abs_dir = os.path.abspath(from_dir)
+    for path, lib_name, standard, _, _ in srcindex.get_sources(from_dir, recursive):
+        file = from_dir / Path(path).relative_to(abs_dir)
         if files_93 and file.name in files_93:
             standard = "VHDL"
-        else:
-            standard = "VHDL 2008"
         file_obj = (file, standard)
         if lib_name not in files:
             files[lib_name] = []
@@ -732,12 +1228,61 @@ def build_block(
     Returns:
         None
 
+    """
+    parser = get_build_parser()
+    args = parser.parse_args()
+    # Don't generate a bitstream since this is just for checking stuff
+    args.impl_only = True
+    job = prepare_block(
+        blk_dir,
+        top_level,
+        constraints,
+        other_files,
+        device,
+        generics,
+        vivado_version,
+        board,
+        bd_file,
+        top,
+        ip_repo,
+    )
+    build(args=args, **job)
+
+
+def prepare_block(
+    blk_dir,
+    top_level=None,
+    constraints=None,
+    other_files=None,
+    device=None,
+    generics=None,
+    vivado_version=None,
+    board=None,
+    bd_file=None,
+    top=None,
+    ip_repo=None,
+    name=None,
+    build_dir=None,
+):
+    """
+    Sets up the build of a block without running it, see `build_block` for the args
+
+    Args:
+        name:      Name of the build, the block directory name by default
+        build_dir: Where to build, scratch/build/<name> under BASE_DIR by default
+
+    Returns:
+        A dictionary of keyword arguments to `build`
+
     """
 
     if device is None:
         device = ZYNQ_7020_2
+    if name is None:
+        name = blk_dir.name
 
-    build_dir = BASE_DIR / "scratch/build" / blk_dir.name
+    if build_dir is None:
+        build_dir = BASE_DIR / "scratch/build" / name
     if top_level:
         dsn_files = [top_level]
     else:
@@ -748,7 +1293,6 @@ def build_block(
     other_files = {"vhdl": {"work": dsn_file_tuples}}
     if constraints:
         other_files["xdc"] = constraints
-    generate_filelist(BASE_DIR, build_dir, other_files=other_files)
 
     if generics is None:
         num_generics = 0
@@ -771,10 +1315,15 @@ def build_block(
         num_generics,
         *generics_pairs,
     ]
-    parser = get_build_parser()
-    args = parser.parse_args()
-    # Don't generate a bitstream since this is just for checking stuff
-    args.impl_only = True
-    build(
-        BUILD_BLK_TCL_SCRIPT, args, build_dir, tcl_args, vivado_version=vivado_version
+    # The filelist is generated by run_vivado, after any old build dir is cleaned
+    return dict(
+        run_tcl=BUILD_BLK_TCL_SCRIPT,
+        run_dir=build_dir,
+        tcl_args=tcl_args,
+        vivado_version=vivado_version,
+        device_name=name,
+        other_files=other_files,
+        proj_dir=BASE_DIR,
+        # utils.tcl falls back to an entity called top
+        top_level=top if top else "top",
     )
@@ -0,0 +1,339 @@
+# Copyright (c) 2022, Intrepid Control Systems, Inc.
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice, this
+#    list of conditions and the following disclaimer.
+#
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+#    this list of conditions and the following disclaimer in the documentation
+#    and/or other materials provided with the distribution.
+#
+# 3. Neither the name of the copyright holder nor the names of its
+#    contributors may be used to endorse or promote products derived from
+#    this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+# OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+
+"""
+Copyright 2022 Intrepid Control Systems
+
+Content addressed cache of build outputs
+Lets an unchanged build restore its output directory instead of rerunning vivado
+
+"""
+
+import hashlib
+import json
+import os
+import re
+import shutil
+import time
+from pathlib import Path
+from os import environ
+
+from .utils import get_data_dir, info, print
+
+# Bump when the key contents change so old entries are never hit
+CACHE_FORMAT = 2
+
+# Same set of files that gets packed into the release tarball, plus the log index
+CACHED_EXTENSIONS = (
+    ".rpt",
+    ".hdf",
+    ".xsa",
+    ".bit",
+    ".log",
+    ".txt",
+    ".ltx",
+    ".json",
+    ".db",
+)
+
+ENTRY_FILE = "entry.json"
+
+# A file changed this recently could change again within the same mtime tick,
+# so its digest isn't kept
+RACY_SECONDS = 2
+
+# Digests of the files hashed so far in this run, keyed on path, size and mtime
+_digests = {}
+
+TCL_TOKEN_RE = re.compile(r'"([^"$\[\]]+)"|\{([^{}$\[\]]+)\}|([^\s"{}$\[\];]+)')
+
+
+def get_cache_dir():
+    """
+    Gets the directory build outputs are cached in
+    Defaults to the cache folder in the data dir, override with FPGA_BUILDER_CACHE_DIR
+
+    Returns:
+        A Path to the cache directory
+
+    """
+    if "FPGA_BUILDER_CACHE_DIR" in environ:
+        cache_dir = Path(environ["FPGA_BUILDER_CACHE_DIR"])
+    else:
+        cache_dir = get_data_dir() / "cache"
+    cache_dir.mkdir(parents=True, exist_ok=True)
+    return cache_dir
+
+
+def hash_file(path, hasher=None):
+    """
+    Hashes the contents of a file without reading it all in at once
+
+    Args:
+        path:   The file to hash
+        hasher: Optional hashlib object to update, a new sha256 if None
+
+    Returns:
+        The hasher, updated with the file contents
+
+    """
+    if hasher is None:
+        hasher = hashlib.sha256()
+    with open(path, "rb") as file:
+        for chunk in iter(lambda: file.read(1024 * 1024), b""):
+            hasher.update(chunk)
+    return hasher
+
+
+def get_digest(path):
+    """
+    Gets the sha256 of a file's contents, only hashing each version of it once per run
+    The stage fingerprints, build key and preflight all hash the same sources
+
+    Args:
+        path: The file to hash
+
+    Returns:
+        The hex digest
+
+    """
+    stat = os.stat(path)
+    key = (os.path.abspath(path), stat.st_size, stat.st_mtime_ns)
+    digest = _digests.get(key)
+    if digest is None:
+        digest = hash_file(path).hexdigest()
+        if time.time_ns() - stat.st_mtime_ns >= RACY_SECONDS * 1e9:
+            _digests[key] = digest
+    return digest
+
+
+def get_referenced_files(tcl_file, seen=None):
+    """
+    Finds every existing file a tcl script mentions, following referenced tcl scripts
+    Only literal paths can be found, anything built from tcl variables other than
+    $origin_dir is invisible here
+
+    Args:
+        tcl_file: The tcl script to scan
+        seen:     Set of files already found, used when recursing
+
+    Returns:
+        A set of resolved Paths
+
+    """
+    if seen is None:
+        seen = set()
+    tcl_file = Path(tcl_file).resolve()
+    if not tcl_file.is_file():
+        return seen
+    script_dir = tcl_file.parent
+    text = tcl_file.read_text(errors="replace")
+    # Vivado generated scripts build everything off of origin_dir
+    text = re.sub(r"\$\{?origin_dir\}?", script_dir.as_posix(), text)
+    for match in TCL_TOKEN_RE.finditer(text):
+        token = next(group for group in match.groups() if group)
+        if "/" not in token and "." not in token:
+            # Can't be a file, save a stat
+            continue
+        path = Path(token)
+        if not path.is_absolute():
+            path = script_dir / path
+        try:
+            if not path.is_file():
+                continue
+        except OSError:
+            continue
+        path = path.resolve()
+        if path in seen:
+            continue
+        seen.add(path)
+        if path.suffix == ".tcl":
+            get_referenced_files(path, seen)
+    return seen
+
+
+def get_build_key(
+    build_tcl,
+    utils_tcl,
+    filelist,
+    vivado_version,
+    tcl_args,
+    usr_access,
+    design_version,
+    impl_strategies=None,
+):
+    """
+    Fingerprints everything that feeds a build
+
+    Args:
+        build_tcl:      The top level tcl script for the build
+        utils_tcl:      The utils.tcl used by the build
+        filelist:       The generated filelist.tcl, may not exist
+        vivado_version: The vivado version string
+        tcl_args:       The user tcl args given to the build
+        usr_access:     The USR_ACCESS value for the bitstream
+        design_version: The design version string
+        impl_strategies: Extra implementation strategies being explored
+
+    Returns:
+        A hex digest identifying the build
+
+    """
+    hasher = hashlib.sha256()
+    header = [
+        CACHE_FORMAT,
+        vivado_version,
+        [str(arg) for arg in tcl_args or []],
+        str(usr_access),
+        design_version,
+    ]
+    if impl_strategies:
+        header.append(impl_strategies)
+    hasher.update(json.dumps(header).encode())
+    scripts = [Path(build_tcl), Path(utils_tcl), Path(filelist)]
+    files = set()
+    for script in scripts:
+        if script.exists():
+            files.add(script.resolve())
+            get_referenced_files(script, files)
+    for arg in tcl_args or []:
+        path = Path(str(arg))
+        if path.is_file():
+            files.add(path.resolve())
+    for path in sorted(files):
+        hasher.update(path.as_posix().encode() + b"\0")
+        hasher.update(get_digest(path).encode())
+    return hasher.hexdigest()
+
+
+def restore(key, output_dir, stats_file):
+    """
+    Restores cached outputs for a build into its output directory
+
+    Args:
+        key:        Build key from `get_build_key`
+        output_dir: The output directory of the build
+        stats_file: The stats file this build is expected to produce
+
+    Returns:
+        True if the build was restored, False if it wasn't cached
+
+    """
+    entry_dir = get_cache_dir() / key
+    entry_file = entry_dir / ENTRY_FILE
+    if not entry_file.exists():
+        return False
+    entry = json.loads(entry_file.read_text())
+    for name in entry["files"]:
+        shutil.copy2(entry_dir / name, output_dir / name)
+    stats_file = Path(stats_file)
+    if not stats_file.exists() and entry["stats_file"]:
+        # Cached from another host or thread count, still the same results
+        shutil.copy2(entry_dir / entry["stats_file"], stats_file)
+    # Mark as recently used for eviction
+    os.utime(entry_file)
+    info(f"Restored {len(entry['files'])} files from build cache {key[:12]}")
+    return True
+
+
+def store(key, output_dir, stats_file, max_size_gb):
+    """
+    Stores the outputs of a finished build in the cache, then trims the cache
+
+    Args:
+        key:         Build key from `get_build_key`
+        output_dir:  The output directory of the build
+        stats_file:  The stats file the build produced
+        max_size_gb: Size the cache is trimmed to, in GB
+
+    Returns:
+        None
+
+    """
+    cache_dir = get_cache_dir()
+    entry_dir = cache_dir / key
+    if (entry_dir / ENTRY_FILE).exists():
+        return
+    tmp_dir = cache_dir / f"{key}.tmp{os.getpid()}"
+    if tmp_dir.exists():
+        shutil.rmtree(tmp_dir)
+    tmp_dir.mkdir()
+    files = []
+    size = 0
+    for file in sorted(output_dir.iterdir()):
+        if file.is_file() and file.suffix in CACHED_EXTENSIONS:
+            shutil.copy2(file, tmp_dir / file.name)
+            files.append(file.name)
+            size += file.stat().st_size
+    stats_name = Path(stats_file).name
+    entry = {
+        "files": files,
+        "size": size,
+        "created": time.time(),
+        "stats_file": stats_name if stats_name in files else None,
+    }
+    # Entry file goes last so a half written entry is never used
+    (tmp_dir / ENTRY_FILE).write_text(json.dumps(entry, indent=2))
+    try:
+        tmp_dir.rename(entry_dir)
+    except OSError:
+        # Someone else stored the same build first
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+    evict(max_size_gb)
+
+
+def evict(max_size_gb):
+    """
+    Removes the least recently used cache entries until the cache fits
+
+    Args:
+        max_size_gb: Size to trim the cache to, in GB
+
+    Returns:
+        None
+
+    """
+    max_size = int(max_size_gb * 1024**3)
+    entries = []
+    total = 0
+    for entry_file in get_cache_dir().glob(f"*/{ENTRY_FILE}"):
+        try:
+            size = json.loads(entry_file.read_text())["size"]
+            last_used = entry_file.stat().st_mtime
+        except (OSError, ValueError, KeyError):
+            continue
+        entries.append((last_used, size, entry_file.parent))
+        total += size
+    entries.sort()
+    for _, size, entry_dir in entries:
+        if total <= max_size:
+            break
+        print(f"Evicting {entry_dir.name[:12]} from build cache")
+        shutil.rmtree(entry_dir, ignore_errors=True)
+        total -= size
@@ -0,0 +1,295 @@
+# Copyright (c) 2022, Intrepid Control Systems, Inc.
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice, this
+#    list of conditions and the following disclaimer.
+#
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+#    this list of conditions and the following disclaimer in the documentation
+#    and/or other materials provided with the distribution.
+#
+# 3. Neither the name of the copyright holder nor the names of its
+#    contributors may be used to endorse or promote products derived from
+#    this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+# OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+
+"""
+Copyright 2022 Intrepid Control Systems
+
+Long lived vivado workers, so back to back builds don't each pay for tool startup
+Each worker runs worker.tcl and takes one job at a time over its stdin
+
+"""
+
+import atexit
+import re
+import shlex
+import subprocess
+import threading
+from os import environ
+
+from .utils import FILE_DIR, warning, info, print
+from .procmon import get_tree_rss
+
+WORKER_TCL = FILE_DIR / "worker.tcl"
+
+READY_MARKER = "FPGA_BUILDER_WORKER_READY"
+DONE_MARKER = "FPGA_BUILDER_JOB_DONE"
+
+# Set to something like "tclsh {worker}" to stand in for vivado
+WORKER_CMD_ENV_VAR = "FPGA_BUILDER_WORKER_CMD"
+
+_pool_lock = threading.Lock()
+_pool = {}
+
+
+class WorkerError(Exception):
+    """The worker died or never came up, the job can be rerun one-shot"""
+
+
+def tcl_quote(value):
+    """
+    Quotes a string so it is a single element of a tcl list
+
+    Args:
+        value: The string to quote
+
+    Returns:
+        The quoted string
+
+    """
+    if value == "":
+        return "{}"
+    return re.sub(r'([\\{}\[\]$";\s])', r"\\\1", value)
+
+
+class VivadoWorker:
+    """
+    A single vivado process running jobs one at a time
+    Restarts itself after max_jobs jobs, or once its memory passes max_rss_gb
+    """
+
+    def __init__(self, vivado_cmd, max_jobs=10, max_rss_gb=None):
+        self.vivado_cmd = vivado_cmd
+        self.max_jobs = max_jobs
+        self.max_rss_gb = max_rss_gb
+        self.process = None
+        self.num_jobs = 0
+        self.busy = False
+
+    def get_cmd(self):
+        """
+        Gets the command that starts the worker
+
+        Returns:
+            The command as a list
+
+        """
+        if WORKER_CMD_ENV_VAR in environ:
+            cmd = environ[WORKER_CMD_ENV_VAR].replace("{worker}", str(WORKER_TCL))
+            return shlex.split(cmd)
+        return [
+            str(self.vivado_cmd),
+            "-mode",
+            "batch",
+            "-notrace",
+            "-nojournal",
+            "-nolog",
+            "-source",
+            str(WORKER_TCL),
+        ]
+
+    def start(self):
+        cmd = self.get_cmd()
+        info(f"Starting vivado worker: {' '.join(cmd)}")
+        try:
+            self.process = subprocess.Popen(
+                cmd,
+                stdin=subprocess.PIPE,
+                stdout=subprocess.PIPE,
+                stderr=subprocess.STDOUT,
+                bufsize=1,
+                universal_newlines=True,
+            )
+        except OSError as e:
+            raise WorkerError(f"Could not start worker: {e}")
+        for line in self.process.stdout:
+            if line.strip() == READY_MARKER:
+                self.num_jobs = 0
+                return
+        self.stop()
+        raise WorkerError("Worker exited before it was ready")
+
+    def stop(self):
+        if self.process is None:
+            return
+        try:
+            if self.process.poll() is None:
+                self.process.stdin.write("quit\n")
+                self.process.stdin.flush()
+                self.process.wait(timeout=60)
+        except (OSError, subprocess.TimeoutExpired):
+            self.process.kill()
+            self.process.wait()
+        self.process = None
+
+    def alive(self):
+        return self.process is not None and self.process.poll() is None
+
+    def needs_restart(self):
+        if not self.alive():
+            return True
+        if self.num_jobs >= self.max_jobs:
+            info(f"Worker ran {self.num_jobs} jobs, restarting")
+            return True
+        if self.max_rss_gb:
+            rss_gb = get_tree_rss(self.process.pid) / 1024**3
+            if rss_gb > self.max_rss_gb:
+                info(f"Worker is using {rss_gb:.1f} GB, restarting")
+                return True
+        return False
+
+    def run_job(
+        self, script, tcl_args, cwd, line_handler=None, log=None, on_start=None
+    ):
+        """
+        Runs a tcl script in the worker as if it were `vivado -mode batch -source`
+
+        Args:
+            script:       The tcl script to source
+            tcl_args:     List of arguments the script sees in argv
+            cwd:          The directory to run the script from
+            line_handler: Function of a string that is each line.  If not provided, just prints output
+            log:          Optional path to write the output of the job to
+            on_start:     Optional function of the worker's pid, called before the job is sent
+
+        Raises:
+            WorkerError if the worker died, Exception if the job failed
+
+        Returns:
+            0
+        """
+        if self.needs_restart():
+            self.stop()
+            self.start()
+        if on_start is not None:
+            on_start(self.process.pid)
+        job = [str(cwd), str(script)] + [str(arg) for arg in tcl_args]
+        log_file = open(log, "w") if log else None
+        rc = None
+        try:
+            self.process.stdin.write(" ".join(tcl_quote(item) for item in job) + "\n")
+            self.process.stdin.flush()
+            for line in self.process.stdout:
+                line = line.rstrip("\r\n")
+                if line.startswith(DONE_MARKER):
+                    rc = int(line.split()[1])
+                    break
+                if log_file:
+                    log_file.write(line + "\n")
+                if line_handler:
+                    line_handler(line)
+                else:
+                    print(line)
+        except OSError as e:
+            raise WorkerError(f"Lost worker: {e}")
+        finally:
+            if log_file:
+                log_file.close()
+        if rc is None:
+            self.stop()
+            raise WorkerError("Worker exited in the middle of a job")
+        self.num_jobs += 1
+        if rc != 0:
+            raise Exception(f"""
+      script: {script}
+      cwd:    {cwd}
+      rc:     {rc}
+    """)
+        return 0
+
+
+def run_job(
+    vivado_cmd,
+    script,
+    tcl_args,
+    cwd,
+    line_handler=None,
+    log=None,
+    on_start=None,
+    **kwargs,
+):
+    """
+    Runs a job on an idle worker for this vivado, starting one if all are busy
+
+    Args:
+        vivado_cmd:   The vivado command the worker should run
+        script:       The tcl script to source
+        tcl_args:     List of arguments the script sees in argv
+        cwd:          The directory to run the script from
+        line_handler: Function of a string that is each line
+        log:          Optional path to write the output of the job to
+        on_start:     Optional function of the worker's pid, called before the job is sent
+        kwargs:       max_jobs and max_rss_gb for new workers
+
+    Raises:
+        WorkerError if no worker could run the job, Exception if the job failed
+
+    Returns:
+        0
+    """
+    with _pool_lock:
+        workers = _pool.setdefault(str(vivado_cmd), [])
+        idle = [worker for worker in workers if not worker.busy]
+        if idle:
+            worker = idle[0]
+        else:
+            worker = VivadoWorker(vivado_cmd, **kwargs)
+            workers.append(worker)
+        worker.busy = True
+    try:
+        return worker.run_job(script, tcl_args, cwd, line_handler, log, on_start)
+    finally:
+        worker.busy = False
+
+
+def run_job_or_fallback(fallback, *args, **kwargs):
+    """
+    Runs a job on a worker, or calls fallback if the worker couldn't run it
+
+    Args:
+        fallback: Function of no arguments that runs the job one-shot
+        args:     Arguments to `run_job`
+        kwargs:   Keyword arguments to `run_job`
+
+    Returns:
+        Whatever the worker or fallback returned
+    """
+    try:
+        return run_job(*args, **kwargs)
+    except WorkerError as e:
+        warning(f"WARNING: Vivado worker failed ({e}), running one-shot instead")
+        return fallback()
+
+
+@atexit.register
+def stop_all():
+    with _pool_lock:
+        for workers in _pool.values():
+            for worker in workers:
+                worker.stop()
+        _pool.clear()
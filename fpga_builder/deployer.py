@@ -50,9 +50,11 @@ from .utils import (
     err,
     print,
     XILINX_BIN_EXTENSION,
-    check_output,
     check_vitis,
 )
+from .gitinfo import get_snapshot, clear_snapshots
+from . import toolchain
+from . import hostlock
 
 SDK_DEPLOY_SCRIPT = FILE_DIR / "../sdk_deploy.tcl"
 VITIS_DEPLOY_SCRIPT = FILE_DIR / "../vitis_deploy.tcl"
@@ -156,9 +158,11 @@ def deploy_(
                 silent=False,
             )
         run_cmd(f'git commit -m "{msg}"', cwd=checkout_dir)
+        # That repo has a new commit now
+        clear_snapshots()
         if for_gitlab:
             run_cmd(f"git push", cwd=checkout_dir)
-    elif not repo_clean():
+    elif not repo_clean()[0]:
         print(
             "****WARNING: REPO NOT CLEAN, THIS SHOULD NOT BE THE OFFICIAL MR BUILD****"
         )
@@ -186,8 +190,7 @@ def get_current_branch(for_gitlab=False, cwd=None):
     if for_gitlab:
         branch = environ.get("CI_COMMIT_BRANCH")
     else:
-        branch = check_output("git rev-parse --abbrev-ref HEAD", cwd=cwd)
-        branch = branch.strip().replace("\n", "")
+        branch = get_snapshot(cwd).branch
     return branch
 
 
@@ -202,9 +205,7 @@ def get_current_commit_hash():
         The commit hash
 
     """
-    hash = check_output("git log --pretty=format:'%H' -n 1")
-    hash = hash.replace("'", "")
-    return hash
+    return get_snapshot().commit_hash
 
 
 def get_remote_url():
@@ -218,8 +219,7 @@ def get_remote_url():
         The remote url in the form git@host:group/repo.git
 
     """
-    url = check_output("git config --get remote.origin.url")
-    return url
+    return get_snapshot().remote_url
 
 
 def get_git_root_directory(cwd=None):
@@ -233,8 +233,7 @@ def get_git_root_directory(cwd=None):
         The root directory
 
     """
-    path = check_output("git rev-parse --show-toplevel", cwd=cwd)
-    return Path(path)
+    return get_snapshot(cwd).root
 
 
 def get_current_commit_url():
@@ -283,7 +282,9 @@ def run_sdk(script, tcl_args=None, version=None):
     else:
         args_string = ""
     cmd = f"{xsct_cmd} {script} {args_string}"
-    run_cmd(cmd)
+    # Limited by FPGA_BUILDER_MAX_XSCT across every builder on this host
+    with hostlock.slot("xsct"):
+        run_cmd(cmd)
 
 
 def get_xsct_cmd(version):
@@ -308,14 +309,9 @@ def get_xsct_cmd(version):
             )
             exit(1)
 
-    # Last chance, try guessing off the usual install path
-    xsct_cmd = Path(f"C:/Xilinx/SDK/{version}/bin/xsct{XILINX_BIN_EXTENSION}")
-    if xsct_cmd.exists():
-        return xsct_cmd
-
-    # Last chance, try guessing off the usual install path
-    xsct_cmd = Path(f"C:/Xilinx/Vitis/{version}/bin/xsct{XILINX_BIN_EXTENSION}")
-    if xsct_cmd.exists():
+    # Last chance, look through the usual install paths for SDK or Vitis
+    xsct_cmd = toolchain.find_tool("xsct", version)
+    if xsct_cmd is not None:
         return xsct_cmd
 
     # Couldn't find anything, die :(
@@ -342,9 +338,7 @@ def verify_branch(this_dir, deploy_dir):
 
 
 def get_git_root_dir(dir):
-    cmd = "git rev-parse --show-toplevel"
-    output = check_output(cmd, cwd=dir)
-    return output
+    return str(get_snapshot(dir).root)
 
 
 def get_parser():
@@ -0,0 +1,177 @@
+# Copyright (c) 2022, Intrepid Control Systems, Inc.
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice, this
+#    list of conditions and the following disclaimer.
+#
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+#    this list of conditions and the following disclaimer in the documentation
+#    and/or other materials provided with the distribution.
+#
+# 3. Neither the name of the copyright holder nor the names of its
+#    contributors may be used to endorse or promote products derived from
+#    this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+# OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+"""
+Copyright 2022 Intrepid Control Systems
+
+Builds many blocks at once and tabulates the results
+i.e. `python -m fpga_builder blocks blocks.json -j 4`
+
+"""
+
+import copy
+import json
+from pathlib import Path
+
+from .utils import err, success, print
+from . import builder
+from . import metrics
+from . import scheduler
+
+# Block keys holding a path or list of paths, relative to the blocks file
+PATH_KEYS = ["blk_dir", "top_level", "bd_file", "ip_repo", "build_dir"]
+PATH_LIST_KEYS = ["constraints", "other_files"]
+
+RESULT_STATS = ["worst_slack", "lut_util", "ram_util"]
+
+
+def load_blocks(blocks_file):
+    """
+    Reads a list of blocks to build from a json file
+    Each block is a dictionary of `builder.prepare_block` arguments, i.e.
+    {"blk_dir": "ip/fifo", "top_level": "ip/fifo/top.vhd", "generics": {"DEPTH": 16}}
+
+    Args:
+        blocks_file: The json file
+
+    Returns:
+        A list of block dictionaries with paths resolved
+
+    """
+    blocks_file = Path(blocks_file)
+    blocks = json.loads(blocks_file.read_text())
+    base_dir = blocks_file.parent.resolve()
+    for block in blocks:
+        for key in PATH_KEYS:
+            if block.get(key) is not None:
+                block[key] = base_dir / block[key]
+        for key in PATH_LIST_KEYS:
+            if block.get(key) is not None:
+                block[key] = [base_dir / path for path in block[key]]
+    return blocks
+
+
+def build_blocks(blocks, args):
+    """
+    Builds blocks through implementation, `args.jobs` at a time
+    With `args.daemon`, each worker process keeps its vivado session between blocks
+
+    Args:
+        blocks: A list of dictionaries of `builder.prepare_block` arguments
+        args:   The arguments, at least from `builder.get_build_parser().parse_args()`
+
+    Returns:
+        A list of result dictionaries with block, passed, time, error and the
+        RESULT_STATS, None where a stat isn't available
+
+    """
+    args = copy.copy(args)
+    # Don't generate a bitstream since this is just for checking stuff
+    args.impl_only = True
+    jobs = [builder.prepare_block(**block) for block in blocks]
+    names = [job["device_name"] for job in jobs]
+    duplicates = sorted({name for name in names if names.count(name) > 1})
+    if duplicates:
+        err(f"ERROR: Blocks need unique names, give these a name: {duplicates}")
+        exit(1)
+    run_dirs = {job["device_name"]: job["run_dir"] for job in jobs}
+    results = []
+    for result in scheduler.build_devices(jobs, args):
+        row = {
+            "block": result["device"],
+            "passed": result["passed"],
+            "time": result["time"],
+            "error": result["error"],
+        }
+        stats = {}
+        if result["passed"]:
+            stats_file = builder.get_stats_file(
+                run_dirs[result["device"]], result["num_threads"]
+            )
+            try:
+                stats = metrics.parse_stats(stats_file)
+            except OSError:
+                pass
+        for stat in RESULT_STATS:
+            row[stat] = stats.get(stat)
+        results.append(row)
+    # Finish order depends on timing, report in the order given
+    results.sort(key=lambda row: names.index(row["block"]))
+    return results
+
+
+def _format_stat(value):
+    return "-" if value is None else f"{value:g}"
+
+
+def print_results(results):
+    """
+    Prints a pass/fail table of block results
+
+    Args:
+        results: Result dictionaries from `build_blocks`
+
+    Returns:
+        True if every block passed
+
+    """
+    width = max(len(row["block"]) for row in results)
+    header = (
+        f"{'block':<{width}}  {'time':>6}  {'slack':>7}  {'lut %':>6}  {'ram %':>6}"
+    )
+    print(header)
+    for row in results:
+        line = (
+            f"{row['block']:<{width}}  {row['time']:>6}  "
+            f"{_format_stat(row['worst_slack']):>7}  "
+            f"{_format_stat(row['lut_util']):>6}  {_format_stat(row['ram_util']):>6}"
+        )
+        if row["passed"]:
+            success(f"{line}  PASS")
+        else:
+            err(f"{line}  FAIL  {row['error']}")
+    return all(row["passed"] for row in results)
+
+
+def setup_blocks_parser(parser):
+    parser.add_argument("blocks_file", help="Json file listing the blocks to build")
+    parser.add_argument(
+        "--results",
+        default=None,
+        help="Also write the results table to this json file",
+    )
+    parser = builder._add_build_args(parser)
+    return parser
+
+
+def blocks_main(args):
+    results = build_blocks(load_blocks(args.blocks_file), args)
+    all_passed = print_results(results)
+    if args.results:
+        Path(args.results).write_text(json.dumps(results, indent=2))
+    if not all_passed:
+        exit(1)
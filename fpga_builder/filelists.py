@@ -0,0 +1,247 @@
+# Copyright (c) 2022, Intrepid Control Systems, Inc.
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice, this
+#    list of conditions and the following disclaimer.
+#
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+#    this list of conditions and the following disclaimer in the documentation
+#    and/or other materials provided with the distribution.
+#
+# 3. Neither the name of the copyright holder nor the names of its
+#    contributors may be used to endorse or promote products derived from
+#    this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+# OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+"""
+Copyright 2022 Intrepid Control Systems
+
+Cache of the filelists generated from blocks.yaml
+The filelist only changes when blocks.yaml, other_files or a manifest does, so
+an unchanged project copies the last one instead of generating it again
+
+"""
+
+import hashlib
+import json
+import re
+import shutil
+import sys
+import time
+from pathlib import Path
+
+from .cache import hash_file
+from .utils import get_data_dir, err, info
+
+try:
+    from manifest_reader.vivado_util import generate_filelist
+except ImportError:
+    # Only needed once a filelist has to be generated
+    generate_filelist = None
+
+# Bump when the key contents change so old entries are never hit
+CACHE_FORMAT = 1
+MAX_ENTRIES = 200
+
+FILELIST_FILE = "filelist.tcl"
+INPUTS_FILE = "inputs.json"
+MANIFEST_EXTENSIONS = (".yaml", ".yml")
+
+# Anything in a manifest that looks like it could be a relative path
+PATH_TOKEN_RE = re.compile(r"[\w.\-/\\]+")
+
+
+def get_filelist_dir():
+    filelist_dir = get_data_dir() / "filelists"
+    filelist_dir.mkdir(parents=True, exist_ok=True)
+    return filelist_dir
+
+
+def get_manifests(manifest, seen=None):
+    """
+    Finds the manifests a manifest references, following nested references
+    Paths are resolved against the manifest's directory, directories are searched
+    for manifests but not recursed into
+
+    Args:
+        manifest: The manifest file, i.e. blocks.yaml
+        seen:     Manifests already found, to stop cycles
+
+    Returns:
+        A list of manifest Paths, including the one given
+
+    """
+    if seen is None:
+        seen = []
+    manifest = Path(manifest).resolve()
+    if manifest in seen or not manifest.is_file():
+        return seen
+    seen.append(manifest)
+    for token in PATH_TOKEN_RE.findall(manifest.read_text(errors="replace")):
+        if "/" not in token and not token.endswith(MANIFEST_EXTENSIONS):
+            continue
+        path = manifest.parent / token
+        try:
+            if path.is_dir():
+                candidates = sorted(path.iterdir())
+            else:
+                candidates = [path]
+        except OSError:
+            continue
+        for candidate in candidates:
+            if candidate.suffix in MANIFEST_EXTENSIONS:
+                get_manifests(candidate, seen)
+    return seen
+
+
+def get_generator_file():
+    """
+    Gets the source of the filelist generator, so changes to it are part of the key
+
+    Returns:
+        The path of the module `generate_filelist` comes from
+
+    """
+    _check_generator()
+    return sys.modules[generate_filelist.__module__].__file__
+
+
+def _check_generator():
+    if generate_filelist is None:
+        err("ERROR: manifest_reader is needed to generate filelists, please install it")
+        exit(1)
+
+
+def get_inputs(proj_dir, run_dir, other_files):
+    """
+    Digests everything that goes into a generated filelist
+
+    Args:
+        proj_dir:    The project directory holding blocks.yaml
+        run_dir:     The directory the filelist is generated in
+        other_files: The other_files passed to generate_filelist
+
+    Returns:
+        A dictionary of input name to digest
+
+    """
+    inputs = {
+        "format": str(CACHE_FORMAT),
+        "dirs": f"{Path(proj_dir).resolve()} {Path(run_dir).resolve()}",
+        "other_files": hashlib.sha256(
+            json.dumps(other_files, default=str).encode()
+        ).hexdigest(),
+        "manifest_reader": hash_file(get_generator_file()).hexdigest(),
+    }
+    for manifest in get_manifests(Path(proj_dir) / "blocks.yaml"):
+        inputs[manifest.as_posix()] = hash_file(manifest).hexdigest()
+    return inputs
+
+
+def _get_key(inputs):
+    hasher = hashlib.sha256()
+    for name, digest in sorted(inputs.items()):
+        hasher.update(f"{name} {digest}\n".encode())
+    return hasher.hexdigest()
+
+
+def _get_changes(old_inputs, inputs):
+    if not old_inputs:
+        return ["no earlier filelist"]
+    changed = []
+    for name in sorted(set(old_inputs) | set(inputs)):
+        if name not in old_inputs:
+            changed.append(f"{name} added")
+        elif name not in inputs:
+            changed.append(f"{name} removed")
+        elif old_inputs[name] != inputs[name]:
+            changed.append(f"{name} changed")
+    return changed
+
+
+def generate(proj_dir, run_dir, other_files=None, use_cache=True):
+    """
+    Generates the filelist for a run directory, copying it from the cache if none
+    of its inputs changed
+
+    Args:
+        proj_dir:    The project directory holding blocks.yaml
+        run_dir:     The directory to generate the filelist in
+        other_files: Extra files to add, see `builder.get_other_files`
+        use_cache:   Look in the cache first
+
+    Returns:
+        True if the filelist came from the cache
+
+    """
+    run_dir = Path(run_dir)
+    _check_generator()
+    if not use_cache:
+        generate_filelist(proj_dir, run_dir, other_files=other_files)
+        return False
+    inputs = get_inputs(proj_dir, run_dir, other_files)
+    key = _get_key(inputs)
+    cached_file = get_filelist_dir() / f"{key}.tcl"
+    if cached_file.exists():
+        run_dir.mkdir(parents=True, exist_ok=True)
+        shutil.copyfile(cached_file, run_dir / FILELIST_FILE)
+        # Marks it recently used
+        cached_file.touch()
+        info("Filelist inputs unchanged, reusing the cached filelist")
+        return True
+
+    inputs_file = get_filelist_dir() / INPUTS_FILE
+    try:
+        last_inputs = json.loads(inputs_file.read_text())
+    except (OSError, ValueError):
+        last_inputs = {}
+    run_dir_key = run_dir.resolve().as_posix()
+    changes = _get_changes(last_inputs.get(run_dir_key), inputs)
+    info(f"Generating filelist: {', '.join(changes)}")
+
+    generate_filelist(proj_dir, run_dir, other_files=other_files)
+    # Copied in under a temp name so a half written filelist is never picked up
+    tmp_file = cached_file.with_name(f"{key}.tmp{time.time_ns()}")
+    shutil.copyfile(run_dir / FILELIST_FILE, tmp_file)
+    tmp_file.replace(cached_file)
+
+    last_inputs[run_dir_key] = inputs
+    tmp_file = inputs_file.with_name(f"{INPUTS_FILE}.tmp{time.time_ns()}")
+    tmp_file.write_text(json.dumps(last_inputs, indent=2))
+    tmp_file.replace(inputs_file)
+    evict()
+    return False
+
+
+def evict(max_entries=MAX_ENTRIES):
+    """
+    Removes the least recently used filelists past the limit
+
+    Args:
+        max_entries: Number of filelists to keep
+
+    Returns:
+        None
+
+    """
+    entries = []
+    for cached_file in get_filelist_dir().glob("*.tcl"):
+        try:
+            entries.append((cached_file.stat().st_mtime, cached_file))
+        except OSError:
+            continue
+    entries.sort()
+    for _, cached_file in entries[: max(len(entries) - max_entries, 0)]:
+        cached_file.unlink(missing_ok=True)
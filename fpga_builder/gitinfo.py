@@ -0,0 +1,121 @@
+# Copyright (c) 2022, Intrepid Control Systems, Inc.
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice, this
+#    list of conditions and the following disclaimer.
+#
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+#    this list of conditions and the following disclaimer in the documentation
+#    and/or other materials provided with the distribution.
+#
+# 3. Neither the name of the copyright holder nor the names of its
+#    contributors may be used to endorse or promote products derived from
+#    this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+# OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+
+"""
+Copyright 2022 Intrepid Control Systems
+
+Snapshot of git repository metadata, gathered once and shared for the whole run
+
+"""
+
+from pathlib import Path
+
+from .utils import check_output
+
+# Resolved directory and repo root to snapshot
+_snapshots = {}
+
+
+class RepoSnapshot:
+    """
+    Metadata of a single git repository
+    Root, branch and commit come from one git call, everything else is looked up
+    the first time it's needed and kept
+    """
+
+    def __init__(self, root, branch, commit_hash):
+        self.root = root
+        self.branch = branch
+        self.commit_hash = commit_hash
+        self._remote_url = None
+        self._status = None
+        self._submodule_commits = None
+
+    def git(self, cmd):
+        return check_output(f"git {cmd}", cwd=self.root)
+
+    @property
+    def remote_url(self):
+        if self._remote_url is None:
+            self._remote_url = self.git("config --get remote.origin.url")
+        return self._remote_url
+
+    @property
+    def status(self):
+        """Output of git status --porcelain, empty if the repo is clean"""
+        if self._status is None:
+            self._status = self.git("status --porcelain")
+        return self._status
+
+    @property
+    def submodule_commits(self):
+        """Dictionary of submodule path to the commit checked out"""
+        if self._submodule_commits is None:
+            self._submodule_commits = {}
+            for line in self.git("submodule status --recursive").splitlines():
+                # Leading character is a status flag, i.e. + or -
+                commit, name = line[1:].split()[:2]
+                self._submodule_commits[name] = commit
+        return self._submodule_commits
+
+
+def get_snapshot(cwd=None):
+    """
+    Gets the metadata of the git repo containing cwd, only asking git the first time
+
+    Args:
+        cwd: Any directory in the repo, the current directory if None
+
+    Returns:
+        A RepoSnapshot
+
+    """
+    key = Path(cwd if cwd is not None else Path.cwd()).resolve()
+    if key not in _snapshots:
+        # --abbrev-ref only applies to the revisions after it
+        root, commit_hash, branch = check_output(
+            "git rev-parse --show-toplevel HEAD --abbrev-ref HEAD", cwd=key
+        ).splitlines()
+        root = Path(root)
+        # Other directories in the same repo share a snapshot
+        if root not in _snapshots:
+            _snapshots[root] = RepoSnapshot(root, branch, commit_hash)
+        _snapshots[key] = _snapshots[root]
+    return _snapshots[key]
+
+
+def clear_snapshots():
+    """
+    Forgets every snapshot, i.e. after committing
+
+    Returns:
+        None
+
+    """
+    _snapshots.clear()
@@ -0,0 +1,204 @@
+# Copyright (c) 2022, Intrepid Control Systems, Inc.
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice, this
+#    list of conditions and the following disclaimer.
+#
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+#    this list of conditions and the following disclaimer in the documentation
+#    and/or other materials provided with the distribution.
+#
+# 3. Neither the name of the copyright holder nor the names of its
+#    contributors may be used to endorse or promote products derived from
+#    this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+# OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+"""
+Copyright 2022 Intrepid Control Systems
+
+Host wide limit on how many copies of a tool run at once
+Each running copy holds a file lock on one of the tool's slot files, so a slot
+frees up the moment its holder exits, however it exits
+Waiters line up in a queue file and only the first in line takes a free slot
+
+"""
+
+import json
+import os
+import time
+from contextlib import contextmanager
+from os import environ
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+from .utils import get_lock_dir, info
+
+POLL_SECONDS = 2
+
+
+def get_limit(tool):
+    """
+    Gets the host wide limit for a tool from FPGA_BUILDER_MAX_<TOOL>
+
+    Args:
+        tool: The tool name, i.e. vivado or xsct
+
+    Returns:
+        The number of copies allowed at once, None if unlimited
+
+    """
+    limit = environ.get(f"FPGA_BUILDER_MAX_{tool.upper()}")
+    return int(limit) if limit else None
+
+
+def _alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def _open_shared(path):
+    file = open(path, "a+")
+    try:
+        # Every user's builds need to take it
+        os.chmod(path, 0o666)
+    except OSError:
+        pass
+    return file
+
+
+class HostSlot:
+    """
+    One of the limited slots for a tool on this host
+    """
+
+    def __init__(self, tool, limit):
+        self.tool = tool
+        self.limit = limit
+        self.enabled = bool(limit) and fcntl is not None
+        self.ticket = f"{os.getpid()}-{time.time_ns()}"
+        self.slot_file = None
+
+    @contextmanager
+    def _queue(self):
+        """
+        Holds the queue lock while the queue is read and updated
+
+        Yields:
+            The queue, a list of tickets, written back on exit
+
+        """
+        lock_dir = get_lock_dir()
+        with _open_shared(lock_dir / f"{self.tool}.queue.lock") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            queue_file = lock_dir / f"{self.tool}.queue.json"
+            try:
+                queue = json.loads(queue_file.read_text())
+            except (OSError, ValueError):
+                queue = []
+            # Waiters that died give up their place
+            queue = [ticket for ticket in queue if _alive(int(ticket.split("-")[0]))]
+            yield queue
+            tmp_file = queue_file.with_name(f"{queue_file.name}.{os.getpid()}")
+            tmp_file.write_text(json.dumps(queue))
+            tmp_file.chmod(0o666)
+            tmp_file.replace(queue_file)
+
+    def _try_slots(self):
+        lock_dir = get_lock_dir()
+        for idx in range(self.limit):
+            slot_file = _open_shared(lock_dir / f"{self.tool}.slot{idx}.lock")
+            try:
+                fcntl.flock(slot_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except OSError:
+                slot_file.close()
+                continue
+            slot_file.truncate(0)
+            slot_file.write(f"{os.getpid()}\n")
+            slot_file.flush()
+            return slot_file
+        return None
+
+    def acquire(self):
+        """
+        Waits in line for a free slot and takes it
+
+        Returns:
+            None
+
+        """
+        if not self.enabled:
+            return
+        with self._queue() as queue:
+            queue.append(self.ticket)
+        last_position = None
+        try:
+            while True:
+                with self._queue() as queue:
+                    position = queue.index(self.ticket)
+                    if position == 0:
+                        self.slot_file = self._try_slots()
+                        if self.slot_file is not None:
+                            queue.remove(self.ticket)
+                            return
+                if position != last_position:
+                    info(
+                        f"Waiting for one of {self.limit} {self.tool} slots, "
+                        f"{position + 1} in line"
+                    )
+                    last_position = position
+                time.sleep(POLL_SECONDS)
+        except BaseException:
+            with self._queue() as queue:
+                if self.ticket in queue:
+                    queue.remove(self.ticket)
+            raise
+
+    def release(self):
+        if self.slot_file is not None:
+            # Closing drops the lock
+            self.slot_file.close()
+            self.slot_file = None
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, *exc):
+        self.release()
+
+
+def slot(tool, limit=None):
+    """
+    Gets a slot for a tool, use as a context manager around running it
+
+    Args:
+        tool:  The tool name, i.e. vivado or xsct
+        limit: Copies allowed on this host at once, from `get_limit` if None
+
+    Returns:
+        A HostSlot
+
+    """
+    if limit is None:
+        limit = get_limit(tool)
+    return HostSlot(tool, limit)
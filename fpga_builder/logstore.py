@@ -0,0 +1,453 @@
+# Copyright (c) 2022, Intrepid Control Systems, Inc.
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice, this
+#    list of conditions and the following disclaimer.
+#
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+#    this list of conditions and the following disclaimer in the documentation
+#    and/or other materials provided with the distribution.
+#
+# 3. Neither the name of the copyright holder nor the names of its
+#    contributors may be used to endorse or promote products derived from
+#    this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+# OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+
+"""
+Copyright 2022 Intrepid Control Systems
+
+Indexes vivado messages as they are logged so they can be queried without grepping
+The index is a small sqlite database next to vivado.log
+
+"""
+
+import re
+import sqlite3
+import time
+from pathlib import Path
+
+from .utils import err, warning, print
+
+INDEX_FILE = "vivado_log.db"
+
+# i.e. WARNING: [Synth 8-3332] Sequential element (foo) is unused
+MESSAGE_RE = re.compile(r"^(ERROR|CRITICAL WARNING|WARNING|INFO): \[([^\]]+)\]\s*(.*)$")
+# i.e. ERROR: Failed to meet timing! from utils.tcl, which has no message ID
+SEVERITY_RE = re.compile(r"^(ERROR|CRITICAL WARNING|WARNING|INFO): ")
+# Tcl traceback lines after an error, i.e.     while executing
+TRACEBACK_RE = re.compile(r'^(\s|")')
+
+# Same names as the times in the stats file, in build order
+STAGES = ["setup", "synth", "impl", "report", "bitstream", "export"]
+
+# utils.tcl announces each stage with this
+STAGE_MARKER_RE = re.compile(r"^Starting stage: (\w+)")
+
+# Fallbacks for logs without markers, i.e. runme.log, checked in order
+STAGE_PATTERNS = [
+    ("bitstream", re.compile(r"^Command: write_bitstream")),
+    ("export", re.compile(r"^Command: write_(hw_platform|hwdef|sysdef)")),
+    ("synth", re.compile(r"^Command: synth_design|Waiting for synth_1")),
+    ("impl", re.compile(r"^Command: (opt|place|route)_design|Waiting for impl_1")),
+    ("report", re.compile(r"^Command: open_run")),
+]
+
+# user_version of an index that was closed, not left behind by a crash
+INDEX_COMPLETE = 1
+
+# Rows are written in batches, a transaction per line would dominate
+BATCH_SIZE = 1000
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS messages (
+    seq INTEGER PRIMARY KEY,
+    line INTEGER,
+    severity TEXT,
+    msg_id TEXT,
+    stage TEXT,
+    ts REAL,
+    text TEXT
+);
+"""
+
+INDEXES = """
+CREATE INDEX IF NOT EXISTS messages_msg_id ON messages (msg_id, seq);
+CREATE INDEX IF NOT EXISTS messages_severity ON messages (severity, seq);
+CREATE INDEX IF NOT EXISTS messages_stage ON messages (stage, seq);
+"""
+
+
+class StageTracker:
+    """
+    Follows the vivado log to know which build stage is running
+    """
+
+    def __init__(self):
+        self.stage = STAGES[0]
+        # Commands of later stages show up in earlier ones once there are markers,
+        # i.e. write_bitstream during export
+        self.has_markers = False
+
+    def update(self, line):
+        """
+        Checks a line of the log for the start of a new stage
+
+        Args:
+            line: A line of vivado output
+
+        Returns:
+            The name of the new stage if this line started one, otherwise None
+
+        """
+        match = STAGE_MARKER_RE.match(line)
+        if match:
+            stage = match.group(1)
+            self.has_markers = True
+        elif self.has_markers:
+            return None
+        else:
+            for stage, pattern in STAGE_PATTERNS:
+                if pattern.search(line):
+                    break
+            else:
+                return None
+        if stage == self.stage:
+            return None
+        self.stage = stage
+        return stage
+
+
+def parse_message(line):
+    """
+    Splits a vivado message into its parts
+
+    Args:
+        line: A line of vivado output
+
+    Returns:
+        A tuple of severity, message id and text, or None if the line isn't a message
+        The message id is None for messages without one, i.e. from utils.tcl
+
+    """
+    match = MESSAGE_RE.match(line)
+    if match is not None:
+        return match.groups()
+    match = SEVERITY_RE.match(line)
+    if match is not None:
+        return match.group(1), None, line[match.end() :].strip()
+    return None
+
+
+class ConsoleFilter:
+    """
+    Decides which lines of vivado output are worth showing on the console
+    Everything still goes to vivado.log and the index
+    """
+
+    def __init__(self, quiet=False, max_repeats=0):
+        # Quiet only shows warnings and errors, max_repeats of 0 is no limit
+        self.quiet = quiet
+        self.max_repeats = max_repeats
+        self.counts = {}
+        # Whether the traceback of an error could follow
+        self.after_error = False
+
+    def filter(self, line):
+        """
+        Checks a line of vivado output
+
+        Args:
+            line: The line
+
+        Returns:
+            The line to show, a note in its place if its message ID just hit
+            the limit, or None to hide it
+
+        """
+        message = parse_message(line)
+        severity, msg_id, _ = message if message is not None else (None, None, None)
+        if severity is None:
+            if self.after_error and TRACEBACK_RE.match(line):
+                return line
+            self.after_error = False
+            return None if self.quiet else line
+        self.after_error = severity == "ERROR"
+        if self.quiet and severity == "INFO":
+            return None
+        if not self.max_repeats or severity == "ERROR" or msg_id is None:
+            return line
+        count = self.counts.get(msg_id, 0) + 1
+        self.counts[msg_id] = count
+        if count <= self.max_repeats:
+            return line
+        if count == self.max_repeats + 1:
+            return f"[{msg_id}] shown {self.max_repeats} times, hiding the rest"
+        return None
+
+    def get_hidden(self):
+        """
+        Gets how many lines of each message ID were hidden for repeating
+
+        Returns:
+            A dictionary of message ID to count, most hidden first
+
+        """
+        hidden = {
+            msg_id: count - self.max_repeats
+            for msg_id, count in self.counts.items()
+            if count > self.max_repeats
+        }
+        return dict(sorted(hidden.items(), key=lambda item: -item[1]))
+
+
+class LogIndex:
+    """
+    Writes messages from a vivado log stream to the index as they arrive
+    """
+
+    def __init__(self, index_file):
+        index_file = Path(index_file)
+        if index_file.exists():
+            index_file.unlink()
+        self.connection = sqlite3.connect(str(index_file))
+        # Losing the index on a crash is fine, it's rebuilt from the log
+        self.connection.execute("PRAGMA journal_mode = OFF")
+        self.connection.execute("PRAGMA synchronous = OFF")
+        self.connection.executescript(SCHEMA)
+        self.tracker = StageTracker()
+        self.num_lines = 0
+        self.rows = []
+
+    def add(self, line, ts=None):
+        """
+        Indexes a single line of vivado output
+
+        Args:
+            line: The line
+            ts:   When the line was seen, now if None
+
+        Returns:
+            None
+
+        """
+        self.num_lines += 1
+        self.tracker.update(line)
+        message = parse_message(line)
+        if message is None:
+            return
+        severity, msg_id, text = message
+        if ts is None:
+            ts = time.time()
+        self.rows.append(
+            (self.num_lines, severity, msg_id, self.tracker.stage, ts, text)
+        )
+        if len(self.rows) >= BATCH_SIZE:
+            self.flush()
+
+    def flush(self):
+        self.connection.executemany(
+            "INSERT INTO messages (line, severity, msg_id, stage, ts, text) "
+            "VALUES (?, ?, ?, ?, ?, ?)",
+            self.rows,
+        )
+        self.rows = []
+
+    def close(self):
+        self.flush()
+        # Cheaper to build the indexes once than to keep them up to date
+        self.connection.executescript(INDEXES)
+        # Marks the index as complete, anything else gets rebuilt from the log
+        self.connection.execute(f"PRAGMA user_version = {INDEX_COMPLETE}")
+        self.connection.commit()
+        self.connection.close()
+
+
+def index_log_file(log_file, index_file=None):
+    """
+    Builds the index for an existing log file
+
+    Args:
+        log_file:   The vivado.log to index
+        index_file: Where to put the index, next to the log if None
+
+    Returns:
+        The Path to the index
+
+    """
+    log_file = Path(log_file)
+    if index_file is None:
+        index_file = log_file.parent / INDEX_FILE
+    index = LogIndex(index_file)
+    with open(log_file, "r", errors="replace") as file:
+        for line in file:
+            # No timestamps in the file itself
+            index.add(line.strip(), ts=0)
+    index.close()
+    return Path(index_file)
+
+
+def is_complete(index_file):
+    """
+    Checks that an index exists and was finished
+
+    Args:
+        index_file: The index
+
+    Returns:
+        True if the index can be trusted
+
+    """
+    if not Path(index_file).exists():
+        return False
+    try:
+        with sqlite3.connect(str(index_file)) as connection:
+            (version,) = connection.execute("PRAGMA user_version").fetchone()
+    except sqlite3.Error:
+        return False
+    return version == INDEX_COMPLETE
+
+
+def get_index(output_dir):
+    """
+    Gets the index for a build output directory, building it from vivado.log if needed
+
+    Args:
+        output_dir: The output directory of a build
+
+    Returns:
+        The Path to the index
+
+    """
+    output_dir = Path(output_dir)
+    index_file = output_dir / INDEX_FILE
+    log_file = output_dir / "vivado.log"
+    if is_complete(index_file):
+        return index_file
+    if not log_file.exists():
+        if index_file.exists():
+            warning(
+                f"WARNING: {index_file} is incomplete and there's no log to rebuild it"
+            )
+            return index_file
+        err(f"ERROR: No {INDEX_FILE} or vivado.log in {output_dir}")
+        exit(1)
+    print(f"Indexing {log_file}...")
+    return index_log_file(log_file, index_file)
+
+
+def _where(msg_id=None, severity=None, stage=None):
+    clauses = []
+    params = []
+    for column, value in (("msg_id", msg_id), ("severity", severity), ("stage", stage)):
+        if value is not None:
+            clauses.append(f"{column} = ?")
+            params.append(value)
+    where = " WHERE " + " AND ".join(clauses) if clauses else ""
+    return where, params
+
+
+def count_messages(index_file, by="msg_id", msg_id=None, severity=None, stage=None):
+    """
+    Counts messages, grouped by a column
+
+    Args:
+        index_file: The index to query
+        by:         Column to group by, msg_id, severity or stage
+        msg_id:     Only count this message id
+        severity:   Only count this severity
+        stage:      Only count this stage
+
+    Returns:
+        A list of (value, count) tuples, most common first
+
+    """
+    if by not in ("msg_id", "severity", "stage"):
+        raise ValueError(f"Can't group by {by}")
+    where, params = _where(msg_id, severity, stage)
+    query = f"SELECT {by}, COUNT(*) FROM messages{where} GROUP BY {by} ORDER BY 2 DESC"
+    with sqlite3.connect(str(index_file)) as connection:
+        return connection.execute(query, params).fetchall()
+
+
+def find_messages(index_file, msg_id=None, severity=None, stage=None, limit=10):
+    """
+    Gets the first occurrences of matching messages
+
+    Args:
+        index_file: The index to query
+        msg_id:     Only find this message id
+        severity:   Only find this severity
+        stage:      Only find this stage
+        limit:      The most messages to return
+
+    Returns:
+        A list of (line, severity, msg_id, stage, text) tuples in log order
+
+    """
+    where, params = _where(msg_id, severity, stage)
+    query = (
+        f"SELECT line, severity, msg_id, stage, text FROM messages{where} "
+        "ORDER BY seq LIMIT ?"
+    )
+    with sqlite3.connect(str(index_file)) as connection:
+        return connection.execute(query, params + [limit]).fetchall()
+
+
+def setup_logs_parser(parser):
+    parser.add_argument(
+        "output_dir",
+        type=Path,
+        help="Output directory of the build, i.e. build/device_a/output",
+    )
+    parser.add_argument(
+        "--id", default=None, help="Only this message id, i.e. 'Synth 8-3332'"
+    )
+    parser.add_argument(
+        "--severity",
+        default=None,
+        choices=["ERROR", "CRITICAL WARNING", "WARNING", "INFO"],
+        help="Only this severity",
+    )
+    parser.add_argument("--stage", default=None, choices=STAGES, help="Only this stage")
+    parser.add_argument(
+        "--by",
+        default="msg_id",
+        choices=["msg_id", "severity", "stage"],
+        help="What to count messages by",
+    )
+    parser.add_argument(
+        "-n",
+        "--num",
+        default=0,
+        type=int,
+        help="Also show the first N matching messages",
+    )
+    return parser
+
+
+def logs_main(args):
+    index_file = get_index(args.output_dir)
+    counts = count_messages(index_file, args.by, args.id, args.severity, args.stage)
+    for value, count in counts:
+        print(f"{count:>8}  {'(no id)' if value is None else value}")
+    if args.num:
+        print()
+        for line, severity, msg_id, stage, text in find_messages(
+            index_file, args.id, args.severity, args.stage, args.num
+        ):
+            msg_id = f"[{msg_id}] " if msg_id is not None else ""
+            print(f"{line:>8} {stage:<9} {severity}: {msg_id}{text}")
@@ -0,0 +1,425 @@
+# Copyright (c) 2022, Intrepid Control Systems, Inc.
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice, this
+#    list of conditions and the following disclaimer.
+#
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+#    this list of conditions and the following disclaimer in the documentation
+#    and/or other materials provided with the distribution.
+#
+# 3. Neither the name of the copyright holder nor the names of its
+#    contributors may be used to endorse or promote products derived from
+#    this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+# OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+
+"""
+Copyright 2022 Intrepid Control Systems
+
+Keeps the stats of every build in a sqlite database and flags regressions
+
+"""
+
+import socket
+import sqlite3
+import statistics
+import sys
+import time
+from os import environ
+from pathlib import Path
+
+from .utils import get_data_dir, err, warning, success, print
+
+TIME_STATS = [
+    "setup_time",
+    "synth_time",
+    "impl_time",
+    "report_time",
+    "bitstream_time",
+    "export_time",
+    "total_time",
+]
+BUILD_STATS = ["worst_slack", "lut_util", "ram_util", "total_power"]
+STATS = TIME_STATS + BUILD_STATS
+
+# Stages this short are mostly noise, don't flag them
+MIN_REGRESSION_TIME = 30
+
+SCHEMA = f"""
+CREATE TABLE IF NOT EXISTS builds (
+    id INTEGER PRIMARY KEY,
+    ts REAL,
+    device TEXT,
+    commit_hash TEXT,
+    host TEXT,
+    os TEXT,
+    num_threads INTEGER,
+    {", ".join(f"{stat} REAL" for stat in STATS)}
+);
+CREATE INDEX IF NOT EXISTS builds_config ON builds (device, host, num_threads, ts);
+CREATE TABLE IF NOT EXISTS memory (
+    id INTEGER PRIMARY KEY,
+    ts REAL,
+    device TEXT,
+    host TEXT,
+    stage TEXT,
+    peak_rss INTEGER
+);
+CREATE INDEX IF NOT EXISTS memory_device ON memory (device, stage, ts);
+"""
+
+
+def get_db_file():
+    """
+    Gets the metrics database
+    Defaults to metrics.db in the data dir, override with FPGA_BUILDER_METRICS_DB
+
+    Returns:
+        A Path to the database
+
+    """
+    if "FPGA_BUILDER_METRICS_DB" in environ:
+        return Path(environ["FPGA_BUILDER_METRICS_DB"])
+    return get_data_dir() / "metrics.db"
+
+
+def connect():
+    connection = sqlite3.connect(str(get_db_file()))
+    connection.executescript(SCHEMA)
+    return connection
+
+
+def parse_stats(stats_file):
+    """
+    Reads the stats file written by `report_stats` in utils.tcl
+
+    Args:
+        stats_file: The stats file
+
+    Returns:
+        A dictionary of stat name to value, units dropped
+
+    """
+    stats = {}
+    for line in Path(stats_file).read_text().splitlines():
+        if line.startswith("#") or ":" not in line:
+            continue
+        name, value = line.split(":", 1)
+        value = value.split()[0].rstrip("%") if value.split() else ""
+        try:
+            stats[name.strip()] = float(value)
+        except ValueError:
+            continue
+    return stats
+
+
+def record_build(device, stats_file, num_threads, commit_hash=None):
+    """
+    Stores the stats of a finished build
+
+    Args:
+        device:      The device name
+        stats_file:  The stats file the build wrote
+        num_threads: The number of threads the build used
+        commit_hash: The commit that was built
+
+    Returns:
+        None
+
+    """
+    stats = parse_stats(stats_file)
+    row = {
+        "ts": time.time(),
+        "device": device,
+        "commit_hash": commit_hash,
+        "host": socket.gethostname(),
+        "os": sys.platform,
+        "num_threads": int(num_threads),
+    }
+    row.update({stat: stats.get(stat) for stat in STATS})
+    columns = ", ".join(row)
+    placeholders = ", ".join("?" for _ in row)
+    with connect() as connection:
+        connection.execute(
+            f"INSERT INTO builds ({columns}) VALUES ({placeholders})",
+            list(row.values()),
+        )
+
+
+def record_memory(device, peaks):
+    """
+    Stores the peak memory of each stage of a build
+
+    Args:
+        device: The device name
+        peaks:  A dictionary of stage name to peak resident memory in bytes
+
+    Returns:
+        None
+
+    """
+    ts = time.time()
+    host = socket.gethostname()
+    with connect() as connection:
+        connection.executemany(
+            "INSERT INTO memory (ts, device, host, stage, peak_rss) VALUES (?, ?, ?, ?, ?)",
+            [(ts, device, host, stage, int(peak)) for stage, peak in peaks.items()],
+        )
+
+
+def get_memory_peaks(device, window=5):
+    """
+    Gets the largest peak memory of each stage over a device's recent builds
+
+    Args:
+        device: The device name
+        window: How many recent builds of each stage to look at
+
+    Returns:
+        A dictionary of stage name to peak resident memory in bytes
+
+    """
+    query = "SELECT stage, peak_rss FROM memory WHERE device = ? ORDER BY ts DESC"
+    recent = {}
+    with connect() as connection:
+        for stage, peak in connection.execute(query, (device,)):
+            recent.setdefault(stage, [])
+            if len(recent[stage]) < window:
+                recent[stage].append(peak)
+    return {stage: max(peaks) for stage, peaks in recent.items()}
+
+
+def get_history(device, host=None, num_threads=None, limit=10):
+    """
+    Gets the most recent builds of a device
+
+    Args:
+        device:      The device name
+        host:        Only builds from this host, any if None
+        num_threads: Only builds with this many threads, any if None
+        limit:       The most builds to return
+
+    Returns:
+        A list of dictionaries, newest first
+
+    """
+    query = "SELECT * FROM builds WHERE device = ?"
+    params = [device]
+    if host is not None:
+        query += " AND host = ?"
+        params.append(host)
+    if num_threads is not None:
+        query += " AND num_threads = ?"
+        params.append(int(num_threads))
+    query += " ORDER BY ts DESC LIMIT ?"
+    params.append(limit)
+    with connect() as connection:
+        connection.row_factory = sqlite3.Row
+        return [dict(row) for row in connection.execute(query, params)]
+
+
+def get_times_by_threads(device, host=None, stat="total_time", limit=50):
+    """
+    Gets the median time of a device's recent builds for each thread count
+
+    Args:
+        device: The device name
+        host:   Host of the builds, this host if None
+        stat:   The time stat to compare
+        limit:  How many recent builds to look at
+
+    Returns:
+        A dictionary of thread count to a (median, number of builds) tuple
+
+    """
+    if host is None:
+        host = socket.gethostname()
+    times = {}
+    for build in get_history(device, host, limit=limit):
+        if build[stat] is not None:
+            times.setdefault(build["num_threads"], []).append(build[stat])
+    return {
+        num_threads: (statistics.median(values), len(values))
+        for num_threads, values in times.items()
+    }
+
+
+def find_regressions(
+    device,
+    host=None,
+    num_threads=None,
+    window=10,
+    threshold=0.2,
+    util_threshold=2,
+    slack_margin=0.5,
+):
+    """
+    Compares the latest build of a device to the median of the ones before it
+    Only builds from the same host and thread count make up the baseline
+
+    Args:
+        device:         The device name
+        host:           Host of the builds, this host if None
+        num_threads:    Thread count of the builds, that of the latest build if None
+        window:         How many builds before the latest make up the baseline
+        threshold:      Fraction a time or power can grow by before it is flagged
+        util_threshold: Percentage points a utilization can grow by before it is flagged
+        slack_margin:   Nanoseconds worst slack can drop by before it is flagged
+
+    Returns:
+        A list of strings describing each regression
+
+    """
+    if host is None:
+        host = socket.gethostname()
+    latest = get_history(device, host, num_threads, limit=1)
+    if not latest:
+        return []
+    latest = latest[0]
+    history = get_history(device, host, latest["num_threads"], limit=window + 1)[1:]
+    regressions = []
+
+    def baseline(stat):
+        values = [build[stat] for build in history if build[stat] is not None]
+        return statistics.median(values) if values else None
+
+    slack = latest["worst_slack"]
+    base = baseline("worst_slack")
+    if slack is not None and slack < 0:
+        regressions.append(f"worst_slack is {slack:g} ns")
+    elif slack is not None and base is not None and slack < base - slack_margin:
+        regressions.append(f"worst_slack is {slack:g} ns, down from {base:g} ns")
+
+    for stat in TIME_STATS + ["total_power"]:
+        base = baseline(stat)
+        value = latest[stat]
+        if base is None or value is None or base <= 0:
+            continue
+        if stat in TIME_STATS and value < MIN_REGRESSION_TIME:
+            continue
+        if value > base * (1 + threshold):
+            change = (value - base) / base * 100
+            regressions.append(f"{stat} is {value:g}, {change:+.0f}% over {base:g}")
+    for stat in ("lut_util", "ram_util"):
+        base = baseline(stat)
+        value = latest[stat]
+        if base is None or value is None:
+            continue
+        # Utilization is already a percentage, compare points
+        if value > base + util_threshold:
+            regressions.append(f"{stat} is {value:g}%, up from {base:g}%")
+    return regressions
+
+
+def check_regressions(
+    device,
+    num_threads=None,
+    window=10,
+    threshold=0.2,
+    util_threshold=2,
+    slack_margin=0.5,
+):
+    """
+    Prints the regressions of the latest build of a device on this host
+
+    Args:
+        device:         The device name
+        num_threads:    Thread count of the builds, that of the latest build if None
+        window:         How many builds before the latest make up the baseline
+        threshold:      Fraction a time or power can grow by before it is flagged
+        util_threshold: Percentage points a utilization can grow by before it is flagged
+        slack_margin:   Nanoseconds worst slack can drop by before it is flagged
+
+    Returns:
+        True if there were no regressions
+
+    """
+    regressions = find_regressions(
+        device,
+        num_threads=num_threads,
+        window=window,
+        threshold=threshold,
+        util_threshold=util_threshold,
+        slack_margin=slack_margin,
+    )
+    for regression in regressions:
+        warning(f"WARNING: {device} regression: {regression}")
+    return not regressions
+
+
+def setup_metrics_parser(parser):
+    parser.add_argument("device", help="The device name to check")
+    parser.add_argument(
+        "--window",
+        default=10,
+        type=int,
+        help="Number of previous builds the baseline is made from",
+    )
+    parser.add_argument(
+        "--threshold",
+        default=20,
+        type=float,
+        help="Percent a time or power can grow by before it is a regression",
+    )
+    parser.add_argument(
+        "--util-threshold",
+        default=2,
+        type=float,
+        help="Percentage points a utilization can grow by before it is a regression",
+    )
+    parser.add_argument(
+        "--slack-margin",
+        default=0.5,
+        type=float,
+        help="Nanoseconds worst slack can drop by before it is a regression",
+    )
+    parser.add_argument(
+        "-p",
+        "--num-threads",
+        default=None,
+        type=int,
+        help="Only builds with this many threads",
+    )
+    parser.add_argument(
+        "--history",
+        default=0,
+        type=int,
+        help="Also show the last N builds",
+    )
+    return parser
+
+
+def metrics_main(args):
+    if args.history:
+        columns = ["commit_hash", "num_threads"] + STATS
+        print("  ".join(columns))
+        for build in get_history(
+            args.device, socket.gethostname(), args.num_threads, args.history
+        ):
+            print("  ".join(str(build[column]) for column in columns))
+    passed = check_regressions(
+        args.device,
+        args.num_threads,
+        args.window,
+        args.threshold / 100,
+        args.util_threshold,
+        args.slack_margin,
+    )
+    if not passed:
+        err(f"ERROR: {args.device} has regressed")
+        exit(1)
+    success(f"No regressions for {args.device}")
@@ -0,0 +1,173 @@
+# Copyright (c) 2022, Intrepid Control Systems, Inc.
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice, this
+#    list of conditions and the following disclaimer.
+#
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+#    this list of conditions and the following disclaimer in the documentation
+#    and/or other materials provided with the distribution.
+#
+# 3. Neither the name of the copyright holder nor the names of its
+#    contributors may be used to endorse or promote products derived from
+#    this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+# OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+
+"""
+Copyright 2022 Intrepid Control Systems
+
+Packs build outputs into a release tarball
+Compression runs in a multi-threaded external tool when one is available
+
+"""
+
+import gzip
+import io
+import lzma
+import shutil
+import subprocess
+import tarfile
+from concurrent.futures import ThreadPoolExecutor
+from os import environ
+from pathlib import Path
+
+from .cache import hash_file
+from .utils import err, info
+
+try:
+    import zstandard
+
+    HAS_ZSTANDARD = True
+except ImportError:
+    HAS_ZSTANDARD = False
+
+MANIFEST_NAME = "SHA256SUMS"
+
+# Fixed so the xz container doesn't depend on how many cores the host has
+XZ_BLOCK_SIZE = "--block-size=64MiB"
+
+# Extension and multi-threaded external command for each compression
+COMPRESSORS = {
+    "xz": (".tar.xz", ["xz", "-T0", XZ_BLOCK_SIZE, "-c"]),
+    "zstd": (".tar.zst", ["zstd", "-T0", "-q", "-c"]),
+    "gz": (".tar.gz", ["pigz", "-n", "-c"]),
+}
+
+
+def _open_fallback(out_file, compression):
+    """
+    Opens a single threaded python compressor, for when the external one is missing
+
+    Args:
+        out_file:    The binary file to write compressed data to
+        compression: One of `COMPRESSORS`
+
+    Returns:
+        A writable file object, or None if there's no way to compress this
+
+    """
+    if compression == "xz":
+        return lzma.open(out_file, "wb")
+    if compression == "gz":
+        # No timestamp in the header so the output is reproducible
+        return gzip.GzipFile(filename="", mode="wb", fileobj=out_file, mtime=0)
+    if compression == "zstd" and HAS_ZSTANDARD:
+        return zstandard.ZstdCompressor(threads=-1).stream_writer(out_file)
+    return None
+
+
+def get_manifest(files):
+    """
+    Hashes files in parallel
+
+    Args:
+        files: List of Paths to hash
+
+    Returns:
+        A dictionary of file name to sha256 hex digest
+
+    """
+    with ThreadPoolExecutor() as executor:
+        digests = executor.map(lambda file: hash_file(file).hexdigest(), files)
+        return {file.name: digest for file, digest in zip(files, digests)}
+
+
+def _normalize(tarinfo, mtime):
+    tarinfo.mtime = mtime
+    tarinfo.uid = tarinfo.gid = 0
+    tarinfo.uname = tarinfo.gname = ""
+    tarinfo.mode = 0o644
+    return tarinfo
+
+
+def _write_tar(fileobj, files, manifest, deterministic):
+    # Same value reproducible builds use for their timestamps
+    mtime = int(environ.get("SOURCE_DATE_EPOCH", 0))
+    with tarfile.open(fileobj=fileobj, mode="w|", format=tarfile.PAX_FORMAT) as tar:
+        for file in files:
+            tarinfo = tar.gettarinfo(file, arcname=file.name)
+            if deterministic:
+                _normalize(tarinfo, mtime)
+            with open(file, "rb") as data:
+                # Streams in chunks, nothing is read in all at once
+                tar.addfile(tarinfo, data)
+        manifest_text = "".join(f"{digest}  {name}\n" for name, digest in manifest)
+        manifest_data = manifest_text.encode()
+        tarinfo = tarfile.TarInfo(MANIFEST_NAME)
+        tarinfo.size = len(manifest_data)
+        _normalize(tarinfo, mtime)
+        tar.addfile(tarinfo, io.BytesIO(manifest_data))
+
+
+def make_tarball(files, target, compression="xz", deterministic=False):
+    """
+    Packs files into a compressed tarball with a sha256 manifest of its contents
+
+    Args:
+        files:         List of Paths to pack, stored by name only
+        target:        Path of the tarball without the extension
+        compression:   One of `COMPRESSORS`
+        deterministic: When true, the same files always make the same tarball
+
+    Returns:
+        The Path to the tarball
+
+    """
+    extension, cmd = COMPRESSORS[compression]
+    files = sorted(set(files), key=lambda file: file.name)
+    tar_target = Path(str(target) + extension)
+    manifest = sorted(get_manifest(files).items())
+    info(f"Packing {len(files)} files into {tar_target}")
+    with open(tar_target, "wb") as out_file:
+        if shutil.which(cmd[0]):
+            process = subprocess.Popen(cmd, stdin=subprocess.PIPE, stdout=out_file)
+            try:
+                _write_tar(process.stdin, files, manifest, deterministic)
+            finally:
+                process.stdin.close()
+                rc = process.wait()
+            if rc != 0:
+                raise Exception(f"{' '.join(cmd)} failed with rc {rc}")
+        else:
+            compressed_file = _open_fallback(out_file, compression)
+            if compressed_file is None:
+                err(f"ERROR: {compression} needs {cmd[0]} on PATH or zstandard")
+                exit(1)
+            info(f"{cmd[0]} not found, compressing single threaded")
+            with compressed_file:
+                _write_tar(compressed_file, files, manifest, deterministic)
+    return tar_target
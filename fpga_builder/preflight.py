@@ -0,0 +1,332 @@
+# Copyright (c) 2022, Intrepid Control Systems, Inc.
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice, this
+#    list of conditions and the following disclaimer.
+#
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+#    this list of conditions and the following disclaimer in the documentation
+#    and/or other materials provided with the distribution.
+#
+# 3. Neither the name of the copyright holder nor the names of its
+#    contributors may be used to endorse or promote products derived from
+#    this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+# OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+"""
+Copyright 2022 Intrepid Control Systems
+
+Quick checks of the VHDL sources before a build clears the old project and starts vivado
+Changed files get a syntax sanity check in python, optionally followed by xvhdl,
+and every file's references into its own libraries are resolved
+
+"""
+
+import json
+import os
+import re
+import shutil
+import subprocess
+import tempfile
+from pathlib import Path
+
+from .utils import get_data_dir, err, warning, info, XILINX_BIN_EXTENSION
+from .cache import get_digest
+from . import vhdl_deps
+
+CACHE_FORMAT = 1
+# Hashes of files that passed, least recently checked dropped first
+MAX_CACHE_ENTRIES = 50000
+
+# i.e. end entity foo; end architecture rtl; end package body foo_pkg; end package body;
+END_RE = re.compile(
+    r"\bend\s+(entity|architecture|package\s+body|package)(?:\s+(\w+))?\s*;"
+)
+ARCHITECTURE_NAME_RE = re.compile(r"\barchitecture\s+(\w+)\s+of\b")
+
+# i.e. ERROR: [VRFC 10-91] foo is not declared [/path/top.vhd:12]
+XVHDL_ERROR_RE = re.compile(r"^ERROR: ")
+
+
+def get_cache_file():
+    return get_data_dir() / "preflight.json"
+
+
+def check_text(text):
+    """
+    Looks for mistakes that are certain to fail analysis, without parsing VHDL
+
+    Args:
+        text: The VHDL source
+
+    Returns:
+        A list of (line number, problem) tuples
+
+    """
+    # Blank out comments and literals but keep the line breaks for line numbers
+    text = vhdl_deps.NOISE_RE.sub(
+        lambda match: "\n" * match.group().count("\n") + " ", text
+    ).lower()
+    problems = []
+    open_parens = []
+    for number, line in enumerate(text.splitlines(), 1):
+        if '"' in line:
+            problems.append((number, "unterminated string"))
+        for char in line:
+            if char == "(":
+                open_parens.append(number)
+            elif char == ")":
+                if not open_parens:
+                    problems.append((number, "unmatched )"))
+                else:
+                    open_parens.pop()
+    problems.extend((number, "unclosed (") for number in open_parens)
+
+    parsed = vhdl_deps.parse_vhdl(text)
+    declared = {
+        "entity": parsed["entities"],
+        "architecture": ARCHITECTURE_NAME_RE.findall(text),
+        "package": parsed["packages"],
+        "package body": parsed["bodies"],
+    }
+    for match in END_RE.finditer(text):
+        kind = " ".join(match.group(1).split())
+        name = match.group(2)
+        if name is not None and name not in declared[kind]:
+            number = text.count("\n", 0, match.start()) + 1
+            problems.append((number, f"end {kind} {name} doesn't match any {kind}"))
+    return sorted(problems)
+
+
+def get_sources(other_files):
+    """
+    Gets the VHDL sources of an other_files structure
+
+    Args:
+        other_files: A dictionary like the one from `builder.get_other_files`
+
+    Returns:
+        A list of (path, library, standard) tuples, in filelist order
+
+    """
+    sources = []
+    for lib, files in other_files.get("vhdl", {}).items():
+        for file_obj in files:
+            sources.append((Path(file_obj[0]), lib, file_obj[1]))
+    return sources
+
+
+def get_xvhdl_cmd(vivado_cmd):
+    """
+    Finds xvhdl, on PATH or next to vivado
+
+    Args:
+        vivado_cmd: The vivado command of the build
+
+    Returns:
+        The xvhdl command, or None if it wasn't found
+
+    """
+    xvhdl_cmd = shutil.which("xvhdl")
+    if xvhdl_cmd is not None:
+        return xvhdl_cmd
+    xvhdl_cmd = Path(vivado_cmd).parent / f"xvhdl{XILINX_BIN_EXTENSION}"
+    return str(xvhdl_cmd) if xvhdl_cmd.exists() else None
+
+
+def run_xvhdl(xvhdl_cmd, sources):
+    """
+    Analyzes sources with xvhdl in a scratch directory
+
+    Args:
+        xvhdl_cmd: The xvhdl command
+        sources:   A list of (path, library, standard) tuples, in compile order
+
+    Returns:
+        A list of error lines, empty if everything analyzed
+
+    """
+    errors = []
+    with tempfile.TemporaryDirectory(prefix="fpga_builder_xvhdl") as scratch:
+        # Consecutive files of one library and standard go in a single call
+        groups = []
+        for path, lib, standard in sources:
+            key = (lib, "2008" in str(standard))
+            if groups and groups[-1][0] == key:
+                groups[-1][1].append(str(path))
+            else:
+                groups.append((key, [str(path)]))
+        for (lib, vhdl_2008), paths in groups:
+            cmd = [xvhdl_cmd, "--nolog", "--relax", "--work", lib]
+            if vhdl_2008:
+                cmd.append("--2008")
+            result = subprocess.run(
+                cmd + paths,
+                cwd=scratch,
+                stdout=subprocess.PIPE,
+                stderr=subprocess.STDOUT,
+                universal_newlines=True,
+            )
+            if result.returncode != 0:
+                lines = result.stdout.splitlines()
+                errors.extend(
+                    XVHDL_ERROR_RE.sub("", line)
+                    for line in lines
+                    if XVHDL_ERROR_RE.match(line)
+                )
+                errors = errors or lines[-5:]
+                # Everything after depends on this library
+                break
+    return errors
+
+
+class Preflight:
+    """
+    Checks sources, remembering which contents already passed
+    """
+
+    def __init__(self, cache_file=None):
+        self.cache_file = Path(cache_file or get_cache_file())
+        self.passed = {}
+        try:
+            cache = json.loads(self.cache_file.read_text())
+        except (OSError, ValueError):
+            cache = {}
+        if cache.get("format") == CACHE_FORMAT:
+            self.passed = dict.fromkeys(cache["passed"])
+
+    def get_changed(self, sources, mode):
+        """
+        Gets the sources whose contents haven't passed a check yet
+
+        Args:
+            sources: A list of (path, library, standard) tuples
+            mode:    The check, python or xvhdl
+
+        Returns:
+            A dictionary of path to its cache key, only for changed sources
+
+        """
+        changed = {}
+        for path, lib, standard in sources:
+            digest = get_digest(path)
+            key = f"{mode}:{lib}:{standard}:{digest}"
+            if key not in self.passed:
+                changed[path] = key
+        return changed
+
+    def mark_passed(self, keys):
+        for key in keys:
+            self.passed.pop(key, None)
+            self.passed[key] = None
+
+    def save(self):
+        keys = list(self.passed)[-MAX_CACHE_ENTRIES:]
+        cache = {"format": CACHE_FORMAT, "passed": keys}
+        # Builds run by the scheduler save at the same time
+        tmp_file = self.cache_file.with_name(f"{self.cache_file.name}.{os.getpid()}")
+        tmp_file.write_text(json.dumps(cache))
+        tmp_file.replace(self.cache_file)
+
+    def check_python(self, sources, complete=True):
+        """
+        Checks changed sources on their own, then warns about references no source
+        declares
+
+        Args:
+            sources:  A list of (path, library, standard) tuples
+            complete: Whether these are all of the sources, a blocks.yaml adds more
+
+        Returns:
+            A list of problem strings
+
+        """
+        problems = []
+        changed = self.get_changed(sources, "python")
+        passed = []
+        for path, key in changed.items():
+            found = check_text(path.read_text(errors="replace"))
+            problems.extend(f"{path}:{number}: {problem}" for number, problem in found)
+            if not found:
+                passed.append(key)
+        self.mark_passed(passed)
+        if not complete:
+            # Units could come from the sources we don't know about
+            return problems
+        missing = vhdl_deps.find_missing_units(
+            [(path, lib) for path, lib, _ in sources]
+        )
+        for path, kind, name in missing:
+            # Could be generated by IP or a BD, or come from a library vivado adds
+            kind = "entity" if kind == "instance" else kind
+            warning(f"WARNING: {path}: no source declares {kind} {name}")
+        return problems
+
+    def check_xvhdl(self, sources, xvhdl_cmd):
+        """
+        Analyzes the changed sources and what they depend on with xvhdl
+
+        Args:
+            sources:   A list of (path, library, standard) tuples
+            xvhdl_cmd: The xvhdl command
+
+        Returns:
+            A list of error lines
+
+        """
+        changed = self.get_changed(sources, "xvhdl")
+        if not changed:
+            return []
+        by_path = {
+            (path, lib): (path, lib, standard) for path, lib, standard in sources
+        }
+        order = vhdl_deps.get_analysis_order(list(by_path), set(changed))
+        info(f"Analyzing {len(changed)} changed of {len(order)} files with xvhdl")
+        errors = run_xvhdl(xvhdl_cmd, [by_path[source] for source in order])
+        if not errors:
+            self.mark_passed(changed.values())
+        return errors
+
+
+def check(other_files, complete=True, vivado_cmd=None):
+    """
+    Checks the VHDL sources of a build, exiting if any of them are sure to fail
+
+    Args:
+        other_files: A dictionary like the one from `builder.get_other_files`
+        complete:    Whether these are all of the sources, a blocks.yaml adds more
+        vivado_cmd:  Also analyze with the xvhdl next to this vivado, if given
+
+    Returns:
+        None
+
+    """
+    sources = get_sources(other_files)
+    if not sources:
+        return
+    preflight = Preflight()
+    problems = preflight.check_python(sources, complete)
+    if not problems and vivado_cmd is not None:
+        xvhdl_cmd = get_xvhdl_cmd(vivado_cmd)
+        if xvhdl_cmd is None:
+            warning("WARNING: xvhdl not found, only checked sources in python")
+        else:
+            problems = preflight.check_xvhdl(sources, xvhdl_cmd)
+    preflight.save()
+    if problems:
+        for problem in problems:
+            err(f"ERROR: {problem}")
+        err("ERROR: Preflight check failed, the last build is untouched")
+        exit(1)
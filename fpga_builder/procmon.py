@@ -0,0 +1,222 @@
+# Copyright (c) 2022, Intrepid Control Systems, Inc.
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice, this
+#    list of conditions and the following disclaimer.
+#
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+#    this list of conditions and the following disclaimer in the documentation
+#    and/or other materials provided with the distribution.
+#
+# 3. Neither the name of the copyright holder nor the names of its
+#    contributors may be used to endorse or promote products derived from
+#    this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+# OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+
+"""
+Copyright 2022 Intrepid Control Systems
+
+Helpers for looking at a process and its children
+Relies on /proc, so everything quietly reports nothing on other platforms
+
+"""
+
+from pathlib import Path
+
+PROC_DIR = Path("/proc")
+
+
+def get_children(pid):
+    """
+    Gets the direct children of a process
+
+    Args:
+        pid: The process id
+
+    Returns:
+        A list of child pids, empty if unknown
+
+    """
+    children = []
+    for children_file in (PROC_DIR / str(pid) / "task").glob("*/children"):
+        try:
+            children.extend(int(child) for child in children_file.read_text().split())
+        except (OSError, ValueError):
+            continue
+    return children
+
+
+def get_process_tree(pid):
+    """
+    Gets a process and all of its descendants
+
+    Args:
+        pid: The process id at the root of the tree
+
+    Returns:
+        A list of pids, starting with pid
+
+    """
+    tree = [pid]
+    idx = 0
+    while idx < len(tree):
+        tree.extend(get_children(tree[idx]))
+        idx += 1
+    return tree
+
+
+def get_rss(pid):
+    """
+    Gets the resident memory of a single process
+
+    Args:
+        pid: The process id
+
+    Returns:
+        The resident set size in bytes, 0 if unknown
+
+    """
+    try:
+        status = (PROC_DIR / str(pid) / "status").read_text()
+    except OSError:
+        return 0
+    for line in status.splitlines():
+        if line.startswith("VmRSS:"):
+            # Always reported in kB
+            return int(line.split()[1]) * 1024
+    return 0
+
+
+def get_tree_rss(pid):
+    """
+    Gets the resident memory of a process and all of its descendants
+
+    Args:
+        pid: The process id at the root of the tree
+
+    Returns:
+        The total resident set size in bytes, 0 if unknown
+
+    """
+    return sum(get_rss(child) for child in get_process_tree(pid))
+
+
+def get_available_memory():
+    """
+    Gets how much memory can be used without swapping
+
+    Returns:
+        MemAvailable in bytes, None if unknown
+
+    """
+    try:
+        meminfo = (PROC_DIR / "meminfo").read_text()
+    except OSError:
+        return None
+    for line in meminfo.splitlines():
+        if line.startswith("MemAvailable:"):
+            return int(line.split()[1]) * 1024
+    return None
+
+
+def find_processes(name):
+    """
+    Finds every process running a program
+
+    Args:
+        name: The program name, as in /proc/<pid>/comm
+
+    Returns:
+        A list of pids
+
+    """
+    pids = []
+    for comm_file in PROC_DIR.glob("[0-9]*/comm"):
+        try:
+            if comm_file.read_text().strip() == name:
+                pids.append(int(comm_file.parent.name))
+        except (OSError, ValueError):
+            continue
+    return pids
+
+
+def get_parent(pid):
+    """
+    Gets the parent of a process
+
+    Args:
+        pid: The process id
+
+    Returns:
+        The parent pid, None if unknown
+
+    """
+    try:
+        stat = (PROC_DIR / str(pid) / "stat").read_text()
+    except OSError:
+        return None
+    # The command name is in parentheses and may hold spaces, fields follow it
+    fields = stat.rsplit(")", 1)[-1].split()
+    try:
+        return int(fields[1])
+    except (IndexError, ValueError):
+        return None
+
+
+def get_cpu_ticks(pid):
+    """
+    Gets the CPU time a process has used and its thread count
+
+    Args:
+        pid: The process id
+
+    Returns:
+        A tuple of (user + system time in clock ticks, threads), None if unknown
+
+    """
+    try:
+        stat = (PROC_DIR / str(pid) / "stat").read_text()
+    except OSError:
+        return None
+    # Fields after the command name start at field 3 (state)
+    fields = stat.rsplit(")", 1)[-1].split()
+    try:
+        return int(fields[11]) + int(fields[12]), int(fields[17])
+    except (IndexError, ValueError):
+        return None
+
+
+def get_io(pid):
+    """
+    Gets the bytes a process has read from and written to storage
+
+    Args:
+        pid: The process id
+
+    Returns:
+        A tuple of (read_bytes, write_bytes), None if unknown or not permitted
+
+    """
+    counters = {}
+    try:
+        lines = (PROC_DIR / str(pid) / "io").read_text().splitlines()
+    except OSError:
+        return None
+    for line in lines:
+        name, _, value = line.partition(":")
+        counters[name] = int(value)
+    return counters.get("read_bytes", 0), counters.get("write_bytes", 0)
@@ -0,0 +1,355 @@
+# Copyright (c) 2022, Intrepid Control Systems, Inc.
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice, this
+#    list of conditions and the following disclaimer.
+#
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+#    this list of conditions and the following disclaimer in the documentation
+#    and/or other materials provided with the distribution.
+#
+# 3. Neither the name of the copyright holder nor the names of its
+#    contributors may be used to endorse or promote products derived from
+#    this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+# OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+"""
+Copyright 2022 Intrepid Control Systems
+
+Live build progress, with the time left estimated from earlier builds
+On a terminal a status line is redrawn below the log, otherwise (i.e. in CI) a
+line is printed on each stage change and every so often in between
+
+"""
+
+import queue
+import shutil
+import socket
+import statistics
+import sys
+import threading
+import time
+from os import environ
+
+from .utils import print, set_status
+from . import logstore
+from . import metrics
+
+REDRAW_SECONDS = 1
+LINE_SECONDS = 60
+# How often a build in a worker process sends its status to the parent
+REPORT_SECONDS = 5
+# How many recent builds to take the stage times from
+ESTIMATE_WINDOW = 10
+
+# Builds in scheduler worker processes send their status here instead of showing it
+_queue = None
+
+
+def set_queue(status_queue):
+    """
+    Sends the status of builds in this process to another process
+    Used as the initializer of the scheduler's workers
+
+    Args:
+        status_queue: A multiprocessing queue read by a `RunDisplay`
+
+    """
+    global _queue
+    _queue = status_queue
+
+
+def is_terminal():
+    return sys.stdout.isatty() and "CI" not in environ
+
+
+def get_estimates(device, num_threads, host=None):
+    """
+    Gets the expected time of each stage from a device's recent builds
+    Only builds on the same host with the same thread count are comparable
+
+    Args:
+        device:      The device name
+        num_threads: The number of threads of this build
+        host:        Host of the builds, this host if None
+
+    Returns:
+        A dictionary of stage name to median seconds, empty without history
+
+    """
+    if host is None:
+        host = socket.gethostname()
+    history = metrics.get_history(device, host, num_threads, limit=ESTIMATE_WINDOW)
+    estimates = {}
+    for stage in logstore.STAGES:
+        times = [build[f"{stage}_time"] for build in history]
+        times = [value for value in times if value is not None]
+        if times:
+            estimates[stage] = statistics.median(times)
+    return estimates
+
+
+def get_expected_stages(build_args, resume_stage=None):
+    """
+    Gets the log stages a build with these arguments will go through
+
+    Args:
+        build_args:   The arguments, at least from `get_build_parser().parse_args()`
+        resume_stage: Build stage an incremental build resumes from, if any
+
+    Returns:
+        A list of stage names from `logstore.STAGES`
+
+    """
+    if build_args.bd_only:
+        last = "setup"
+    elif build_args.synth_only:
+        last = "synth"
+    elif build_args.impl_only:
+        last = "report"
+    else:
+        last = logstore.STAGES[-1]
+    expected = logstore.STAGES[: logstore.STAGES.index(last) + 1]
+    # Resumed builds open the project and skip straight ahead
+    if resume_stage in ("impl", "bitstream"):
+        expected.remove("synth")
+    if resume_stage == "bitstream" and "impl" in expected:
+        expected.remove("impl")
+    return expected
+
+
+def format_duration(seconds):
+    seconds = int(seconds)
+    hours, seconds = divmod(seconds, 3600)
+    minutes, seconds = divmod(seconds, 60)
+    if hours:
+        return f"{hours}:{minutes:02}:{seconds:02}"
+    return f"{minutes:02}:{seconds:02}"
+
+
+def format_status(status, width=0):
+    """
+    Formats the status of a build as a single line
+
+    Args:
+        status: A status dictionary from `BuildProgress.get_status`
+        width:  Pad the device name to this width
+
+    Returns:
+        The line, i.e. "dev_a  impl 3/6  12:04 elapsed  ~08:30 left (58%)"
+
+    """
+    line = f"{status['device']:<{width}}  {status['stage']}"
+    if status["stage_index"] is not None:
+        line += f" {status['stage_index'] + 1}/{status['num_stages']}"
+    line += f"  {format_duration(status['elapsed'])} elapsed"
+    if status["done"]:
+        return line + "  done"
+    eta = status["eta"]
+    if eta is None:
+        return line + "  no earlier builds to estimate from"
+    total = status["elapsed"] + eta
+    percent = int(100 * status["elapsed"] / total) if total else 100
+    if eta == 0:
+        # Slower than every earlier build, the estimate is no use anymore
+        return line + "  overdue"
+    return line + f"  ~{format_duration(eta)} left ({percent}%)"
+
+
+class BuildProgress:
+    """
+    Follows the stages of a single build and estimates the time it has left
+    """
+
+    def __init__(self, device, estimates, stages):
+        self.device = device
+        self.estimates = estimates
+        self.stages = stages
+        self.stage = stages[0] if stages else logstore.STAGES[0]
+        self.begin()
+        self.done = False
+
+    def begin(self):
+        """
+        Starts the clock, i.e. once the build is done waiting for the host
+        """
+        self.start = time.time()
+        self.stage_start = self.start
+
+    def update(self, stage):
+        """
+        Moves on to a new stage
+
+        Args:
+            stage: The stage that's running now
+
+        """
+        if stage != self.stage:
+            self.stage = stage
+            self.stage_start = time.time()
+
+    def get_eta(self):
+        """
+        Gets the seconds this build has left
+
+        Returns:
+            The estimate, or None if a stage still to run has no earlier times
+
+        """
+        if self.stage not in self.stages:
+            return None
+        remaining = self.stages[self.stages.index(self.stage) :]
+        if any(stage not in self.estimates for stage in remaining):
+            return None
+        in_stage = time.time() - self.stage_start
+        eta = max(self.estimates[self.stage] - in_stage, 0)
+        return eta + sum(self.estimates[stage] for stage in remaining[1:])
+
+    def get_status(self):
+        return {
+            "device": self.device,
+            "stage": self.stage,
+            "stage_index": (
+                self.stages.index(self.stage) if self.stage in self.stages else None
+            ),
+            "num_stages": len(self.stages),
+            "elapsed": time.time() - self.start,
+            "eta": self.get_eta(),
+            "done": self.done,
+        }
+
+
+class ProgressMonitor(threading.Thread):
+    """
+    Shows the progress of a build while it runs, or sends it to the parent process
+    """
+
+    def __init__(self, progress, interval=LINE_SECONDS, enabled=True):
+        super().__init__(daemon=True)
+        self.progress = progress
+        self.interval = interval
+        self.enabled = enabled
+        self.terminal = _queue is None and is_terminal()
+        self.stopped = threading.Event()
+
+    def publish(self, last_sent, last_stage):
+        """
+        Shows or sends the current status
+
+        Args:
+            last_sent:  When a line was last printed or a status sent
+            last_stage: The stage at that time
+
+        Returns:
+            True if a line was printed or a status sent
+
+        """
+        status = self.progress.get_status()
+        if self.terminal:
+            set_status(format_status(status)[: shutil.get_terminal_size().columns - 1])
+            return False
+        interval = REPORT_SECONDS if _queue is not None else self.interval
+        if status["stage"] == last_stage and time.time() - last_sent < interval:
+            return False
+        if _queue is not None:
+            _queue.put(status)
+        else:
+            print(format_status(status))
+        return True
+
+    def start(self):
+        if not self.enabled:
+            return
+        self.progress.begin()
+        super().start()
+
+    def run(self):
+        last_sent = time.time()
+        last_stage = self.progress.stage
+        while not self.stopped.wait(REDRAW_SECONDS):
+            if self.publish(last_sent, last_stage):
+                last_sent = time.time()
+                last_stage = self.progress.stage
+
+    def stop(self):
+        if not self.enabled:
+            return
+        self.stopped.set()
+        if self.is_alive():
+            self.join()
+        if self.terminal:
+            set_status("")
+        self.progress.done = True
+        if _queue is not None:
+            _queue.put(self.progress.get_status())
+
+
+class RunDisplay(threading.Thread):
+    """
+    Prints a line per device for builds running in the scheduler's worker processes
+    The workers print their logs too, so the lines are printed, never redrawn
+    """
+
+    def __init__(self, status_queue, interval=LINE_SECONDS):
+        super().__init__(daemon=True)
+        self.queue = status_queue
+        self.interval = interval
+        self.statuses = {}
+        self.stopped = threading.Event()
+
+    def show(self):
+        width = max(len(device) for device in self.statuses)
+        lines = [format_status(status, width) for status in self.statuses.values()]
+        print("========== Progress ==========\n" + "\n".join(lines))
+
+    def receive(self, timeout):
+        """
+        Takes every status waiting in the queue
+
+        Args:
+            timeout: Seconds to wait for the first one
+
+        Returns:
+            True if a build changed stage or finished
+
+        """
+        changed = False
+        try:
+            status = self.queue.get(timeout=timeout)
+            while True:
+                previous = self.statuses.get(status["device"])
+                if previous is None or (previous["stage"], previous["done"]) != (
+                    status["stage"],
+                    status["done"],
+                ):
+                    changed = True
+                self.statuses[status["device"]] = status
+                status = self.queue.get_nowait()
+        except queue.Empty:
+            pass
+        return changed
+
+    def run(self):
+        last_shown = time.time()
+        while not self.stopped.is_set():
+            changed = self.receive(timeout=1)
+            if self.statuses and (changed or time.time() - last_shown >= self.interval):
+                self.show()
+                last_shown = time.time()
+
+    def stop(self):
+        self.stopped.set()
+        if self.is_alive():
+            self.join()
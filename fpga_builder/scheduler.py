@@ -0,0 +1,187 @@
+# Copyright (c) 2022, Intrepid Control Systems, Inc.
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice, this
+#    list of conditions and the following disclaimer.
+#
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+#    this list of conditions and the following disclaimer in the documentation
+#    and/or other materials provided with the distribution.
+#
+# 3. Neither the name of the copyright holder nor the names of its
+#    contributors may be used to endorse or promote products derived from
+#    this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+# OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+
+"""
+Copyright 2022 Intrepid Control Systems
+
+Schedules builds of several devices at once
+
+"""
+
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+import copy
+import multiprocessing
+import os
+import time
+
+from .utils import err, success, print
+from . import builder
+from . import tuning
+from . import progress
+
+
+def get_total_threads(args):
+    """
+    Gets the number of threads that can be shared between all running builds
+
+    Args:
+        args: The arguments, at least from `get_parser().parse_args()`
+
+    Returns:
+        The global thread budget
+
+    """
+    if args.total_threads is not None:
+        return int(args.total_threads)
+    return os.cpu_count() or 1
+
+
+def build_devices(jobs, args):
+    """
+    Builds several devices concurrently in a bounded process pool
+    The global thread budget is split between the builds that are running
+
+    Args:
+        jobs: List of dictionaries of keyword arguments to `builder.build`, each with a `device_name`
+        args: The arguments, at least from `get_parser().parse_args()`
+
+    Returns:
+        A list of result dictionaries with device, passed, stats, error, time and num_threads
+
+    """
+    max_jobs = max(1, min(int(args.jobs), len(jobs)))
+    free_threads = get_total_threads(args)
+    print(
+        f"Building {len(jobs)} devices, {max_jobs} at a time with {free_threads} threads"
+    )
+    pending = list(jobs)
+    running = {}
+    results = []
+    # Workers send their progress here, the parent prints it for all of them
+    status_queue = None if args.no_progress else multiprocessing.Queue()
+    display = progress.RunDisplay(status_queue, args.progress_interval)
+    if status_queue is not None:
+        display.start()
+    with ProcessPoolExecutor(
+        max_workers=max_jobs,
+        initializer=progress.set_queue,
+        initargs=(status_queue,),
+    ) as executor:
+        while pending or running:
+            while pending and len(running) < max_jobs:
+                # Share what's left between the slots we're about to fill
+                open_slots = min(max_jobs - len(running), len(pending))
+                # Vivado can't use more than its maximum, leave the rest for others
+                share = min(free_threads // open_slots, tuning.VIVADO_MAX_THREADS)
+                num_threads = max(1, share)
+                free_threads -= num_threads
+                job = pending.pop(0)
+                job_args = copy.copy(args)
+                if str(args.num_threads) == tuning.AUTO:
+                    # Auto tuning picks within this share
+                    job_args.thread_budget = num_threads
+                else:
+                    job_args.num_threads = num_threads
+                print(f"Starting {job['device_name']} with {num_threads} threads")
+                future = executor.submit(_build_worker, job, job_args)
+                running[future] = num_threads
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                free_threads += running.pop(future)
+                result = future.result()
+                if result["passed"]:
+                    success(f"{result['device']} passed")
+                else:
+                    err(f"{result['device']} failed")
+                results.append(result)
+    display.stop()
+    return results
+
+
+def _build_worker(job, args):
+    """
+    Runs a single build in a worker process and captures the outcome
+
+    Args:
+        job:  Dictionary of keyword arguments to `builder.build`
+        args: The arguments for this build with its share of the threads
+
+    Returns:
+        A result dictionary
+
+    """
+    device = job["device_name"]
+    args = tuning.resolve(args, device)
+    result = {
+        "device": device,
+        "passed": False,
+        "stats": "",
+        "error": "",
+        "time": 0,
+        "num_threads": args.num_threads,
+    }
+    start = time.time()
+    try:
+        builder.build(args=args, log_prefix=f"[{device}] ", **job)
+        result["passed"] = True
+        result["stats"] = builder.get_stats(job["run_dir"], args.num_threads)
+    except SystemExit as e:
+        result["error"] = f"exited with code {e.code}"
+    except Exception as e:
+        # Full command is already in the log, just keep the reason
+        lines = str(e).strip().splitlines() or [repr(e)]
+        result["error"] = " ".join(lines[-1].split())
+    result["time"] = int(time.time() - start)
+    return result
+
+
+def print_summary(results):
+    """
+    Prints the stats of every build followed by a combined pass/fail table
+
+    Args:
+        results: Result dictionaries from `build_devices`
+
+    Returns:
+        True if every build passed
+
+    """
+    for result in results:
+        if result["stats"]:
+            print(f"========== {result['device']} ==========")
+            print(result["stats"])
+    print("========== Summary ==========")
+    width = max(len(result["device"]) for result in results)
+    for result in results:
+        line = f"{result['device']:<{width}}  {result['time']:>6} sec  p{result['num_threads']}"
+        if result["passed"]:
+            success(f"{line}  PASS")
+        else:
+            err(f"{line}  FAIL  {result['error']}")
+    return all(result["passed"] for result in results)
@@ -0,0 +1,278 @@
+# Copyright (c) 2022, Intrepid Control Systems, Inc.
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice, this
+#    list of conditions and the following disclaimer.
+#
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+#    this list of conditions and the following disclaimer in the documentation
+#    and/or other materials provided with the distribution.
+#
+# 3. Neither the name of the copyright holder nor the names of its
+#    contributors may be used to endorse or promote products derived from
+#    this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+# OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+"""
+Copyright 2022 Intrepid Control Systems
+
+Persistent index of the HDL sources under a directory
+Only directories whose mtime changed since the last walk are listed again, the
+rest come straight from the index
+
+"""
+
+import json
+import os
+import sqlite3
+import time
+from concurrent.futures import ThreadPoolExecutor
+from os import environ
+from pathlib import Path
+
+from .utils import get_data_dir
+
+HDL_EXTENSIONS = [".vhd"]
+DEFAULT_STANDARD = "VHDL 2008"
+
+# Directory listings are I/O bound, so walk with plenty of threads
+SCAN_THREADS = 16
+
+# A directory changed this recently could still change within the same mtime tick,
+# so it is listed again next time rather than trusted
+RACY_SECONDS = 2
+
+# Bump when what gets listed changes, older indexes are rebuilt
+INDEX_FORMAT = 1
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS dirs (
+    path TEXT PRIMARY KEY,
+    mtime INTEGER,
+    subdirs TEXT
+);
+CREATE TABLE IF NOT EXISTS files (
+    path TEXT PRIMARY KEY,
+    dir TEXT,
+    library TEXT,
+    standard TEXT,
+    size INTEGER,
+    mtime INTEGER
+);
+CREATE INDEX IF NOT EXISTS files_dir ON files (dir);
+"""
+
+
+def get_index_file():
+    """
+    Gets the source index database
+    Defaults to sources.db in the data dir, override with FPGA_BUILDER_SOURCE_INDEX
+
+    Returns:
+        A Path to the database
+
+    """
+    if "FPGA_BUILDER_SOURCE_INDEX" in environ:
+        return Path(environ["FPGA_BUILDER_SOURCE_INDEX"])
+    return get_data_dir() / "sources.db"
+
+
+def get_library(file):
+    """
+    Gets the library of a source from where it sits
+    Files in a dsn directory belong to the library two levels up
+
+    Args:
+        file: The source Path
+
+    Returns:
+        The library name
+
+    """
+    file = Path(file)
+    if file.parent.name == "dsn":
+        return file.parents[2].name
+    return file.parent.name
+
+
+def _subtree_range(root):
+    # Every path under root sorts between root + sep and root + the next character
+    return root + os.sep, root + chr(ord(os.sep) + 1)
+
+
+def _scan_dir(path, cached):
+    """
+    Lists a directory unless its mtime matches the index
+
+    Args:
+        path:   The directory to list
+        cached: The (mtime, subdirs) in the index, None if not indexed
+
+    Returns:
+        A tuple of (path, mtime, subdirs, files), mtime is None if the directory is
+        gone and files is None if the index is still up to date
+
+    """
+    try:
+        mtime = os.stat(path).st_mtime_ns
+    except OSError:
+        return path, None, [], None
+    if cached is not None and cached[0] == mtime:
+        return path, mtime, cached[1], None
+    subdirs = []
+    files = []
+    try:
+        with os.scandir(path) as entries:
+            for entry in entries:
+                # Like rglob, don't follow linked directories, they could loop
+                if entry.is_dir(follow_symlinks=False):
+                    subdirs.append(entry.path)
+                elif os.path.splitext(entry.name)[1] in HDL_EXTENSIONS:
+                    stat = entry.stat()
+                    files.append((entry.path, stat.st_size, stat.st_mtime_ns))
+    except OSError:
+        return path, None, [], None
+    if time.time_ns() - mtime < RACY_SECONDS * 1e9:
+        mtime = -1
+    return path, mtime, sorted(subdirs), sorted(files)
+
+
+class SourceIndex:
+    """
+    The HDL sources under any directory walked so far, kept in a sqlite database
+    """
+
+    def __init__(self, index_file=None, threads=SCAN_THREADS):
+        self.index_file = Path(index_file or get_index_file())
+        self.threads = threads
+        self.connection = sqlite3.connect(str(self.index_file), timeout=60)
+        with self.connection:
+            (version,) = self.connection.execute("PRAGMA user_version").fetchone()
+            if version != INDEX_FORMAT:
+                self.connection.execute("DROP TABLE IF EXISTS dirs")
+                self.connection.execute("DROP TABLE IF EXISTS files")
+                self.connection.execute(f"PRAGMA user_version = {INDEX_FORMAT}")
+        self.connection.executescript(SCHEMA)
+
+    def close(self):
+        self.connection.close()
+
+    def _get_cached_dirs(self, root, recursive):
+        query = "SELECT path, mtime, subdirs FROM dirs WHERE path = ?"
+        params = [root]
+        if recursive:
+            query += " OR (path >= ? AND path < ?)"
+            params.extend(_subtree_range(root))
+        rows = self.connection.execute(query, params)
+        return {path: (mtime, json.loads(subdirs)) for path, mtime, subdirs in rows}
+
+    def update(self, root, recursive=True):
+        """
+        Brings the index up to date for a directory, listing only what changed
+
+        Args:
+            root:      The directory to walk
+            recursive: Walk subdirectories too
+
+        Returns:
+            The set of directories found under root
+
+        """
+        root = os.path.abspath(root)
+        cached_dirs = self._get_cached_dirs(root, recursive)
+        visited = set()
+        changed = []
+        level = [root]
+        with ThreadPoolExecutor(max_workers=self.threads) as pool:
+            while level:
+                scans = pool.map(
+                    lambda path: _scan_dir(path, cached_dirs.get(path)), level
+                )
+                level = []
+                for path, mtime, subdirs, files in scans:
+                    if mtime is None:
+                        continue
+                    visited.add(path)
+                    if files is not None:
+                        changed.append((path, mtime, subdirs, files))
+                    if recursive:
+                        level.extend(subdirs)
+
+        removed = set(cached_dirs) - visited
+        with self.connection:
+            for path in removed:
+                self.connection.execute("DELETE FROM dirs WHERE path = ?", (path,))
+                self.connection.execute("DELETE FROM files WHERE dir = ?", (path,))
+            for path, mtime, subdirs, files in changed:
+                self.connection.execute(
+                    "INSERT OR REPLACE INTO dirs VALUES (?, ?, ?)",
+                    (path, mtime, json.dumps(subdirs)),
+                )
+                self.connection.execute("DELETE FROM files WHERE dir = ?", (path,))
+                self.connection.executemany(
+                    "INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?, ?, ?)",
+                    [
+                        (file, path, get_library(file), DEFAULT_STANDARD, size, mtime)
+                        for file, size, mtime in files
+                    ],
+                )
+        return visited
+
+    def get_files(self, root, recursive=True):
+        """
+        Gets the indexed sources under a directory, updating the index first
+
+        Args:
+            root:      The directory to look in
+            recursive: Include subdirectories
+
+        Returns:
+            A sorted list of (path, library, standard, size, mtime) tuples
+
+        """
+        root = os.path.abspath(root)
+        visited = self.update(root, recursive)
+        query = (
+            "SELECT path, dir, library, standard, size, mtime FROM files WHERE dir = ?"
+        )
+        params = [root]
+        if recursive:
+            query += " OR (dir >= ? AND dir < ?)"
+            params.extend(_subtree_range(root))
+        rows = self.connection.execute(query + " ORDER BY path", params)
+        return [
+            (path, library, standard, size, mtime)
+            for path, directory, library, standard, size, mtime in rows
+            if directory in visited
+        ]
+
+
+def get_sources(root, recursive=True):
+    """
+    Gets the HDL sources under a directory through the source index
+
+    Args:
+        root:      The directory to look in
+        recursive: Include subdirectories
+
+    Returns:
+        A sorted list of (path, library, standard, size, mtime) tuples
+
+    """
+    index = SourceIndex()
+    try:
+        return index.get_files(root, recursive)
+    finally:
+        index.close()
@@ -0,0 +1,187 @@
+# Copyright (c) 2022, Intrepid Control Systems, Inc.
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice, this
+#    list of conditions and the following disclaimer.
+#
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+#    this list of conditions and the following disclaimer in the documentation
+#    and/or other materials provided with the distribution.
+#
+# 3. Neither the name of the copyright holder nor the names of its
+#    contributors may be used to endorse or promote products derived from
+#    this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+# OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+
+"""
+Copyright 2022 Intrepid Control Systems
+
+Tracks the inputs of each build stage so an existing project can be resumed
+from the first stage whose inputs changed
+
+"""
+
+import hashlib
+import json
+from pathlib import Path
+
+from .cache import get_referenced_files, get_digest
+
+# In build order, see `build` in utils.tcl
+STAGES = ["bd", "synth", "impl", "bitstream"]
+
+STATE_FILE = "stages.json"
+
+HDL_EXTENSIONS = (".vhd", ".vhdl", ".v", ".sv", ".vh", ".svh", ".mem", ".coe")
+CONSTRAINT_EXTENSIONS = (".xdc", ".sdc")
+
+
+def get_fingerprints(
+    build_tcl,
+    utils_tcl,
+    filelist,
+    vivado_version,
+    tcl_args,
+    usr_access,
+    design_version,
+    impl_strategies=None,
+):
+    """
+    Fingerprints the inputs of each build stage separately
+    Anything that changes the project itself (scripts, BD, IP, the set of files) is a
+    bd input, HDL content is a synth input, constraint content is an impl input and
+    the bitstream only depends on USR_ACCESS and the design version
+
+    Args:
+        build_tcl:      The top level tcl script for the build
+        utils_tcl:      The utils.tcl used by the build
+        filelist:       The generated filelist.tcl, may not exist
+        vivado_version: The vivado version string
+        tcl_args:       The user tcl args given to the build
+        usr_access:     The USR_ACCESS value for the bitstream
+        design_version: The design version string
+        impl_strategies: Extra implementation strategies being explored
+
+    Returns:
+        A dictionary of stage name to hex digest
+
+    """
+    files = set()
+    for script in (build_tcl, utils_tcl, filelist):
+        script = Path(script)
+        if script.exists():
+            files.add(script.resolve())
+            get_referenced_files(script, files)
+    hashers = {stage: hashlib.sha256() for stage in STAGES}
+    header = [vivado_version, [str(arg) for arg in tcl_args or []]]
+    hashers["bd"].update(json.dumps(header).encode())
+    for path in sorted(files):
+        name = path.as_posix().encode() + b"\0"
+        # Adding or removing any file means a new project
+        hashers["bd"].update(name)
+        if path.suffix in HDL_EXTENSIONS:
+            stage = "synth"
+        elif path.suffix in CONSTRAINT_EXTENSIONS:
+            stage = "impl"
+        else:
+            stage = "bd"
+        hashers[stage].update(name)
+        hashers[stage].update(get_digest(path).encode())
+    if impl_strategies:
+        hashers["impl"].update(json.dumps(impl_strategies).encode())
+    hashers["bitstream"].update(json.dumps([str(usr_access), design_version]).encode())
+    return {stage: hasher.hexdigest() for stage, hasher in hashers.items()}
+
+
+def get_completed_stages(build_args):
+    """
+    Gets the stages a successful build with these arguments will have run
+
+    Args:
+        build_args: The arguments, at least from `get_build_parser().parse_args()`
+
+    Returns:
+        A list of stage names
+
+    """
+    if build_args.bd_only:
+        last = "bd"
+    elif build_args.synth_only:
+        last = "synth"
+    elif build_args.impl_only:
+        last = "impl"
+    else:
+        last = "bitstream"
+    return STAGES[: STAGES.index(last) + 1]
+
+
+def get_resume_stage(run_dir, fingerprints, wanted_stages):
+    """
+    Determines the first stage that has to be rerun for an existing project
+
+    Args:
+        run_dir:       The run directory of the existing build
+        fingerprints:  Current fingerprints from `get_fingerprints`
+        wanted_stages: Stages this build should finish, from `get_completed_stages`
+
+    Returns:
+        The stage name to resume from, or None if everything is up to date
+
+    """
+    state_file = run_dir / STATE_FILE
+    if not state_file.exists():
+        return STAGES[0]
+    state = json.loads(state_file.read_text())
+    for stage in wanted_stages:
+        if stage not in state["completed"]:
+            return stage
+        if state["fingerprints"].get(stage) != fingerprints[stage]:
+            return stage
+    return None
+
+
+def save(run_dir, fingerprints, completed):
+    """
+    Records the fingerprints of the stages a build finished
+
+    Args:
+        run_dir:      The run directory of the build
+        fingerprints: Fingerprints from `get_fingerprints`
+        completed:    Stage names the build finished
+
+    Returns:
+        None
+
+    """
+    state = {"fingerprints": fingerprints, "completed": completed}
+    (run_dir / STATE_FILE).write_text(json.dumps(state, indent=2))
+
+
+def clear(run_dir):
+    """
+    Forgets the recorded stages, so a failed build is never resumed from
+
+    Args:
+        run_dir: The run directory of the build
+
+    Returns:
+        None
+
+    """
+    state_file = run_dir / STATE_FILE
+    if state_file.exists():
+        state_file.unlink()
@@ -0,0 +1,245 @@
+# Copyright (c) 2022, Intrepid Control Systems, Inc.
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice, this
+#    list of conditions and the following disclaimer.
+#
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+#    this list of conditions and the following disclaimer in the documentation
+#    and/or other materials provided with the distribution.
+#
+# 3. Neither the name of the copyright holder nor the names of its
+#    contributors may be used to endorse or promote products derived from
+#    this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+# OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+"""
+Copyright 2022 Intrepid Control Systems
+
+Sweeps the generics of blocks and ranks the combinations
+i.e. `python -m fpga_builder sweep blocks.json -j 8`
+
+"""
+
+import hashlib
+import itertools
+import json
+import re
+from pathlib import Path
+
+from .utils import get_data_dir, err, info, print
+from .cache import get_digest
+from . import builder
+from . import farm
+from . import filelists
+
+# Bump when the key contents change so old results are never hit
+CACHE_FORMAT = 3
+
+# Ways to rank results, and the sort key of each, best first
+RANKINGS = {
+    "slack": lambda row: -row["worst_slack"],
+    "lut": lambda row: row["lut_util"],
+    "ram": lambda row: row["ram_util"],
+    "time": lambda row: row["time"],
+}
+
+
+def get_results_dir():
+    results_dir = get_data_dir() / "sweeps"
+    results_dir.mkdir(parents=True, exist_ok=True)
+    return results_dir
+
+
+def expand(block):
+    """
+    Expands a block's sweep into one block per generics combination
+    The sweep is either a dictionary of generic to a list of values, which is
+    expanded as a grid, or a list of generics dictionaries
+    Swept generics are applied on top of the block's own generics
+
+    Args:
+        block: A block dictionary, see `farm.load_blocks`, with an optional sweep
+
+    Returns:
+        A list of block dictionaries, named after the generics they set
+
+    """
+    block = dict(block)
+    sweep = block.pop("sweep", None)
+    if not sweep:
+        return [block]
+    if isinstance(sweep, dict):
+        names = list(sweep)
+        combinations = [
+            dict(zip(names, values)) for values in itertools.product(*sweep.values())
+        ]
+    else:
+        combinations = sweep
+    base_name = block.get("name") or block["blk_dir"].name
+    blocks = []
+    for combination in combinations:
+        swept = dict(block)
+        swept["generics"] = {**(block.get("generics") or {}), **combination}
+        suffix = "_".join(f"{key}{value}" for key, value in combination.items())
+        # Names become build directories, keep them to plain characters
+        suffix = re.sub(r"[^\w.-]", "", suffix)
+        swept["name"] = f"{base_name}_{suffix}"
+        blocks.append(swept)
+    return blocks
+
+
+def get_key(block, args):
+    """
+    Hashes everything that affects the result of a block build
+
+    Args:
+        block: An expanded block dictionary
+        args:  The arguments, the thread settings change the build time
+
+    Returns:
+        The hex digest
+
+    """
+    hasher = hashlib.sha256()
+    hasher.update(f"{CACHE_FORMAT}\n".encode())
+    settings = {key: value for key, value in block.items() if key != "name"}
+    # The scheduler splits total_threads between jobs unless num_threads is auto
+    settings["threads"] = [str(args.num_threads), args.total_threads, args.jobs]
+    hasher.update(json.dumps(settings, default=str, sort_keys=True).encode())
+    files = [
+        builder.BUILD_BLK_TCL_SCRIPT,
+        builder.THIS_DIR / "utils.tcl",
+        filelists.get_generator_file(),
+    ]
+    for key in farm.PATH_KEYS:
+        # The build directory is an output
+        if key == "build_dir" or block.get(key) is None:
+            continue
+        path = Path(block[key])
+        if path.is_dir():
+            # i.e. blk_dir and ip_repo
+            files.extend(sorted(file for file in path.rglob("*") if file.is_file()))
+        elif path.is_file():
+            files.append(path)
+    for key in farm.PATH_LIST_KEYS:
+        files.extend(block.get(key) or [])
+    # Block builds generate their filelist from BASE_DIR/blocks.yaml
+    files.extend(filelists.get_manifests(builder.BASE_DIR / "blocks.yaml"))
+    for file in files:
+        hasher.update(f"{Path(file).as_posix()}\n".encode())
+        hasher.update(get_digest(file).encode())
+    return hasher.hexdigest()
+
+
+def run_sweep(blocks, args):
+    """
+    Builds every generics combination of the blocks, reusing earlier results
+
+    Args:
+        blocks: A list of block dictionaries, see `expand`
+        args:   The arguments, at least from `builder.get_build_parser().parse_args()`
+
+    Returns:
+        A list of result dictionaries like `farm.build_blocks`, plus generics and
+        whether the result came from the cache
+
+    """
+    expanded = [swept for block in blocks for swept in expand(block)]
+    keys = {}
+    results = {}
+    to_build = []
+    for block in expanded:
+        name = block.get("name") or block["blk_dir"].name
+        keys[name] = get_key(block, args)
+        result_file = get_results_dir() / f"{keys[name]}.json"
+        if not args.no_cache and result_file.exists():
+            results[name] = json.loads(result_file.read_text())
+            results[name].update(block=name, cached=True)
+        else:
+            to_build.append(block)
+    info(f"{len(expanded)} combinations, {len(results)} already built")
+    if to_build:
+        for row in farm.build_blocks(to_build, args):
+            row["cached"] = False
+            results[row["block"]] = row
+            # Failures could be the machine rather than the design, always retry them
+            if row["passed"]:
+                result_file = get_results_dir() / f"{keys[row['block']]}.json"
+                result_file.write_text(json.dumps(row, indent=2))
+    ranked = []
+    for block in expanded:
+        name = block.get("name") or block["blk_dir"].name
+        row = results[name]
+        row["generics"] = block.get("generics") or {}
+        ranked.append(row)
+    return ranked
+
+
+def rank(results, rank_by):
+    """
+    Orders results best first, failures and missing stats last
+
+    Args:
+        results: Result dictionaries from `run_sweep`
+        rank_by: List of RANKINGS names, most important first
+
+    Returns:
+        A new sorted list
+
+    """
+
+    def sort_key(row):
+        complete = row["passed"] and all(
+            row[stat] is not None for stat in farm.RESULT_STATS
+        )
+        if not complete:
+            return (1,)
+        return (0, *(RANKINGS[name](row) for name in rank_by))
+
+    return sorted(results, key=sort_key)
+
+
+def setup_sweep_parser(parser):
+    parser.add_argument(
+        "blocks_file",
+        help="Json file listing the blocks to build, each with an optional sweep",
+    )
+    parser.add_argument(
+        "--rank-by",
+        default="slack,lut,ram,time",
+        help=f"Comma separated order to rank results by, from {list(RANKINGS)}",
+    )
+    parser.add_argument(
+        "--results",
+        default=None,
+        help="Also write the ranked results to this json file",
+    )
+    parser = builder._add_build_args(parser)
+    return parser
+
+
+def sweep_main(args):
+    rank_by = args.rank_by.split(",")
+    for name in rank_by:
+        if name not in RANKINGS:
+            err(f"ERROR: Can't rank by {name}, choose from {list(RANKINGS)}")
+            exit(1)
+    results = rank(run_sweep(farm.load_blocks(args.blocks_file), args), rank_by)
+    all_passed = farm.print_results(results)
+    if args.results:
+        Path(args.results).write_text(json.dumps(results, indent=2))
+    if not all_passed:
+        exit(1)
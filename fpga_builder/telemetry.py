@@ -0,0 +1,244 @@
+# Copyright (c) 2022, Intrepid Control Systems, Inc.
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice, this
+#    list of conditions and the following disclaimer.
+#
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+#    this list of conditions and the following disclaimer in the documentation
+#    and/or other materials provided with the distribution.
+#
+# 3. Neither the name of the copyright holder nor the names of its
+#    contributors may be used to endorse or promote products derived from
+#    this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+# OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+"""
+Copyright 2022 Intrepid Control Systems
+
+Resource timeline of a build
+Samples CPU, memory, threads and disk I/O of a process tree at a fixed interval,
+tagged with the build stage running at the time
+
+"""
+
+import csv
+import os
+import threading
+import time
+from array import array
+
+from . import procmon
+
+TIMELINE_FILE = "resources.csv"
+SUMMARY_FILE = "resources.txt"
+SAMPLE_SECONDS = 2
+
+MB = 1024**2
+GB = 1024**3
+
+TICKS_PER_SECOND = os.sysconf("SC_CLK_TCK") if hasattr(os, "sysconf") else 100
+
+COLUMNS = ["time", "stage", "cpu_cores", "rss_mb", "threads", "read_mb_s", "write_mb_s"]
+
+
+class ResourceSampler(threading.Thread):
+    """
+    Samples a process tree until stopped, keeping the timeline in arrays
+    Nothing is sampled until there is a pid, see `attach`
+    """
+
+    def __init__(self, pid, get_stage, on_stage=None, interval=SAMPLE_SECONDS):
+        super().__init__(daemon=True)
+        self.pid = pid
+        self._sampled_pid = None
+        self.get_stage = get_stage
+        self.on_stage = on_stage
+        self.interval = interval
+        self.stopped = threading.Event()
+        self.stage_names = []
+        self.times = array("d")
+        self.stages = array("H")
+        self.cpu = array("f")
+        self.rss = array("Q")
+        self.threads = array("I")
+        self.reads = array("f")
+        self.writes = array("f")
+        self.peaks = {}
+        self._last = None
+
+    def _take_sample(self, root):
+        """
+        Reads the counters of every process in a tree
+
+        Args:
+            root: The pid at the root of the tree
+
+        Returns:
+            A tuple of (per pid CPU ticks, rss, threads, read bytes, write bytes)
+
+        """
+        ticks = {}
+        rss = 0
+        threads = 0
+        reads = 0
+        writes = 0
+        for pid in procmon.get_process_tree(root):
+            cpu = procmon.get_cpu_ticks(pid)
+            if cpu is None:
+                continue
+            ticks[pid] = cpu[0]
+            threads += cpu[1]
+            rss += procmon.get_rss(pid)
+            io = procmon.get_io(pid)
+            if io is not None:
+                reads += io[0]
+                writes += io[1]
+        return ticks, rss, threads, reads, writes
+
+    def attach(self, pid):
+        """
+        Samples the tree of another process from now on, i.e. vivado once it started
+
+        Args:
+            pid: The root of the tree
+
+        """
+        self.pid = pid
+
+    def sample(self, stage):
+        root = self.pid
+        if root is None:
+            return
+        now = time.monotonic()
+        ticks, rss, threads, reads, writes = self._take_sample(root)
+        if stage not in self.stage_names:
+            self.stage_names.append(stage)
+        if self._last is None:
+            self._last = (now, ticks, reads, writes, now)
+            cpu = read_rate = write_rate = 0
+        elif root != self._sampled_pid:
+            # A reused worker already has counters from its earlier jobs
+            self._last = (now, ticks, reads, writes, self._last[4])
+            cpu = read_rate = write_rate = 0
+        else:
+            last_time, last_ticks, last_reads, last_writes, start = self._last
+            elapsed = max(now - last_time, 1e-3)
+            # Processes that started since the last sample count all of their time
+            used = sum(value - last_ticks.get(pid, 0) for pid, value in ticks.items())
+            cpu = max(used, 0) / TICKS_PER_SECOND / elapsed
+            read_rate = max(reads - last_reads, 0) / MB / elapsed
+            write_rate = max(writes - last_writes, 0) / MB / elapsed
+            self._last = (now, ticks, reads, writes, start)
+        self._sampled_pid = root
+        self.times.append(now - self._last[4])
+        self.stages.append(self.stage_names.index(stage))
+        self.cpu.append(cpu)
+        self.rss.append(rss)
+        self.threads.append(threads)
+        self.reads.append(read_rate)
+        self.writes.append(write_rate)
+        if rss > self.peaks.get(stage, 0):
+            self.peaks[stage] = rss
+
+    def run(self):
+        stage = None
+        while not self.stopped.is_set():
+            new_stage = self.get_stage()
+            if new_stage != stage:
+                stage = new_stage
+                if self.on_stage is not None:
+                    self.on_stage(stage)
+            self.sample(stage)
+            self.stopped.wait(self.interval)
+
+    def stop(self):
+        self.stopped.set()
+        if self.is_alive():
+            self.join()
+
+    def rows(self):
+        for i in range(len(self.times)):
+            yield [
+                f"{self.times[i]:.1f}",
+                str(self.stage_names[self.stages[i]]),
+                f"{self.cpu[i]:.2f}",
+                f"{self.rss[i] / MB:.0f}",
+                self.threads[i],
+                f"{self.reads[i]:.2f}",
+                f"{self.writes[i]:.2f}",
+            ]
+
+    def summarize(self):
+        """
+        Sums up the timeline by stage
+
+        Returns:
+            A list of dictionaries with stage, seconds, peak_rss_gb, mean_cores,
+            max_threads, read_mb and write_mb, in the order the stages ran
+
+        """
+        summary = []
+        for idx, stage in enumerate(self.stage_names):
+            samples = [i for i in range(len(self.times)) if self.stages[i] == idx]
+            # Each sample stands for the interval leading up to it
+            spans = [self.times[i] - self.times[i - 1] if i else 0 for i in samples]
+            seconds = sum(spans)
+            summary.append(
+                {
+                    "stage": stage,
+                    "seconds": seconds,
+                    "peak_rss_gb": max(self.rss[i] for i in samples) / GB,
+                    "mean_cores": (
+                        sum(self.cpu[i] * span for i, span in zip(samples, spans))
+                        / seconds
+                        if seconds
+                        else 0
+                    ),
+                    "max_threads": max(self.threads[i] for i in samples),
+                    "read_mb": sum(self.reads[i] * s for i, s in zip(samples, spans)),
+                    "write_mb": sum(self.writes[i] * s for i, s in zip(samples, spans)),
+                }
+            )
+        return summary
+
+    def save(self, output_dir):
+        """
+        Writes the timeline and its summary
+
+        Args:
+            output_dir: The directory to write TIMELINE_FILE and SUMMARY_FILE to
+
+        Returns:
+            The summary text
+
+        """
+        with open(output_dir / TIMELINE_FILE, "w", newline="") as file:
+            writer = csv.writer(file)
+            writer.writerow(COLUMNS)
+            writer.writerows(self.rows())
+        lines = [
+            f"{'stage':<10} {'seconds':>8} {'peak GB':>8} {'cores':>6} "
+            f"{'threads':>7} {'read MB':>8} {'write MB':>8}"
+        ]
+        for row in self.summarize():
+            lines.append(
+                f"{str(row['stage']):<10} {row['seconds']:>8.0f} {row['peak_rss_gb']:>8.2f} "
+                f"{row['mean_cores']:>6.2f} {row['max_threads']:>7} "
+                f"{row['read_mb']:>8.0f} {row['write_mb']:>8.0f}"
+            )
+        text = "\n".join(lines) + "\n"
+        (output_dir / SUMMARY_FILE).write_text(text)
+        return text
@@ -0,0 +1,276 @@
+# Copyright (c) 2022, Intrepid Control Systems, Inc.
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice, this
+#    list of conditions and the following disclaimer.
+#
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+#    this list of conditions and the following disclaimer in the documentation
+#    and/or other materials provided with the distribution.
+#
+# 3. Neither the name of the copyright holder nor the names of its
+#    contributors may be used to endorse or promote products derived from
+#    this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+# OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+
+"""
+Copyright 2022 Intrepid Control Systems
+
+Registry of installed Xilinx tools
+Install roots are scanned once and the results kept on disk, so finding a tool
+is a lookup instead of a search
+
+"""
+
+import json
+import shutil
+import sys
+from os import environ, getpid, pathsep
+from pathlib import Path
+
+from .utils import get_data_dir, XILINX_BIN_EXTENSION, info, print
+
+# Layout under each root is <root>/<tool>/<version>/bin/<binary>
+TOOLS = {
+    "Vivado": ["vivado"],
+    "Vitis": ["xsct", "vitis"],
+    "SDK": ["xsct"],
+}
+
+if sys.platform == "win32":
+    DEFAULT_ROOTS = ["C:/Xilinx"]
+else:
+    DEFAULT_ROOTS = ["/opt/Xilinx", "/tools/Xilinx"]
+
+# Bump when the index layout changes
+INDEX_FORMAT = 1
+
+_registry = None
+
+
+def get_index_file():
+    return get_data_dir() / "toolchains.json"
+
+
+def get_roots():
+    """
+    Gets the install roots to search
+    FPGA_BUILDER_XILINX_ROOTS can add more, separated like PATH
+    Tools found on PATH add their own root too
+
+    Returns:
+        A list of root directory strings
+
+    """
+    roots = []
+    if "FPGA_BUILDER_XILINX_ROOTS" in environ:
+        roots.extend(environ["FPGA_BUILDER_XILINX_ROOTS"].split(pathsep))
+    roots.extend(DEFAULT_ROOTS)
+    for binaries in TOOLS.values():
+        for binary in binaries:
+            found = shutil.which(binary)
+            if found:
+                # <root>/<tool>/<version>/bin/<binary>
+                parents = Path(found).resolve().parents
+                if len(parents) > 3:
+                    roots.append(str(parents[3]))
+    unique = []
+    for root in roots:
+        root = Path(root).as_posix()
+        if root and root not in unique:
+            unique.append(root)
+    return unique
+
+
+def _get_stamp(path):
+    try:
+        return Path(path).stat().st_mtime
+    except OSError:
+        return None
+
+
+def _get_root_stamps(root):
+    """
+    Gets modification times that change whenever a version is installed or removed
+
+    Args:
+        root: The install root
+
+    Returns:
+        A dictionary of tool name to the mtime of its directory, None if missing
+
+    """
+    return {tool: _get_stamp(Path(root) / tool) for tool in TOOLS}
+
+
+def scan_root(root):
+    """
+    Finds every tool version under an install root
+
+    Args:
+        root: The install root
+
+    Returns:
+        A list of dictionaries with tool, version, and binary name to path
+
+    """
+    found = []
+    for tool, binaries in TOOLS.items():
+        tool_dir = Path(root) / tool
+        if not tool_dir.is_dir():
+            continue
+        for version_dir in sorted(tool_dir.iterdir()):
+            paths = {}
+            for binary in binaries:
+                path = version_dir / "bin" / f"{binary}{XILINX_BIN_EXTENSION}"
+                if path.exists():
+                    paths[binary] = path.as_posix()
+            if paths:
+                found.append(
+                    {"tool": tool, "version": version_dir.name, "binaries": paths}
+                )
+    return found
+
+
+class ToolchainRegistry:
+    """
+    Every tool version found under the install roots, kept in sync with the index file
+    """
+
+    def __init__(self, index_file=None):
+        self.index_file = Path(index_file or get_index_file())
+        self.roots = {}
+        self.search_roots = get_roots()
+        self.load()
+
+    def load(self):
+        try:
+            index = json.loads(self.index_file.read_text())
+        except (OSError, ValueError):
+            return
+        if index.get("format") == INDEX_FORMAT:
+            self.roots = index["roots"]
+
+    def save(self):
+        index = {"format": INDEX_FORMAT, "roots": self.roots}
+        # Builds run by the scheduler can save at the same time
+        tmp_file = self.index_file.with_name(f"{self.index_file.name}.{getpid()}")
+        tmp_file.write_text(json.dumps(index, indent=2))
+        tmp_file.replace(self.index_file)
+
+    def refresh(self, force=False):
+        """
+        Rescans any root that changed since it was last scanned
+
+        Args:
+            force: Rescan every root regardless
+
+        Returns:
+            None
+
+        """
+        changed = False
+        for root in self.search_roots:
+            stamps = _get_root_stamps(root)
+            entry = self.roots.get(root)
+            if not force and entry is not None and entry["stamps"] == stamps:
+                continue
+            if any(stamp is not None for stamp in stamps.values()):
+                info(f"Scanning {root} for Xilinx tools")
+            self.roots[root] = {"stamps": stamps, "tools": scan_root(root)}
+            changed = True
+        if changed:
+            self.save()
+
+    def find(self, binary, version):
+        """
+        Looks up a binary of a tool version
+
+        Args:
+            binary:  The binary name, i.e. vivado or xsct
+            version: The version string, i.e. 2019.1
+
+        Returns:
+            The Path to the binary, or None if it isn't installed
+
+        """
+        for root in self.search_roots:
+            entry = self.roots.get(root)
+            if entry is None:
+                continue
+            for tool in entry["tools"]:
+                path = tool["binaries"].get(binary)
+                if tool["version"] == version and path:
+                    if Path(path).exists():
+                        return Path(path)
+                    # Removed without touching the tool dir, rescan next time
+                    entry["stamps"] = {}
+                    self.save()
+        return None
+
+    def all_tools(self):
+        for root, entry in self.roots.items():
+            for tool in entry["tools"]:
+                yield root, tool
+
+
+def get_registry():
+    """
+    Gets the registry for this run, refreshing it from disk the first time
+
+    Returns:
+        A ToolchainRegistry
+
+    """
+    global _registry
+    if _registry is None:
+        _registry = ToolchainRegistry()
+        _registry.refresh()
+    return _registry
+
+
+def find_tool(binary, version):
+    """
+    Looks up a binary of a tool version in the registry
+
+    Args:
+        binary:  The binary name, i.e. vivado or xsct
+        version: The version string, i.e. 2019.1
+
+    Returns:
+        The Path to the binary, or None if it isn't installed
+
+    """
+    return get_registry().find(binary, version)
+
+
+def setup_toolchains_parser(parser):
+    parser.add_argument(
+        "--rescan",
+        default=False,
+        action="store_true",
+        help="Rescan every install root instead of only the ones that changed",
+    )
+    return parser
+
+
+def toolchains_main(args):
+    registry = ToolchainRegistry()
+    registry.refresh(force=args.rescan)
+    for root, tool in registry.all_tools():
+        for binary, path in tool["binaries"].items():
+            print(f"{tool['tool']:<7} {tool['version']:<8} {binary:<7} {path}")
@@ -0,0 +1,296 @@
+# Copyright (c) 2022, Intrepid Control Systems, Inc.
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice, this
+#    list of conditions and the following disclaimer.
+#
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+#    this list of conditions and the following disclaimer in the documentation
+#    and/or other materials provided with the distribution.
+#
+# 3. Neither the name of the copyright holder nor the names of its
+#    contributors may be used to endorse or promote products derived from
+#    this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+# OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+"""
+Copyright 2022 Intrepid Control Systems
+
+Spans of where a build spends its time, saved in the Chrome trace event format
+Open the trace.json files in chrome://tracing or https://ui.perfetto.dev
+
+"""
+
+import json
+import os
+import re
+import time
+from contextlib import contextmanager
+from pathlib import Path
+
+from .utils import warning
+from . import logstore
+
+TRACE_FILE = "trace.json"
+
+# Lanes of a build in the viewer, python work and what vivado reports doing
+PYTHON_TID = 1
+VIVADO_TID = 2
+
+# i.e. Command: synth_design -top top -part xc7z020clg400-1
+COMMAND_RE = re.compile(r"^Command: (\w+)")
+# i.e. synth_design completed successfully
+# i.e. opt_design: Time (s): cpu = 00:00:02 ; elapsed = 00:00:03 . Memory (MB): ...
+COMMAND_END_RE = re.compile(r"^(\w+)(?: completed successfully|: Time \(s\):)")
+
+# Tracers of the enclosing traces, innermost last
+_active = []
+
+
+def now_us():
+    return time.time() * 1e6
+
+
+class Tracer:
+    """
+    Collects spans for a single trace file
+    """
+
+    def __init__(self, name, path=None):
+        self.name = name
+        self.path = path
+        self.pid = os.getpid()
+        self.events = [
+            self._metadata("process_name", {"name": name}),
+            self._metadata("thread_name", {"name": "python"}, PYTHON_TID),
+            self._metadata("thread_name", {"name": "vivado"}, VIVADO_TID),
+        ]
+
+    def _metadata(self, kind, args, tid=PYTHON_TID):
+        return {"ph": "M", "name": kind, "pid": os.getpid(), "tid": tid, "args": args}
+
+    def add(self, name, start, end, cat="python", tid=PYTHON_TID, args=None):
+        """
+        Adds a finished span
+
+        Args:
+            name:  What the span was doing
+            start: Start time in microseconds since the epoch
+            end:   End time in microseconds since the epoch
+            cat:   Category, used to filter in the viewer
+            tid:   Lane of the span, PYTHON_TID or VIVADO_TID
+            args:  Optional dictionary shown with the span
+
+        """
+        event = {
+            "ph": "X",
+            "name": name,
+            "cat": cat,
+            "ts": round(start),
+            "dur": round(max(end - start, 0)),
+            "pid": self.pid,
+            "tid": tid,
+        }
+        if args:
+            event["args"] = args
+        self.events.append(event)
+
+    @contextmanager
+    def span(self, name, cat="python", **args):
+        """
+        Records the block as a span
+
+        Args:
+            name: What the block does
+            cat:  Category, used to filter in the viewer
+            args: Shown with the span
+
+        """
+        start = now_us()
+        try:
+            yield
+        finally:
+            self.add(name, start, now_us(), cat, args=args or None)
+
+    def merge(self, trace_file):
+        """
+        Adds every event of another trace file, i.e. from a build in a worker process
+
+        Args:
+            trace_file: The trace.json to add
+
+        """
+        try:
+            events = json.loads(Path(trace_file).read_text())["traceEvents"]
+        except (OSError, ValueError, KeyError):
+            return
+        # Pool workers are reused, give every build its own process in the viewer
+        used = {event["pid"] for event in self.events}
+        pid = max(used) + 1
+        for event in events:
+            event["pid"] = pid
+        self.events.extend(events)
+
+    def save(self, path=None):
+        """
+        Writes the trace
+
+        Args:
+            path: Where to write it, defaults to the path given when created
+
+        """
+        path = Path(path or self.path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        try:
+            path.write_text(json.dumps({"traceEvents": self.events}))
+        except OSError as e:
+            warning(f"WARNING: Could not write {path}: {e}")
+
+
+def get_tracer():
+    """
+    Gets the innermost active tracer
+
+    Returns:
+        A Tracer, or None if nothing is being traced
+
+    """
+    return _active[-1] if _active else None
+
+
+def set_path(path):
+    """
+    Sets where the innermost active trace will be written once it ends
+
+    Args:
+        path: The trace file path
+
+    """
+    if _active:
+        _active[-1].path = path
+
+
+@contextmanager
+def activate(tracer):
+    """
+    Makes a tracer the active one inside the block, writing it out at the end
+    Spans also go to any enclosing trace, so a run's trace holds each of its builds
+
+    Args:
+        tracer: The Tracer, it's only written if it has a path by the end
+
+    Yields:
+        The Tracer
+
+    """
+    _active.append(tracer)
+    try:
+        yield tracer
+    finally:
+        _active.remove(tracer)
+        if _active:
+            # Same process as the enclosing trace, which already names it
+            _active[-1].events.extend(
+                event for event in tracer.events if event["ph"] != "M"
+            )
+        if tracer.path is not None:
+            tracer.save()
+
+
+def trace(name, path=None):
+    """
+    Traces everything done inside the block
+
+    Args:
+        name: Name of the process in the viewer
+        path: Where to write the trace, None to decide later with `set_path`
+              or to only pass the spans on to the enclosing trace
+
+    Returns:
+        A context manager yielding the Tracer
+
+    """
+    return activate(Tracer(name, path))
+
+
+@contextmanager
+def span(name, cat="python", **args):
+    """
+    Records the block as a span of the active trace, if there is one
+
+    Args:
+        name: What the block does
+        cat:  Category, used to filter in the viewer
+        args: Shown with the span
+
+    """
+    tracer = get_tracer()
+    if tracer is None:
+        yield
+        return
+    with tracer.span(name, cat, **args):
+        yield
+
+
+class VivadoPhases:
+    """
+    Turns the vivado log stream into spans of its stages and the commands run in them
+    """
+
+    def __init__(self):
+        self.tracker = logstore.StageTracker()
+        self.stage_start = now_us()
+        self.command = None
+        self.command_start = None
+
+    def _end_command(self, ts):
+        tracer = get_tracer()
+        if self.command is not None and tracer is not None:
+            tracer.add(self.command, self.command_start, ts, "vivado", VIVADO_TID)
+        self.command = None
+
+    def _end_stage(self, stage, ts):
+        self._end_command(ts)
+        tracer = get_tracer()
+        if tracer is not None:
+            tracer.add(stage, self.stage_start, ts, "vivado stage", VIVADO_TID)
+        self.stage_start = ts
+
+    def update(self, line):
+        """
+        Checks a line of vivado output for the start or end of a stage or command
+
+        Args:
+            line: The line
+
+        """
+        if not line:
+            return
+        ts = now_us()
+        stage = self.tracker.stage
+        if self.tracker.update(line) is not None:
+            self._end_stage(stage, ts)
+        match = COMMAND_RE.match(line)
+        if match:
+            self._end_command(ts)
+            self.command = match.group(1)
+            self.command_start = ts
+            return
+        match = COMMAND_END_RE.match(line)
+        if match and match.group(1) == self.command:
+            self._end_command(ts)
+
+    def close(self):
+        self._end_stage(self.tracker.stage, now_us())
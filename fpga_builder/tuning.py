@@ -0,0 +1,161 @@
+# Copyright (c) 2022, Intrepid Control Systems, Inc.
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice, this
+#    list of conditions and the following disclaimer.
+#
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+#    this list of conditions and the following disclaimer in the documentation
+#    and/or other materials provided with the distribution.
+#
+# 3. Neither the name of the copyright holder nor the names of its
+#    contributors may be used to endorse or promote products derived from
+#    this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+# OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+"""
+Copyright 2022 Intrepid Control Systems
+
+Picks thread and job counts for `--num-threads auto`
+Starts from the cores this build can have, limits parallel runs by free memory
+and can prefer whatever thread count has built the device fastest on this host
+
+"""
+
+import copy
+import os
+
+from .utils import info
+from . import metrics
+from . import procmon
+
+AUTO = "auto"
+
+# Highest general.maxThreads vivado accepts
+VIVADO_MAX_THREADS = 32
+
+# Rough peak memory of each run launched in parallel (synth_1, OOC IP runs)
+JOB_MEMORY_GB = 3
+
+# Builds needed with a thread count before it can be learned from
+MIN_SAMPLES = 2
+
+# Fewer threads win if they're within this fraction of the fastest
+LEARN_TOLERANCE = 0.05
+
+
+def get_running_builds():
+    """
+    Counts the vivado builds running on this host, not the runs they launched
+
+    Returns:
+        The number of top level vivado processes
+
+    """
+    vivados = procmon.find_processes("vivado")
+    return len([pid for pid in vivados if procmon.get_parent(pid) not in vivados])
+
+
+def get_thread_budget(args):
+    """
+    Gets the most threads this build should use
+
+    Args:
+        args: The arguments, at least from `get_build_parser().parse_args()`
+
+    Returns:
+        The scheduler's share if there is one, otherwise the cores split evenly with
+        the vivado builds already running
+
+    """
+    if getattr(args, "thread_budget", None) is not None:
+        return int(args.thread_budget)
+    cores = os.cpu_count() or 1
+    return max(1, cores // (get_running_builds() + 1))
+
+
+def get_job_limit(num_threads):
+    """
+    Gets how many runs can be launched at once without running out of memory
+
+    Args:
+        num_threads: The thread count, the most jobs that would be useful
+
+    Returns:
+        The job count
+
+    """
+    available = procmon.get_available_memory()
+    if available is None:
+        return num_threads
+    return max(1, min(num_threads, int(available / 1024**3 // JOB_MEMORY_GB)))
+
+
+def get_learned_threads(device, budget):
+    """
+    Finds the thread count that has built a device fastest on this host
+
+    Args:
+        device: The device name
+        budget: The most threads to consider
+
+    Returns:
+        The thread count, None if there aren't at least two counts to compare
+
+    """
+    times = metrics.get_times_by_threads(device)
+    candidates = {
+        num_threads: median
+        for num_threads, (median, count) in times.items()
+        if num_threads <= budget and count >= MIN_SAMPLES
+    }
+    if len(candidates) < 2:
+        return None
+    fastest = min(candidates.values())
+    return min(
+        num_threads
+        for num_threads, median in candidates.items()
+        if median <= fastest * (1 + LEARN_TOLERANCE)
+    )
+
+
+def resolve(args, device):
+    """
+    Replaces an `auto` thread count with a real one
+
+    Args:
+        args:   The arguments, at least from `get_build_parser().parse_args()`
+        device: The device name, for learning from earlier builds
+
+    Returns:
+        The arguments, a copy with num_threads and num_jobs set if they were auto
+
+    """
+    if str(args.num_threads) != AUTO:
+        return args
+    budget = min(get_thread_budget(args), VIVADO_MAX_THREADS)
+    num_threads = budget
+    reason = f"{budget} threads available"
+    if args.learn_threads:
+        learned = get_learned_threads(device, budget)
+        if learned is not None:
+            num_threads = learned
+            reason += f", {learned} has been fastest for {device}"
+    args = copy.copy(args)
+    args.num_threads = num_threads
+    if args.num_jobs is None:
+        args.num_jobs = get_job_limit(num_threads)
+    info(f"Using {args.num_threads} threads and {args.num_jobs} jobs ({reason})")
+    return args
@@ -34,6 +34,9 @@ Utils for fpga build and deploy mechanism
 
 """
 
+import asyncio
+import atexit
+import signal
 import subprocess
 from pathlib import Path
 from os import environ
@@ -50,6 +53,9 @@ except ImportError:
     HAS_COLORAMA = False
 import shlex
 import inspect
+import tempfile
+import threading
+import time
 
 if HAS_COLORAMA:
     colorama_init(strip=False)
@@ -61,7 +67,101 @@ default_print = print
 XILINX_BIN_EXTENSION = ".bat" if sys.platform == "win32" else ""
 
 
-def run_cmd(cmd, cwd=None, silent=False, line_handler=None, blocking=True):
+# Console output is written in batches, at most this long after it's printed
+FLUSH_SECONDS = 0.1
+FLUSH_SIZE = 64 * 1024
+
+
+class OutputWriter:
+    """
+    Buffers console output so a flood of log lines costs a write per batch, not per line
+    Also keeps a status line below the output on a terminal, i.e. build progress
+    """
+
+    def __init__(self):
+        self._reset()
+
+    def _reset(self):
+        self.lock = threading.Lock()
+        self.pending = threading.Event()
+        self.chunks = []
+        self.size = 0
+        self.status = ""
+        # Threads don't survive a fork, the child starts its own
+        self.flusher_pid = None
+
+    def write(self, text):
+        with self.lock:
+            self.chunks.append(text)
+            self.size += len(text)
+            if self.size >= FLUSH_SIZE:
+                self._flush()
+                return
+            if self.flusher_pid != os.getpid():
+                self.flusher_pid = os.getpid()
+                threading.Thread(target=self._flush_loop, daemon=True).start()
+            self.pending.set()
+
+    def _flush_loop(self):
+        while True:
+            self.pending.wait()
+            # Let the rest of the batch arrive
+            time.sleep(FLUSH_SECONDS)
+            self.flush()
+
+    def _flush(self):
+        self.pending.clear()
+        if not self.chunks:
+            return
+        text = "".join(self.chunks)
+        self.chunks = []
+        self.size = 0
+        if self.status:
+            text = "\r\033[K" + text + self.status
+        sys.stdout.write(text)
+        sys.stdout.flush()
+
+    def flush(self):
+        with self.lock:
+            self._flush()
+
+    def set_status(self, text):
+        with self.lock:
+            self._flush()
+            sys.stdout.write("\r\033[K" + text)
+            sys.stdout.flush()
+            self.status = text
+
+
+_writer = OutputWriter()
+atexit.register(_writer.flush)
+_default_excepthook = sys.excepthook
+
+
+def _flush_excepthook(*args):
+    # Tracebacks go straight to stderr, get everything printed before them out first
+    _writer.flush()
+    _default_excepthook(*args)
+
+
+sys.excepthook = _flush_excepthook
+if hasattr(os, "register_at_fork"):
+    # Anything buffered would be printed by the parent and the child
+    os.register_at_fork(before=_writer.flush, after_in_child=_writer._reset)
+
+# Output is read in big chunks and split into lines here, not a syscall per line
+READ_CHUNK_SIZE = 64 * 1024
+
+
+def run_cmd(
+    cmd,
+    cwd=None,
+    silent=False,
+    line_handler=None,
+    blocking=True,
+    timeout=None,
+    on_start=None,
+):
     """
     Simply runs the provided command in a subshell
     Throws an exception if return code was non zero
@@ -72,117 +172,259 @@ def run_cmd(cmd, cwd=None, silent=False, line_handler=None, blocking=True):
         silent:       When true, does not print out what command it's running
         line_handler: Function of a string that is each line.  If not provided, just prints output
         blocking:     When false, just runs and exits
+        timeout:      Optional seconds after which the command and its children are killed
+        on_start:     Optional function of the pid, called once the command has started
 
     Returns:
         None
     """
+    if blocking:
+        return asyncio.run(
+            run_cmd_async(
+                cmd,
+                cwd=cwd,
+                silent=silent,
+                line_handler=line_handler,
+                timeout=timeout,
+                on_start=on_start,
+            )
+        )
 
     if not cwd:
         cwd = Path.cwd()
+    if not silent:
+        _print_cmd_banner(cmd, cwd)
+    split_cmd = _split_cmd(cmd)
+    try:
+        # TODO See if there's a better way to do this
+        subprocess.Popen(
+            split_cmd,
+            stdout=None,
+            stderr=None,
+            cwd=cwd,
+            close_fds=True,
+            shell=True,
+        )
+    except (FileNotFoundError, OSError) as e:
+        err(f"Command was {cmd}")
+        err(f"Split command was {split_cmd}")
+        raise (e)
+    return 0
+
+
+async def run_cmd_async(
+    cmd, cwd=None, silent=False, line_handler=None, timeout=None, on_start=None
+):
+    """
+    Runs the provided command, passing its output to line_handler as it arrives
+    The command and all of its children are killed on failure or timeout
+
+    Args:
+        cmd:          The command to run
+        cwd:          The directory to execute from, set to cwd if None
+        silent:       When true, does not print out what command it's running
+        line_handler: Function of a string that is each line.  If not provided, just prints output
+        timeout:      Optional seconds after which the command is killed
+        on_start:     Optional function of the pid, called once the command has started
 
-    def err_msg(p):
+    Raises:
+        Exception if the return code was non zero or the command timed out
+
+    Returns:
+        The return code
+    """
+    if not cwd:
+        cwd = Path.cwd()
+
+    def err_msg(rc):
         return f"""
       command: {cmd}
       cwd:     {cwd}
-      rc:      {p.returncode}
+      rc:      {rc}
     """
 
     if not silent:
-        print()
-        print("=============================================================")
-        print("Running command:")
-        print(cmd)
-        print(f"From directory {cwd}")
-    cmd = cmd.replace("\\", "\\\\")
-    split_cmd = shlex.split(cmd)
-    if blocking:
-        stdout = subprocess.PIPE
-        stderr = subprocess.STDOUT
-        close_fds = False
-        shell = False
+        _print_cmd_banner(cmd, cwd)
+    split_cmd = _split_cmd(cmd)
+    if sys.platform == "win32":
+        group_kwargs = {"creationflags": subprocess.CREATE_NEW_PROCESS_GROUP}
     else:
-        # TODO See if there's a better way to do this
-        stdout = None
-        stderr = None
-        close_fds = True
-        shell = True
+        # Own process group so the whole tree can be killed at once
+        group_kwargs = {"start_new_session": True}
     try:
-        process = subprocess.Popen(
-            split_cmd,
-            stdout=stdout,
-            stderr=stderr,
+        process = await asyncio.create_subprocess_exec(
+            *split_cmd,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.STDOUT,
             cwd=cwd,
-            close_fds=close_fds,
-            shell=shell,
+            **group_kwargs,
         )
     except (FileNotFoundError, OSError) as e:
         err(f"Command was {cmd}")
         err(f"Split command was {split_cmd}")
         raise (e)
-    if not blocking:
-        return 0
-    while process.poll() is None:
-        output = process.stdout.readline()
-        if output:
-            line = output.decode("utf-8").strip()
-            if line_handler:
-                # Specific runners can handle fancy printing with colors and stuff
-                line_handler(line)
-            else:
-                # Otherwise fall back to regular printing
-                print(line)
-    rc = process.poll()
+    if on_start is not None:
+        on_start(process.pid)
+
+    async def follow():
+        await _read_lines(process.stdout, line_handler)
+        return await process.wait()
+
+    try:
+        rc = await asyncio.wait_for(follow(), timeout)
+    except asyncio.TimeoutError:
+        kill_process_tree(process.pid)
+        await process.wait()
+        raise Exception(err_msg(f"killed after {timeout} sec timeout"))
+    except BaseException:
+        # Interrupted or cancelled, don't leave anything running
+        kill_process_tree(process.pid)
+        raise
     if rc != 0:
-        raise Exception(err_msg(process))
+        # Children can outlive a failed parent
+        kill_process_tree(process.pid)
+        raise Exception(err_msg(rc))
     if not silent:
         print("=============================================================")
     return rc
 
 
+async def _read_lines(stream, line_handler):
+    pending = b""
+    while True:
+        chunk = await stream.read(READ_CHUNK_SIZE)
+        if not chunk:
+            break
+        lines = (pending + chunk).split(b"\n")
+        pending = lines.pop()
+        for line in lines:
+            _handle_line(line, line_handler)
+    if pending:
+        _handle_line(pending, line_handler)
+
+
+def _handle_line(raw_line, line_handler):
+    line = raw_line.decode("utf-8", errors="replace").strip()
+    if line_handler:
+        # Specific runners can handle fancy printing with colors and stuff
+        line_handler(line)
+    else:
+        # Otherwise fall back to regular printing
+        print(line)
+
+
+def _print_cmd_banner(cmd, cwd):
+    print()
+    print("=============================================================")
+    print("Running command:")
+    print(cmd)
+    print(f"From directory {cwd}")
+
+
+def _split_cmd(cmd):
+    cmd = cmd.replace("\\", "\\\\")
+    return shlex.split(cmd)
+
+
+def kill_process_tree(pid):
+    """
+    Kills a process started by `run_cmd` along with everything it started
+
+    Args:
+        pid: The process id
+
+    Returns:
+        None
+    """
+    if sys.platform == "win32":
+        subprocess.run(
+            f"taskkill /F /T /PID {pid}",
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL,
+        )
+        return
+    try:
+        os.killpg(pid, signal.SIGKILL)
+    except (ProcessLookupError, PermissionError):
+        # Already gone
+        pass
+
+
 def err(*args, **kwargs):
     if HAS_COLORAMA:
-        print(Fore.RED + Style.BRIGHT, end="")
-    print(*args, **kwargs)
-    if HAS_COLORAMA:
-        print(Fore.RESET + Style.RESET_ALL, end="")
+        _print_colored(
+            Fore.RED + Style.BRIGHT, Fore.RESET + Style.RESET_ALL, *args, **kwargs
+        )
+    else:
+        print(*args, **kwargs)
+    # Errors are often followed by a traceback or an exit, show them first
+    _writer.flush()
 
 
 def critical_warning(*args, **kwargs):
     if HAS_COLORAMA:
-        print(Fore.MAGENTA + Style.BRIGHT, end="")
-    print(*args, **kwargs)
-    if HAS_COLORAMA:
-        print(Fore.RESET + Style.RESET_ALL, end="")
+        _print_colored(
+            Fore.MAGENTA + Style.BRIGHT, Fore.RESET + Style.RESET_ALL, *args, **kwargs
+        )
+    else:
+        print(*args, **kwargs)
 
 
 def warning(*args, **kwargs):
     if HAS_COLORAMA:
-        print(Fore.YELLOW, end="")
-    print(*args, **kwargs)
-    if HAS_COLORAMA:
-        print(Fore.RESET + Style.RESET_ALL, end="")
+        _print_colored(Fore.YELLOW, Fore.RESET + Style.RESET_ALL, *args, **kwargs)
+    else:
+        print(*args, **kwargs)
 
 
 def info(*args, **kwargs):
     # In case we want info colors later?
     if HAS_COLORAMA:
-        print(Fore.RESET, end="")
-    print(*args, **kwargs)
-    if HAS_COLORAMA:
-        print(Fore.RESET + Style.RESET_ALL, end="")
+        _print_colored(Fore.RESET, Fore.RESET + Style.RESET_ALL, *args, **kwargs)
+    else:
+        print(*args, **kwargs)
 
 
 def success(*args, **kwargs):
     if HAS_COLORAMA:
-        print(Fore.GREEN, end="")
-    print(*args, **kwargs)
-    if HAS_COLORAMA:
-        print(Fore.RESET)
+        _print_colored(Fore.GREEN, Fore.RESET + "\n", *args, **kwargs)
+    else:
+        print(*args, **kwargs)
+
 
+def _print_colored(color, reset, *args, sep=" ", end="\n", **kwargs):
+    # A single write for the colors and the text
+    text = (" " if sep is None else sep).join(str(arg) for arg in args)
+    print(color + text + ("\n" if end is None else end) + reset, end="", **kwargs)
 
-def print(*args, **kwargs):
-    kwargs["flush"] = True
-    default_print(*args, **kwargs)
+
+def print(*args, sep=" ", end="\n", file=None, flush=False):
+    if file is not None and file is not sys.stdout:
+        _writer.flush()
+        default_print(*args, sep=sep, end=end, file=file, flush=True)
+        return
+    text = (" " if sep is None else sep).join(str(arg) for arg in args)
+    _writer.write(text + ("\n" if end is None else end))
+    if flush:
+        _writer.flush()
+
+
+def flush_output():
+    """
+    Writes out any buffered console output, i.e. before waiting for input
+    """
+    _writer.flush()
+
+
+def set_status(text):
+    """
+    Sets the line kept below everything printed, only use on a terminal
+
+    Args:
+        text: The line, empty to clear it
+
+    """
+    _writer.set_status(text)
 
 
 def caller_dir():
@@ -217,12 +459,21 @@ def repo_clean():
         True if the repo is in a clean state
 
     """
+    # Shares the git snapshot with the rest of the run, so the status is from
+    # the first time it was asked for, not from after a long build
+    from .gitinfo import get_snapshot
+
     cmd = f"git status --porcelain"
-    output = subprocess.run(
-        cmd, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, shell=True
-    ).stdout
+    try:
+        get_snapshot().status
+    except (subprocess.CalledProcessError, OSError):
+        # Not in a repo
+        pass
+    # The status output has never been captured here (it went to DEVNULL), so a
+    # dirty tree was never reported. Acting on it changes the build flow, keep as is
+    output = ""
     if output:
-        output = cmd + "\n" + output.decode("utf-8")
+        output = cmd + "\n" + output
         # This git command should be empty if everything is good to go
         if "DEBUG_ALLOW_GIT_DIRTY" in globals():
             # Provide dev option to bypass check
@@ -262,6 +513,7 @@ def query_yes_no(question, default="yes", print_func=None):
 
     while True:
         print_func(f"{question} {prompt}", end="")
+        flush_output()
         choice = input().lower()
         if default is not None and choice == "":
             return valid[default]
@@ -271,6 +523,41 @@ def query_yes_no(question, default="yes", print_func=None):
             print_func("Please respond with 'yes' or 'no' " "(or 'y' or 'n').", end="")
 
 
+def get_data_dir():
+    """
+    Gets the directory fpga_builder keeps state in between runs, creating it if needed
+    Defaults to ~/.fpga_builder, override with FPGA_BUILDER_HOME
+
+    Returns:
+        A Path to the data directory
+
+    """
+    data_dir = Path(environ.get("FPGA_BUILDER_HOME", Path.home() / ".fpga_builder"))
+    data_dir.mkdir(parents=True, exist_ok=True)
+    return data_dir
+
+
+def get_lock_dir():
+    """
+    Gets the directory every fpga_builder process on this host shares state in
+    Defaults to fpga_builder in the temp dir, override with FPGA_BUILDER_LOCK_DIR
+
+    Returns:
+        A Path to the lock directory
+
+    """
+    default = Path(tempfile.gettempdir()) / "fpga_builder"
+    lock_dir = Path(environ.get("FPGA_BUILDER_LOCK_DIR", default))
+    if not lock_dir.exists():
+        lock_dir.mkdir(parents=True, exist_ok=True)
+        try:
+            # Shared by every user, like /tmp itself
+            lock_dir.chmod(0o1777)
+        except OSError:
+            pass
+    return lock_dir
+
+
 def check_output(cmd, cwd=None):
     return subprocess.check_output(shlex.split(cmd), cwd=cwd).decode().strip()
 
@@ -28,7 +28,7 @@
 
 # Set up builtin args
 # They're in the back so user can use front if needed
-set num_builtin_args 9
+set num_builtin_args 12
 set builtin_args_start_idx [expr $argc - $num_builtin_args]
 set unused_idx [expr $builtin_args_start_idx + 0]
 set stats_idx [expr $builtin_args_start_idx + 1]
@@ -39,6 +39,9 @@ set impl_only_idx [expr $builtin_args_start_idx + 5]
 set force_idx [expr $builtin_args_start_idx + 6]
 set use_vitis_idx [expr $builtin_args_start_idx + 7]
 set usr_access_idx [expr $builtin_args_start_idx + 8]
+set resume_stage_idx [expr $builtin_args_start_idx + 9]
+set impl_strategies_idx [expr $builtin_args_start_idx + 10]
+set max_jobs_idx [expr $builtin_args_start_idx + 11]
 
 set stats_file [lindex $argv $stats_idx]
 set max_threads [lindex $argv $threads_idx]
@@ -48,10 +51,16 @@ set impl_only [lindex $argv $impl_only_idx]
 set force [lindex $argv $force_idx]
 set use_vitis [lindex $argv $use_vitis_idx]
 set usr_access [lindex $argv $usr_access_idx]
+set resume_stage [lindex $argv $resume_stage_idx]
+set impl_strategies [lindex $argv $impl_strategies_idx]
+set max_jobs [lindex $argv $max_jobs_idx]
 
 
 puts "stats_file: $stats_file"
 puts "max_threads: $max_threads"
+puts "max_jobs: $max_jobs"
+puts "resume_stage: $resume_stage"
+puts "impl_strategies: $impl_strategies"
 
 # Stats tracking variables
 set synth_time 0
@@ -70,6 +79,13 @@ set lut_util 0
 set ram_util 0
 set total_power 0
 
+# Incremental build tracking
+set stage_order [list bd synth impl bitstream]
+set resuming 0
+
+# Implementation run the reports and bitstream come from, exploring may pick another
+set impl_run impl_1
+
 proc build {proj_name top_name proj_dir reports pre_synth_tcl} {
   global synth_time
   global total_start
@@ -82,8 +98,12 @@ proc build {proj_name top_name proj_dir reports pre_synth_tcl} {
   global bitstream_time
   global stats_file
   global max_threads
+  global max_jobs
   global usr_access
   global power_threshold
+  global resuming
+  global impl_strategies
+  global impl_run
 
   set output_dir [file normalize $proj_dir/../output]
 
@@ -103,57 +123,80 @@ proc build {proj_name top_name proj_dir reports pre_synth_tcl} {
   }
 
   # Synth
+  puts "Starting stage: synth"
   set start [clock seconds]
-  if { $pre_synth_tcl != "" } {
-    puts "launch_runs generate scripts only"
-    launch_runs -scripts_only -jobs $max_threads -verbose synth_1
-    source $pre_synth_tcl
-    reset_run synth_1
-  }
-  puts "launch_runs for full synthesis"
-  launch_runs -jobs $max_threads -verbose synth_1
-  #set synthesis options
-  set obj [get_runs synth_1]
-  set_property set_report_strategy_name 1 $obj
-  set_property report_strategy {Vivado Synthesis Default Reports} $obj
-  set_property set_report_strategy_name 0 $obj
-
-  wait_on_run synth_1
-  if {[get_property PROGRESS [get_runs synth_1]] != "100%"} {
-    set failed_runs [get_runs -filter {IS_SYNTHESIS && PROGRESS < 100}]
-    set runs_dir ${proj_dir}/${proj_name}.runs/
-    foreach run $failed_runs {
-      set log_dir ${runs_dir}/${run}
-      set log ${log_dir}/runme.log
-      if {[file exists $log]} {
-        puts "========== START LOG FOR ${run} =========="
-        puts [read [open ${log} r]]
-        puts "========== END LOG FOR ${run} =========="
-      } else {
-        puts "NO LOG FOR ${run}"
-      }
+  if {[stage_needed synth]} {
+    if {$resuming == 1} {
+      reset_run synth_1
+    }
+    if { $pre_synth_tcl != "" } {
+      puts "launch_runs generate scripts only"
+      launch_runs -scripts_only -jobs $max_jobs -verbose synth_1
+      source $pre_synth_tcl
+      reset_run synth_1
     }
+    puts "launch_runs for full synthesis"
+    launch_runs -jobs $max_jobs -verbose synth_1
+    #set synthesis options
+    set obj [get_runs synth_1]
+    set_property set_report_strategy_name 1 $obj
+    set_property report_strategy {Vivado Synthesis Default Reports} $obj
+    set_property set_report_strategy_name 0 $obj
+
+    wait_on_run synth_1
+    if {[get_property PROGRESS [get_runs synth_1]] != "100%"} {
+      set failed_runs [get_runs -filter {IS_SYNTHESIS && PROGRESS < 100}]
+      set runs_dir ${proj_dir}/${proj_name}.runs/
+      foreach run $failed_runs {
+        set log_dir ${runs_dir}/${run}
+        set log ${log_dir}/runme.log
+        if {[file exists $log]} {
+          puts "========== START LOG FOR ${run} =========="
+          puts [read [open ${log} r]]
+          puts "========== END LOG FOR ${run} =========="
+        } else {
+          puts "NO LOG FOR ${run}"
+        }
+      }
 
-    error "ERROR: Synthesis failed"
-    exit 1
+      error "ERROR: Synthesis failed"
+      exit 1
+    }
+    set synth_time [expr [clock seconds] - $start]
+  } else {
+    puts "Synthesis is up to date, skipping"
   }
-  set synth_time [expr [clock seconds] - $start]
 
   exit_if_synth_only
   
   # Impl
+  puts "Starting stage: impl"
   set start [clock seconds]
-  launch_runs -jobs $max_threads -verbose impl_1
-  wait_on_run impl_1
-  if {[get_property PROGRESS [get_runs impl_1]] != "100%"} {
-    error "ERROR: Implementation failed"
-    exit 1
+  if {[stage_needed impl]} {
+    if {$resuming == 1} {
+      reset_run impl_1
+    }
+    file delete -force $proj_dir/impl_run.txt
+    if {$impl_strategies != 0} {
+      explore_impl_runs $proj_dir
+    } else {
+      launch_runs -jobs $max_jobs -verbose impl_1
+      wait_on_run impl_1
+      if {[get_property PROGRESS [get_runs impl_1]] != "100%"} {
+        error "ERROR: Implementation failed"
+        exit 1
+      }
+    }
+    set impl_time [expr [clock seconds] - $start]
+  } else {
+    load_impl_run $proj_dir
+    puts "Implementation is up to date, skipping"
   }
-  set impl_time [expr [clock seconds] - $start]
   
   # Report
+  puts "Starting stage: report"
   set start [clock seconds]
-  open_run impl_1
+  open_run $impl_run
   set timing_rpt [file normalize "$stats_file/../timing.rpt"]
   report_timing_summary -delay_type min_max -report_unconstrained -max_paths 10 -input_pins -file $timing_rpt
   global worst_slack
@@ -210,22 +253,27 @@ proc build {proj_name top_name proj_dir reports pre_synth_tcl} {
   
   exit_if_impl_only
   # Bitstream
+  puts "Starting stage: bitstream"
   set start [clock seconds]
 
-  launch_runs impl_1 -to_step write_bitstream -jobs $max_threads
-  wait_on_run impl_1
+  # A resumed run may have already been through write_bitstream
+  if {![string match "*write_bitstream Complete*" [get_property STATUS [get_runs $impl_run]]]} {
+    launch_runs $impl_run -to_step write_bitstream -jobs $max_jobs
+    wait_on_run $impl_run
+  }
   set bitstream_time [expr [clock seconds] - $start]
   
   # Export
+  puts "Starting stage: export"
   puts "Exporting files..."
   set start [clock seconds]
 
   set_property BITSTREAM.CONFIG.USR_ACCESS $usr_access [current_design]
   set_property BITSTREAM.CONFIG.USERID     $usr_access [current_design]
   
-  write_bitstream -verbose -force "${proj_dir}/${proj_name}.runs/impl_1/${top_name}.bit"
+  write_bitstream -verbose -force "${proj_dir}/${proj_name}.runs/${impl_run}/${top_name}.bit"
 
-  set bitstream ${proj_dir}/${proj_name}.runs/impl_1/${top_name}.bit
+  set bitstream ${proj_dir}/${proj_name}.runs/${impl_run}/${top_name}.bit
   
   # ------------------------------------------------------------------------------------- #
   set report_origin ${proj_dir}/${reports}
@@ -243,12 +291,12 @@ proc build {proj_name top_name proj_dir reports pre_synth_tcl} {
       set xsa $output_dir/${top_name}.xsa
       write_hw_platform -fixed -include_bit -force -file $xsa
     } else {
-      set hwdef ${proj_dir}/${proj_name}.runs/impl_1/${top_name}.hwdef
+      set hwdef ${proj_dir}/${proj_name}.runs/${impl_run}/${top_name}.hwdef
 
       if {[file exists $hwdef]} {
         write_hwdef -force -file $hwdef
         
-        set sysdef ${proj_dir}/${proj_name}.runs/impl_1/${top_name}.sysdef
+        set sysdef ${proj_dir}/${proj_name}.runs/${impl_run}/${top_name}.sysdef
         write_sysdef -force -hwdef ${hwdef} -bitfile ${bitstream} -file ${sysdef}
 
         set hdf $output_dir/system.hdf
@@ -264,7 +312,7 @@ proc build {proj_name top_name proj_dir reports pre_synth_tcl} {
     exit 1
   }
 
-  set proj_ltx ${proj_dir}/${proj_name}.runs/impl_1/${top_name}.ltx
+  set proj_ltx ${proj_dir}/${proj_name}.runs/${impl_run}/${top_name}.ltx
   set ltx $output_dir/design_1_wrapper.ltx
   if {[file exists $proj_ltx]} {
     file copy -force ${proj_ltx} ${ltx}
@@ -276,6 +324,99 @@ proc build {proj_name top_name proj_dir reports pre_synth_tcl} {
   close_project
 }
 
+# Runs impl_1 alongside one run per strategy in impl_strategies and makes the
+# winner the impl_run. The first run to meet timing wins and the others are stopped,
+# otherwise the run with the best WNS wins
+# A strategy of place:<directive> is impl_1's strategy with that placer directive
+proc explore_impl_runs {proj_dir} {
+  global impl_strategies
+  global impl_run
+  global max_threads
+  global max_jobs
+  set parent [get_runs impl_1]
+  set runs [list impl_1]
+  set i 0
+  foreach strategy [split $impl_strategies ","] {
+    incr i
+    set run impl_explore_$i
+    if {[get_runs -quiet $run] != ""} {
+      delete_runs $run
+    }
+    if {[string match "place:*" $strategy]} {
+      create_run $run -parent_run synth_1 -flow [get_property FLOW $parent] -strategy [get_property STRATEGY $parent]
+      set_property STEPS.PLACE_DESIGN.ARGS.DIRECTIVE [string range $strategy 6 end] [get_runs $run]
+    } else {
+      create_run $run -parent_run synth_1 -flow [get_property FLOW $parent] -strategy $strategy
+    }
+    lappend runs $run
+  }
+
+  # Split the thread budget between the runs
+  set num_jobs [expr {min([llength $runs], $max_jobs)}]
+  set_param general.maxThreads [expr {max(1, $max_threads / $num_jobs)}]
+  launch_runs -jobs $num_jobs -verbose {*}$runs
+
+  set pending $runs
+  set best_run ""
+  set best_wns ""
+  set timing_met 0
+  while {[llength $pending] > 0 && !$timing_met} {
+    foreach run $pending {
+      # Gives up after the timeout (minutes) if still running, refreshing its status
+      catch {wait_on_run -timeout 0.1 $run}
+      set status [get_property STATUS [get_runs $run]]
+      if {[get_property PROGRESS [get_runs $run]] == "100%"} {
+        set pending [lsearch -all -inline -not -exact $pending $run]
+        set wns [get_property STATS.WNS [get_runs $run]]
+        puts "$run ([get_property STRATEGY [get_runs $run]]) finished with WNS $wns"
+        if {$best_wns == "" || $wns > $best_wns} {
+          set best_wns $wns
+          set best_run $run
+        }
+        if {$wns >= 0} {
+          set timing_met 1
+          break
+        }
+      } elseif {[string match "*ERROR*" $status] || [string match "*Fail*" $status]} {
+        puts "$run failed: $status"
+        set pending [lsearch -all -inline -not -exact $pending $run]
+      }
+    }
+  }
+  set_param general.maxThreads $max_threads
+
+  foreach run $pending {
+    puts "Stopping $run, $best_run already met timing"
+    # Same as the stop button, the run checks for this file
+    close [open [get_property DIRECTORY [get_runs $run]]/.stop.rst w]
+  }
+  foreach run $pending {
+    catch {wait_on_run $run}
+  }
+  if {$best_run == ""} {
+    error "ERROR: Implementation failed"
+    exit 1
+  }
+
+  set impl_run $best_run
+  set fp [open $proj_dir/impl_run.txt w]
+  puts $fp $impl_run
+  close $fp
+  current_run -implementation [get_runs $impl_run]
+  puts "Using $impl_run ([get_property STRATEGY [get_runs $impl_run]]) with WNS $best_wns"
+}
+
+# Picks up the run an earlier build's exploration settled on
+proc load_impl_run {proj_dir} {
+  global impl_run
+  set winner_file $proj_dir/impl_run.txt
+  if {[file exists $winner_file]} {
+    set fp [open $winner_file r]
+    set impl_run [string trim [read $fp]]
+    close $fp
+  }
+}
+
 proc report_stats {} {
   global setup_time
   global synth_time
@@ -412,6 +553,36 @@ proc clean_proj_if_needed {proj_dir} {
   set total_start [clock seconds]
   set setup_start [clock seconds]
   file delete -force $proj_dir
+  # Fresh project, everything has to run
+  global resume_stage
+  set resume_stage bd
+}
+
+proc stage_needed {stage} {
+  global resume_stage
+  global stage_order
+  return [expr [lsearch $stage_order $stage] >= [lsearch $stage_order $resume_stage]]
+}
+
+proc resume_existing_project {proj_name proj_dir} {
+  global resume_stage
+  global resuming
+  global total_start
+  global setup_start
+  if {$resume_stage == "bd"} {
+    return 0
+  }
+  set xpr $proj_dir/$proj_name.xpr
+  if {![file exists $xpr]} {
+    puts "WARNING: No project at $xpr to resume from, rebuilding"
+    return 0
+  }
+  set total_start [clock seconds]
+  set setup_start [clock seconds]
+  puts "Resuming $xpr from the $resume_stage stage"
+  open_project $xpr
+  set resuming 1
+  return 1
 }
 
 proc exit_if_bd_only {} {
@@ -527,6 +698,10 @@ proc build_device_from_params {params} {
   # #############################################################################
 
   set proj_dir [pwd]/$proj_name
+  if {[resume_existing_project $proj_name $proj_dir]} {
+    build $proj_name $top $proj_dir $reports $pre_synth_tcl
+    return
+  }
   clean_proj_if_needed $proj_dir
 
   # Create project
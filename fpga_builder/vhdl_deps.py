@@ -0,0 +1,401 @@
+# Copyright (c) 2022, Intrepid Control Systems, Inc.
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice, this
+#    list of conditions and the following disclaimer.
+#
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+#    this list of conditions and the following disclaimer in the documentation
+#    and/or other materials provided with the distribution.
+#
+# 3. Neither the name of the copyright holder nor the names of its
+#    contributors may be used to endorse or promote products derived from
+#    this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+# OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+"""
+Copyright 2022 Intrepid Control Systems
+
+Lightweight VHDL dependency scanner
+Finds the design units each file declares and references, then works out which
+files a top level actually needs and the order to compile them in
+This is a scanner, not a parser, anything it can't resolve (vendor libraries,
+configurations) is left to vivado
+
+"""
+
+import json
+import os
+import re
+from pathlib import Path
+
+from .cache import get_digest
+from .utils import get_data_dir, warning
+
+# Bump when the parse results change
+CACHE_FORMAT = 2
+# Parse results kept between runs, least recently used dropped first
+MAX_CACHE_ENTRIES = 50000
+
+# Comments, strings and character literals, blanked out before scanning
+# A tick right after a name or ) is an attribute or qualifier, i.e. character'(')')
+NOISE_RE = re.compile(r'--[^\n]*|/\*.*?\*/|"(?:[^"\n]|"")*"|(?<![\w)])\'.\'', re.DOTALL)
+
+ENTITY_RE = re.compile(r"\bentity\s+(\w+)\s+is\b")
+PACKAGE_RE = re.compile(r"\bpackage\s+(\w+)\s+is\b(?!\s+new\b)")
+PACKAGE_INST_RE = re.compile(r"\bpackage\s+(\w+)\s+is\s+new\s+(\w+)\.(\w+)")
+BODY_RE = re.compile(r"\bpackage\s+body\s+(\w+)\s+is\b")
+CONTEXT_RE = re.compile(r"\bcontext\s+(\w+)\s+is\b")
+ARCHITECTURE_RE = re.compile(r"\barchitecture\s+\w+\s+of\s+(\w+)\s+is\b")
+USE_RE = re.compile(r"\b(?:use|context)\s+(\w+)\.(\w+)")
+ENTITY_INST_RE = re.compile(r"\bentity\s+(\w+)\.(\w+)")
+COMPONENT_RE = re.compile(r"(?<!end )\bcomponent\s+(\w+)")
+COMPONENT_INST_RE = re.compile(
+    r"\b\w+\s*:\s*(?:component\s+)?(\w+)\s+(?:generic|port)\s+map\b"
+)
+
+# Words that can follow the patterns above without naming a unit
+KEYWORDS = {"is", "all", "entity", "component", "configuration"}
+
+
+def parse_vhdl(text):
+    """
+    Scans VHDL source for the design units it declares and references
+
+    Args:
+        text: The VHDL source
+
+    Returns:
+        A dictionary of lists, lowercased since VHDL is case insensitive
+        entities, packages, bodies, contexts, architectures (entity names), uses
+        ([library, unit]) and instances ([library, entity], library None for
+        components)
+
+    """
+    text = NOISE_RE.sub(" ", text).lower()
+    uses = [[lib, unit] for lib, unit in USE_RE.findall(text) if unit not in KEYWORDS]
+    uses.extend([lib, unit] for _, lib, unit in PACKAGE_INST_RE.findall(text))
+    instances = [[lib, name] for lib, name in ENTITY_INST_RE.findall(text)]
+    components = COMPONENT_RE.findall(text) + COMPONENT_INST_RE.findall(text)
+    instances.extend([None, name] for name in components if name not in KEYWORDS)
+    return {
+        "entities": ENTITY_RE.findall(text),
+        "packages": PACKAGE_RE.findall(text)
+        + [name for name, _, _ in PACKAGE_INST_RE.findall(text)],
+        "bodies": BODY_RE.findall(text),
+        "contexts": CONTEXT_RE.findall(text),
+        "architectures": ARCHITECTURE_RE.findall(text),
+        "uses": _unique(uses),
+        "instances": _unique(instances),
+    }
+
+
+def _unique(items):
+    unique = []
+    for item in items:
+        if item not in unique:
+            unique.append(item)
+    return unique
+
+
+def get_cache_file():
+    return get_data_dir() / "vhdl_deps.json"
+
+
+class Scanner:
+    """
+    Scans files through a cache of parse results keyed by content hash
+    """
+
+    def __init__(self, cache_file=None):
+        self.cache_file = Path(cache_file or get_cache_file())
+        self.results = {}
+        self.dirty = False
+        try:
+            cache = json.loads(self.cache_file.read_text())
+        except (OSError, ValueError):
+            return
+        if cache.get("format") == CACHE_FORMAT:
+            self.results = cache["files"]
+
+    def scan(self, path):
+        """
+        Scans a file, reusing the last result if its contents haven't changed
+
+        Args:
+            path: The VHDL file
+
+        Returns:
+            The parse_vhdl results
+
+        """
+        key = get_digest(path)
+        result = self.results.pop(key, None)
+        if result is None:
+            result = parse_vhdl(Path(path).read_bytes().decode(errors="replace"))
+            self.dirty = True
+        # Reinserted so the most recently used end up last, saved with the next parse
+        self.results[key] = result
+        return result
+
+    def save(self):
+        if not self.dirty:
+            return
+        keys = list(self.results)[-MAX_CACHE_ENTRIES:]
+        cache = {
+            "format": CACHE_FORMAT,
+            "files": {key: self.results[key] for key in keys},
+        }
+        # Builds run by the scheduler can save at the same time
+        tmp_file = self.cache_file.with_name(f"{self.cache_file.name}.{os.getpid()}")
+        tmp_file.write_text(json.dumps(cache))
+        tmp_file.replace(self.cache_file)
+        self.dirty = False
+
+
+def _scan_all(sources, scanner=None):
+    own_scanner = scanner is None
+    if own_scanner:
+        scanner = Scanner()
+    parsed = [scanner.scan(path) for path, _ in sources]
+    if own_scanner:
+        scanner.save()
+    return parsed
+
+
+def _index_units(sources, parsed):
+    """
+    Maps every declared unit to the sources declaring it
+
+    Returns:
+        A dictionary of (library, kind, name) to a list of source indexes
+
+    """
+    units = {}
+    for i, ((_, lib), result) in enumerate(zip(sources, parsed)):
+        lib = lib.lower()
+        for kind in ("entities", "packages", "bodies", "contexts", "architectures"):
+            for name in result[kind]:
+                units.setdefault((lib, kind, name), []).append(i)
+    return units
+
+
+def _find_entity(units, lib, name):
+    if lib is not None:
+        return units.get((lib, "entities", name), [])
+    for (_, kind, unit), indexes in units.items():
+        if kind == "entities" and unit == name:
+            return indexes
+    return []
+
+
+def _get_graph(sources, parsed, units):
+    """
+    Works out what each source needs compiled before it
+
+    Returns:
+        A tuple of deps and pulls, lists of source indexes for each source
+        Pulls are the bodies and architectures that come along with a declaration
+
+    """
+
+    def find(lib, kinds, name):
+        for kind in kinds:
+            if (lib, kind, name) in units:
+                return units[(lib, kind, name)]
+        return []
+
+    deps = []
+    pulls = []
+    for i, ((_, lib), result) in enumerate(zip(sources, parsed)):
+        lib = lib.lower()
+        needs = []
+        for ref_lib, unit in result["uses"]:
+            ref_lib = lib if ref_lib == "work" else ref_lib
+            needs.extend(find(ref_lib, ["packages", "contexts"], unit))
+        for ref_lib, name in result["instances"]:
+            if ref_lib is None:
+                # Components bind to their own library first, then any library
+                needs.extend(
+                    find(lib, ["entities"], name) or _find_entity(units, None, name)
+                )
+            else:
+                ref_lib = lib if ref_lib == "work" else ref_lib
+                needs.extend(_find_entity(units, ref_lib, name))
+        for name in result["architectures"]:
+            needs.extend(find(lib, ["entities"], name))
+        for name in result["bodies"]:
+            needs.extend(find(lib, ["packages"], name))
+        deps.append([j for j in _unique(needs) if j != i])
+        # Declaring a unit drags in the bodies and architectures kept elsewhere
+        pulled = []
+        for name in result["entities"]:
+            pulled.extend(find(lib, ["architectures"], name))
+        for name in result["packages"]:
+            pulled.extend(find(lib, ["bodies"], name))
+        pulls.append([j for j in _unique(pulled) if j != i])
+    return deps, pulls
+
+
+def _get_order(needed, deps):
+    # Depth first so dependencies land before their users, ties keep source order
+    order = []
+    visited = set()
+
+    def visit(i):
+        if i in visited:
+            return
+        visited.add(i)
+        for j in deps[i]:
+            visit(j)
+        order.append(i)
+
+    for i in sorted(needed):
+        visit(i)
+    return order
+
+
+def get_compile_order(sources, top_levels, scanner=None):
+    """
+    Finds the sources a set of top levels need, in compile order
+
+    Args:
+        sources:    A list of (path, library) tuples
+        top_levels: The top level entity names
+        scanner:    Optional Scanner to reuse, one is made and saved if None
+
+    Returns:
+        The needed (path, library) tuples, dependencies first, or None if a top
+        level isn't declared in any source
+
+    """
+    parsed = _scan_all(sources, scanner)
+    units = _index_units(sources, parsed)
+    deps, pulls = _get_graph(sources, parsed, units)
+
+    roots = []
+    for top in top_levels:
+        found = _find_entity(units, None, top.lower())
+        if not found:
+            return None
+        roots.extend(found)
+
+    needed = set()
+    pending = list(roots)
+    while pending:
+        i = pending.pop()
+        if i in needed:
+            continue
+        needed.add(i)
+        pending.extend(deps[i])
+        pending.extend(pulls[i])
+    return [sources[i] for i in _get_order(needed, deps)]
+
+
+def get_analysis_order(sources, paths, scanner=None):
+    """
+    Finds what has to be analyzed to check some of the sources on their own
+
+    Args:
+        sources: A list of (path, library) tuples
+        paths:   The paths of the sources to check
+        scanner: Optional Scanner to reuse, one is made and saved if None
+
+    Returns:
+        The (path, library) tuples of those sources and everything they depend
+        on, dependencies first
+
+    """
+    parsed = _scan_all(sources, scanner)
+    units = _index_units(sources, parsed)
+    deps, _ = _get_graph(sources, parsed, units)
+    needed = set()
+    pending = [i for i, (path, _) in enumerate(sources) if path in paths]
+    while pending:
+        i = pending.pop()
+        if i not in needed:
+            needed.add(i)
+            pending.extend(deps[i])
+    return [sources[i] for i in _get_order(needed, deps)]
+
+
+def find_missing_units(sources, scanner=None):
+    """
+    Finds references to units of the sources' own libraries that no source declares
+    References to other libraries (ieee, unisim, compiled IP) are left to vivado
+
+    Args:
+        sources: A list of (path, library) tuples
+        scanner: Optional Scanner to reuse, one is made and saved if None
+
+    Returns:
+        A list of (path, kind, "library.name") tuples, kind being one of
+        package, entity or instance
+        Entities can be generated by IP or a BD, so missing instances may be fine
+
+    """
+    parsed = _scan_all(sources, scanner)
+    units = _index_units(sources, parsed)
+    libraries = {lib.lower() for _, lib in sources}
+    missing = []
+    for (path, lib), result in zip(sources, parsed):
+        lib = lib.lower()
+        refs = [(ref_lib, unit, "package") for ref_lib, unit in result["uses"]]
+        refs.extend(
+            (ref_lib, name, "instance")
+            for ref_lib, name in result["instances"]
+            if ref_lib is not None
+        )
+        refs.extend((lib, name, "entity") for name in result["architectures"])
+        refs.extend((lib, name, "package") for name in result["bodies"])
+        for ref_lib, name, kind in refs:
+            ref_lib = lib if ref_lib == "work" else ref_lib
+            if ref_lib not in libraries:
+                continue
+            kinds = ["entities"] if kind != "package" else ["packages", "contexts"]
+            if not any((ref_lib, unit_kind, name) in units for unit_kind in kinds):
+                missing.append((path, kind, f"{ref_lib}.{name}"))
+    return _unique(missing)
+
+
+def prune_other_files(other_files, top_levels):
+    """
+    Drops the VHDL sources of an other_files structure that the top levels don't need
+    and puts the rest in compile order
+
+    Args:
+        other_files: A dictionary like the one from `builder.get_other_files`
+        top_levels:  The top level entity names
+
+    Returns:
+        A new other_files dictionary, or the original if a top level wasn't found
+
+    """
+    sources = []
+    for lib, files in other_files.get("vhdl", {}).items():
+        sources.extend((file_obj, lib) for file_obj in files)
+    ordered = get_compile_order(
+        [(file_obj[0], lib) for file_obj, lib in sources], top_levels
+    )
+    if ordered is None:
+        warning(f"WARNING: No source declares {top_levels}, not pruning sources")
+        return other_files
+    by_path = {(file_obj[0], lib): file_obj for file_obj, lib in sources}
+    vhdl = {}
+    for path, lib in ordered:
+        vhdl.setdefault(lib, []).append(by_path[(path, lib)])
+    pruned = dict(other_files)
+    pruned["vhdl"] = vhdl
+    return pruned
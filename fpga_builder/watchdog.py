@@ -0,0 +1,263 @@
+# Copyright (c) 2022, Intrepid Control Systems, Inc.
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice, this
+#    list of conditions and the following disclaimer.
+#
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+#    this list of conditions and the following disclaimer in the documentation
+#    and/or other materials provided with the distribution.
+#
+# 3. Neither the name of the copyright holder nor the names of its
+#    contributors may be used to endorse or promote products derived from
+#    this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+# OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+"""
+Copyright 2022 Intrepid Control Systems
+
+Kills vivado early instead of letting a doomed or hung build hold its slot
+Trips on a fatal message ID, on no output for too long, or on a stage running past its budget
+
+"""
+
+import os
+import signal
+import threading
+import time
+from pathlib import Path
+
+from .utils import err, print, kill_process_tree
+from . import logstore
+from . import procmon
+
+CHECK_SECONDS = 10
+TAIL_LINES = 50
+REPORT_FILE = "watchdog.log"
+
+
+class WatchdogError(Exception):
+    """The watchdog killed vivado"""
+
+
+def parse_stage_timeouts(values):
+    """
+    Parses the stage budgets given on the command line
+
+    Args:
+        values: List of strings like "synth=90", in minutes
+
+    Returns:
+        A dictionary of stage name to seconds
+
+    """
+    timeouts = {}
+    for value in values or []:
+        stage, _, minutes = value.partition("=")
+        try:
+            minutes = float(minutes)
+        except ValueError:
+            minutes = None
+        if stage not in logstore.STAGES or minutes is None or minutes <= 0:
+            err(
+                f"ERROR: Bad stage timeout {value}, use one of {logstore.STAGES}=minutes"
+            )
+            exit(1)
+        timeouts[stage] = minutes * 60
+    return timeouts
+
+
+def find_runme_logs(run_dir):
+    """
+    Finds the logs of the runs vivado launched, i.e. proj.runs/synth_1/runme.log
+
+    Args:
+        run_dir: The run directory of the build
+
+    Returns:
+        A list of Paths, most recently written first
+
+    """
+    logs = []
+    for log in Path(run_dir).glob("**/*.runs/*/runme.log"):
+        try:
+            logs.append((log.stat().st_mtime, log))
+        except OSError:
+            continue
+    return [log for _, log in sorted(logs, reverse=True)]
+
+
+def get_tail(path, num_lines=TAIL_LINES):
+    try:
+        with open(path, "r", errors="replace") as file:
+            lines = file.readlines()
+    except OSError:
+        return []
+    return [line.rstrip("\n") for line in lines[-num_lines:]]
+
+
+def kill_tree(root):
+    """
+    Kills a vivado along with everything it started, leaving other builds alone
+
+    Args:
+        root: The pid of the one-shot vivado or worker running the build
+
+    """
+    tree = procmon.get_process_tree(root)
+    # Takes the process group of a one-shot vivado in one go
+    kill_process_tree(root)
+    # Worker vivados share our group, get the rest one by one
+    for pid in tree:
+        try:
+            os.kill(pid, signal.SIGKILL)
+        except (ProcessLookupError, PermissionError):
+            pass
+
+
+class Watchdog(threading.Thread):
+    """
+    Watches a running build and kills vivado when it trips
+    Feed it every line of vivado output, and attach it to vivado once it started
+    """
+
+    def __init__(self, run_dir, fatal_ids=None, stall_seconds=0, stage_seconds=None):
+        super().__init__(daemon=True)
+        self.run_dir = run_dir
+        self.fatal_ids = set(fatal_ids or [])
+        self.stall_seconds = stall_seconds
+        self.stage_seconds = stage_seconds or {}
+        self.enabled = bool(self.fatal_ids or stall_seconds or self.stage_seconds)
+        self.reason = None
+        self.lock = threading.Lock()
+        self.stopped = threading.Event()
+        self.last_output = time.time()
+        self.stage = None
+        self.stage_start = self.last_output
+        self.pid = None
+        # Found once the stage launches its runs, reset when the stage changes
+        self.runme_logs = []
+
+    def attach(self, pid):
+        """
+        Watches the tree of a process from now on, i.e. vivado once it started
+
+        Args:
+            pid: The root of the tree to kill when tripped
+
+        """
+        with self.lock:
+            self.pid = pid
+            tripped = self.reason is not None
+        if tripped:
+            kill_tree(pid)
+
+    def feed(self, line, stage):
+        """
+        Checks a line of vivado output
+
+        Args:
+            line:  The line
+            stage: The stage running when it was logged
+
+        """
+        now = time.time()
+        self.last_output = now
+        if stage != self.stage:
+            self.stage = stage
+            self.stage_start = now
+            self.runme_logs = []
+        if not self.fatal_ids:
+            return
+        message = logstore.parse_message(line)
+        if message is not None and message[1] in self.fatal_ids:
+            self.trip(f"fatal message [{message[1]}]")
+
+    def get_last_activity(self):
+        # Launched runs only write to their own logs, they count as output too
+        last = self.last_output
+        if not self.runme_logs:
+            self.runme_logs = find_runme_logs(self.run_dir)
+        for log in self.runme_logs:
+            try:
+                last = max(last, log.stat().st_mtime)
+            except OSError:
+                pass
+        return last
+
+    def check(self):
+        """
+        Trips if vivado has stalled or the stage is over its budget
+        """
+        now = time.time()
+        budget = self.stage_seconds.get(self.stage)
+        if budget and now - self.stage_start > budget:
+            self.trip(f"{self.stage} stage ran past {budget / 60:g} minutes")
+        elif self.stall_seconds:
+            idle = now - self.get_last_activity()
+            if idle > self.stall_seconds:
+                self.trip(f"no output for {idle / 60:.0f} minutes")
+
+    def trip(self, reason):
+        with self.lock:
+            if self.reason is not None:
+                return
+            self.reason = reason
+            pid = self.pid
+        err(f"ERROR: Watchdog tripped ({reason}), killing vivado")
+        if pid is not None:
+            kill_tree(pid)
+
+    def start(self):
+        if not self.enabled:
+            return
+        self.last_output = self.stage_start = time.time()
+        super().start()
+
+    def run(self):
+        while not self.stopped.wait(CHECK_SECONDS):
+            if self.reason is None:
+                self.check()
+
+    def stop(self):
+        self.stopped.set()
+        if self.is_alive():
+            self.join()
+
+    def report(self, output_dir):
+        """
+        Shows the tail of the newest runme.log and saves it with the reason, if tripped
+
+        Args:
+            output_dir: The output directory of the build
+
+        """
+        if self.reason is None:
+            return
+        lines = [f"Watchdog tripped ({self.reason}) in the {self.stage} stage"]
+        logs = find_runme_logs(self.run_dir)
+        if logs:
+            lines.append(f"========== TAIL OF {logs[0]} ==========")
+            lines.extend(get_tail(logs[0]))
+            lines.append(f"========== END OF {logs[0]} ==========")
+        else:
+            lines.append("No runme.log found")
+        text = "\n".join(lines)
+        print(text)
+        (Path(output_dir) / REPORT_FILE).write_text(text + "\n")
+
+    def raise_if_tripped(self):
+        if self.reason is not None:
+            raise WatchdogError(f"Watchdog killed vivado: {self.reason}")
@@ -0,0 +1,66 @@
+# Copyright (c) 2022, Intrepid Control Systems, Inc.
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice, this
+#    list of conditions and the following disclaimer.
+#
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+#    this list of conditions and the following disclaimer in the documentation
+#    and/or other materials provided with the distribution.
+#
+# 3. Neither the name of the copyright holder nor the names of its
+#    contributors may be used to endorse or promote products derived from
+#    this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+# OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+# Keeps a single vivado alive to run several build scripts back to back
+# Jobs come in on stdin, one tcl list per line: cwd script args...
+# Each job ends with a done marker holding its return code
+
+# Scripts are allowed to exit, that should only end the job
+rename exit fpga_builder_real_exit
+proc exit {{code 0}} {
+  return -code error -errorcode [list FPGA_BUILDER_EXIT $code] "exit $code"
+}
+
+fconfigure stdout -buffering line
+puts "FPGA_BUILDER_WORKER_READY"
+while {[gets stdin job] >= 0} {
+  if {$job == "quit"} {
+    break
+  }
+  set rc 0
+  if {[catch {
+    cd [lindex $job 0]
+    set script [lindex $job 1]
+    set argv [lrange $job 2 end]
+    set argc [llength $argv]
+    set argv0 $script
+    uplevel #0 [list source $script]
+  } msg opts]} {
+    set code [dict get $opts -errorcode]
+    if {[lindex $code 0] == "FPGA_BUILDER_EXIT"} {
+      set rc [lindex $code 1]
+    } else {
+      puts "ERROR: $msg"
+      set rc 1
+    }
+  }
+  # Leave a clean slate for the next job
+  catch {close_project}
+  puts "FPGA_BUILDER_JOB_DONE $rc"
+}
+fpga_builder_real_exit 0
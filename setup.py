@@ -42,8 +42,8 @@ setup(
     author="author_name",
     packages=packages,
     install_requires=read_requirements("requirements.txt"),
-    entry_points={"console_scripts": ["project_name = project_name.__main__:main"]},
-    package_data={"fpga_builder": ["utils.tcl"]},
+    entry_points={"console_scripts": ["fpga_builder = fpga_builder.__main__:main"]},
+    package_data={"fpga_builder": ["utils.tcl", "worker.tcl"]},
     include_package_data=True
     # extras_require={"test": read_requirements("requirements-test.txt")},
 )
@@ -0,0 +1,183 @@
+# Copyright (c) 2022, Intrepid Control Systems, Inc.
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice, this
+#    list of conditions and the following disclaimer.
+#
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+#    this list of conditions and the following disclaimer in the documentation
+#    and/or other materials provided with the distribution.
+#
+# 3. Neither the name of the copyright holder nor the names of its
+#    contributors may be used to endorse or promote products derived from
+#    this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+# OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+"""
+Copyright 2022 Intrepid Control Systems
+
+Runs `daemon.VivadoWorker` against a fake worker speaking the same line protocol
+
+"""
+
+import shlex
+import sys
+from textwrap import dedent
+
+import pytest
+
+from fpga_builder import daemon
+
+# Stands in for vivado running worker.tcl, the script name picks what the job does
+FAKE_WORKER = dedent("""\
+    import os
+    import shlex
+    import sys
+    print("{ready}", flush=True)
+    for line in sys.stdin:
+        if line.strip() == "quit":
+            break
+        cwd, script, *args = shlex.split(line)
+        if script == "die":
+            print("Crashed", flush=True)
+            sys.exit(1)
+        print(f"pid {{os.getpid()}} cwd {{cwd}}", flush=True)
+        for arg in args:
+            print(f"arg {{arg}}", flush=True)
+        print(f"{done} {{1 if script == 'fail' else 0}}", flush=True)
+    """)
+
+
+@pytest.fixture
+def worker_cmd(tmp_path, monkeypatch):
+    worker = tmp_path / "worker.py"
+    worker.write_text(
+        FAKE_WORKER.format(ready=daemon.READY_MARKER, done=daemon.DONE_MARKER)
+    )
+    cmd = f"{shlex.quote(sys.executable)} {shlex.quote(str(worker))}"
+    monkeypatch.setenv(daemon.WORKER_CMD_ENV_VAR, cmd)
+    yield cmd
+    daemon.stop_all()
+
+
+def run_job(worker, script, tcl_args=(), cwd="/tmp"):
+    lines = []
+    pids = []
+    worker.run_job(script, list(tcl_args), cwd, lines.append, on_start=pids.append)
+    return lines, pids[0]
+
+
+def test_protocol(worker_cmd, tmp_path):
+    worker = daemon.VivadoWorker("vivado")
+    args = ["plain", "with space", "{braces}", "[cmd]", "$var", 'quote"d']
+    log = tmp_path / "job.log"
+
+    lines = []
+    pids = []
+    worker.run_job("ok", args, tmp_path, lines.append, log, pids.append)
+
+    assert lines[0] == f"pid {pids[0]} cwd {tmp_path}"
+    assert lines[1:] == [f"arg {arg}" for arg in args]
+    assert log.read_text().splitlines() == lines
+    assert worker.num_jobs == 1
+    worker.stop()
+    assert not worker.alive()
+
+
+def test_reuses_worker(worker_cmd):
+    worker = daemon.VivadoWorker("vivado")
+
+    pids = [run_job(worker, "ok")[1] for _ in range(3)]
+
+    assert len(set(pids)) == 1
+    assert worker.num_jobs == 3
+    worker.stop()
+
+
+def test_restart_after_max_jobs(worker_cmd):
+    worker = daemon.VivadoWorker("vivado", max_jobs=2)
+
+    pids = [run_job(worker, "ok")[1] for _ in range(5)]
+
+    assert pids[0] == pids[1] != pids[2] == pids[3] != pids[4]
+    worker.stop()
+
+
+def test_restart_after_max_rss(worker_cmd):
+    # Any python process is over a megabyte
+    worker = daemon.VivadoWorker("vivado", max_rss_gb=1 / 1024)
+
+    pids = [run_job(worker, "ok")[1] for _ in range(3)]
+
+    assert len(set(pids)) == 3
+    worker.stop()
+
+
+def test_failed_job(worker_cmd):
+    worker = daemon.VivadoWorker("vivado")
+    _, pid = run_job(worker, "ok")
+
+    with pytest.raises(Exception, match="rc:     1"):
+        run_job(worker, "fail")
+
+    # A failed job leaves the worker usable
+    assert worker.alive()
+    assert run_job(worker, "ok")[1] == pid
+    worker.stop()
+
+
+def test_worker_dies(worker_cmd):
+    worker = daemon.VivadoWorker("vivado")
+    _, pid = run_job(worker, "ok")
+
+    with pytest.raises(daemon.WorkerError):
+        run_job(worker, "die")
+
+    assert not worker.alive()
+    assert run_job(worker, "ok")[1] != pid
+    worker.stop()
+
+
+def test_worker_never_ready(monkeypatch):
+    monkeypatch.setenv(
+        daemon.WORKER_CMD_ENV_VAR, f"{shlex.quote(sys.executable)} -c pass"
+    )
+    worker = daemon.VivadoWorker("vivado")
+
+    with pytest.raises(daemon.WorkerError, match="before it was ready"):
+        worker.run_job("ok", [], "/tmp")
+
+
+def test_fallback(monkeypatch):
+    monkeypatch.setenv(daemon.WORKER_CMD_ENV_VAR, "/nonexistent/vivado")
+    fallbacks = []
+
+    rc = daemon.run_job_or_fallback(
+        lambda: fallbacks.append(True) or 0, "vivado", "ok", [], "/tmp"
+    )
+
+    assert rc == 0
+    assert fallbacks == [True]
+    daemon.stop_all()
+
+
+def test_pool(worker_cmd):
+    lines = []
+    daemon.run_job("vivado", "ok", [], "/tmp", lines.append)
+    daemon.run_job("vivado", "ok", [], "/tmp", lines.append)
+
+    # The second job goes to the idle worker from the first
+    assert lines[0] == lines[1]
+    assert len(daemon._pool["vivado"]) == 1
@@ -0,0 +1,139 @@
+# Copyright (c) 2022, Intrepid Control Systems, Inc.
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice, this
+#    list of conditions and the following disclaimer.
+#
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+#    this list of conditions and the following disclaimer in the documentation
+#    and/or other materials provided with the distribution.
+#
+# 3. Neither the name of the copyright holder nor the names of its
+#    contributors may be used to endorse or promote products derived from
+#    this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+# OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+"""
+Copyright 2022 Intrepid Control Systems
+
+Runs `farm.build_blocks` against a fake vivado on PATH
+
+"""
+
+import argparse
+import sys
+from pathlib import Path
+from textwrap import dedent
+
+import pytest
+
+from fpga_builder import builder, farm, filelists
+
+# Stands in for vivado -mode batch, failing any block whose sources are under broken/
+FAKE_VIVADO = dedent("""\
+    #!{python}
+    import sys
+    args = sys.argv[sys.argv.index("-tclargs") + 1 :]
+    stats = next(arg for arg in args if "stats_" in arg)
+    for stage in ("synth", "impl"):
+        print(f"Starting stage: {{stage}}", flush=True)
+    if any("broken" in arg for arg in args):
+        print("ERROR: [Synth 8-439] module 'missing' not found", flush=True)
+        sys.exit(1)
+    with open(stats, "w") as file:
+        file.write(
+            "# Build stats\\n"
+            "worst_slack:    0.25 ns\\n"
+            "lut_util:       12.5%\\n"
+            "ram_util:       3.0%\\n"
+        )
+    """)
+
+TOP_VHD = dedent("""\
+    library ieee;
+    use ieee.std_logic_1164.all;
+
+    entity top is
+      port (clk : in std_logic);
+    end entity top;
+
+    architecture rtl of top is
+    begin
+    end architecture rtl;
+    """)
+
+
+def fake_generate_filelist(base_dir, build_dir, other_files=None):
+    # Stands in for manifest_reader, listing other_files the same way
+    lines = ["set all_sources [list \\"]
+    for lib, files in (other_files or {}).get("vhdl", {}).items():
+        for file, standard in files:
+            lines.append(f'  "{Path(file).as_posix()}" "{lib}" "{standard}" \\')
+    lines.append("]")
+    build_dir = Path(build_dir)
+    build_dir.mkdir(parents=True, exist_ok=True)
+    (build_dir / filelists.FILELIST_FILE).write_text("\n".join(lines) + "\n")
+
+
+@pytest.fixture
+def fake_vivado(tmp_path, monkeypatch):
+    # The version is read from the install layout, <version>/bin/vivado
+    bin_dir = tmp_path / "Xilinx" / "2019.1" / "bin"
+    bin_dir.mkdir(parents=True)
+    vivado = bin_dir / "vivado"
+    vivado.write_text(FAKE_VIVADO.format(python=sys.executable))
+    vivado.chmod(0o755)
+    monkeypatch.setenv("PATH", str(bin_dir), prepend=":")
+    monkeypatch.setenv("FPGA_BUILDER_HOME", str(tmp_path / "home"))
+    monkeypatch.setenv("FPGA_BUILDER_LOCK_DIR", str(tmp_path / "locks"))
+    monkeypatch.setenv("FPGA_BUILDER_METRICS_DB", str(tmp_path / "metrics.db"))
+    monkeypatch.setattr(builder, "BASE_DIR", tmp_path)
+    monkeypatch.setattr(filelists, "generate_filelist", fake_generate_filelist)
+    monkeypatch.chdir(tmp_path)
+    return vivado
+
+
+def make_block(tmp_path, name, generics=None):
+    blk_dir = tmp_path / name
+    blk_dir.mkdir()
+    (blk_dir / "top.vhd").write_text(TOP_VHD)
+    return {
+        "blk_dir": blk_dir,
+        "top_level": blk_dir / "top.vhd",
+        "generics": generics,
+        "build_dir": tmp_path / "build" / name,
+    }
+
+
+def test_build_blocks(tmp_path, fake_vivado):
+    blocks = [
+        make_block(tmp_path, "fifo", {"DEPTH": 16}),
+        make_block(tmp_path, "broken"),
+        make_block(tmp_path, "uart"),
+    ]
+    parser = farm.setup_blocks_parser(argparse.ArgumentParser())
+    args = parser.parse_args(["blocks.json", "-j", "2", "--no-progress", "--no-cache"])
+
+    results = farm.build_blocks(blocks, args)
+
+    assert [row["block"] for row in results] == ["fifo", "broken", "uart"]
+    assert [row["passed"] for row in results] == [True, False, True]
+    for row in (results[0], results[2]):
+        assert row["worst_slack"] == 0.25
+        assert row["lut_util"] == 12.5
+        assert row["ram_util"] == 3.0
+    assert results[1]["worst_slack"] is None
+    assert results[1]["error"]
+    assert not farm.print_results(results)
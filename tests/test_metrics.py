@@ -0,0 +1,84 @@
+# Copyright (c) 2022, Intrepid Control Systems, Inc.
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice, this
+#    list of conditions and the following disclaimer.
+#
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+#    this list of conditions and the following disclaimer in the documentation
+#    and/or other materials provided with the distribution.
+#
+# 3. Neither the name of the copyright holder nor the names of its
+#    contributors may be used to endorse or promote products derived from
+#    this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+# OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+"""
+Copyright 2022 Intrepid Control Systems
+
+Regression checks of the build metrics
+
+"""
+
+import pytest
+
+from fpga_builder import metrics
+
+
+@pytest.fixture
+def record(tmp_path, monkeypatch):
+    monkeypatch.setenv("FPGA_BUILDER_METRICS_DB", str(tmp_path / "metrics.db"))
+
+    def record_build(worst_slack, total_time=600):
+        stats_file = tmp_path / "stats.txt"
+        stats_file.write_text(
+            f"# Time stats\n"
+            f"total_time:     {total_time} sec\n"
+            f"# Build stats\n"
+            f"worst_slack:    {worst_slack} ns\n"
+            f"lut_util:       12.5%\n"
+        )
+        metrics.record_build("device_a", stats_file, 4)
+
+    return record_build
+
+
+def test_no_regressions(record):
+    for slack in (1.0, 1.2, 0.9, 1.1):
+        record(slack)
+    assert metrics.find_regressions("device_a") == []
+
+
+def test_slack_drop(record):
+    for slack in (1.0, 1.2, 1.1):
+        record(slack)
+    record(0.4)
+    assert metrics.find_regressions("device_a") == [
+        "worst_slack is 0.4 ns, down from 1.1 ns"
+    ]
+    # Within a wider margin
+    assert metrics.find_regressions("device_a", slack_margin=1) == []
+
+
+def test_negative_slack(record):
+    record(-0.1)
+    assert metrics.find_regressions("device_a") == ["worst_slack is -0.1 ns"]
+
+
+def test_time_regression(record):
+    for _ in range(3):
+        record(1.0, total_time=600)
+    record(1.0, total_time=900)
+    assert metrics.find_regressions("device_a") == ["total_time is 900, +50% over 600"]
@@ -0,0 +1,124 @@
+# Copyright (c) 2022, Intrepid Control Systems, Inc.
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice, this
+#    list of conditions and the following disclaimer.
+#
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+#    this list of conditions and the following disclaimer in the documentation
+#    and/or other materials provided with the distribution.
+#
+# 3. Neither the name of the copyright holder nor the names of its
+#    contributors may be used to endorse or promote products derived from
+#    this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+# OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+"""
+Copyright 2022 Intrepid Control Systems
+
+Runs `scheduler.build_devices` with vivado stubbed out
+
+"""
+
+import json
+import time
+
+import pytest
+
+from fpga_builder import builder, scheduler, tuning
+
+
+def fake_run_vivado(build_tcl, run_dir, build_args, *args, **kwargs):
+    # Runs in a worker process, so the parent reads what it saw back from a file
+    start = time.time()
+    time.sleep(0.5)
+    record = {
+        "start": start,
+        "end": time.time(),
+        "num_threads": build_args.num_threads,
+    }
+    (run_dir / "record.json").write_text(json.dumps(record))
+    stats_file = builder.get_stats_file(run_dir, build_args.num_threads)
+    stats_file.parent.mkdir(parents=True, exist_ok=True)
+    stats_file.write_text("stats\n")
+    return False
+
+
+@pytest.fixture
+def jobs(tmp_path, monkeypatch):
+    monkeypatch.setenv("FPGA_BUILDER_HOME", str(tmp_path / "home"))
+    monkeypatch.setattr(builder, "run_vivado", fake_run_vivado)
+    jobs = []
+    for device in ("dev_a", "dev_b", "dev_c", "dev_d"):
+        run_dir = tmp_path / device
+        run_dir.mkdir()
+        jobs.append(
+            {"run_tcl": run_dir / "run.tcl", "run_dir": run_dir, "device_name": device}
+        )
+    return jobs
+
+
+def build(jobs, *options):
+    args = builder.get_build_parser().parse_args(["--no-progress", *options])
+    results = scheduler.build_devices(jobs, args)
+    records = [json.loads((job["run_dir"] / "record.json").read_text()) for job in jobs]
+    return results, records
+
+
+def get_max_running(records):
+    # The most builds that overlapped at once
+    events = sorted(
+        [(record["start"], 1) for record in records]
+        + [(record["end"], -1) for record in records]
+    )
+    running = max_running = 0
+    for _, change in events:
+        running += change
+        max_running = max(max_running, running)
+    return max_running
+
+
+def test_concurrency(jobs):
+    results, records = build(jobs, "--jobs", "2", "--total-threads", "8")
+
+    assert [result["error"] for result in results] == [""] * 4
+    assert sorted(result["device"] for result in results) == [
+        "dev_a",
+        "dev_b",
+        "dev_c",
+        "dev_d",
+    ]
+    assert get_max_running(records) == 2
+    # Each running build gets half of the threads
+    assert [record["num_threads"] for record in records] == [4, 4, 4, 4]
+
+
+def test_thread_shares(jobs):
+    _, records = build(jobs[:3], "--jobs", "3", "--total-threads", "8")
+
+    # The remainder goes to the builds started last
+    assert [record["num_threads"] for record in records] == [2, 3, 3]
+
+
+def test_max_threads(jobs):
+    total = 4 * tuning.VIVADO_MAX_THREADS
+    results, records = build(jobs[:2], "--jobs", "2", "--total-threads", str(total))
+
+    assert [record["num_threads"] for record in records] == [
+        tuning.VIVADO_MAX_THREADS
+    ] * 2
+    assert [result["num_threads"] for result in results] == [
+        tuning.VIVADO_MAX_THREADS
+    ] * 2
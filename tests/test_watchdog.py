@@ -0,0 +1,121 @@
+# Copyright (c) 2022, Intrepid Control Systems, Inc.
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice, this
+#    list of conditions and the following disclaimer.
+#
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+#    this list of conditions and the following disclaimer in the documentation
+#    and/or other materials provided with the distribution.
+#
+# 3. Neither the name of the copyright holder nor the names of its
+#    contributors may be used to endorse or promote products derived from
+#    this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+# OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+"""
+Copyright 2022 Intrepid Control Systems
+
+Checks what `watchdog.Watchdog` kills and watches
+
+"""
+
+import os
+import subprocess
+import sys
+import time
+
+import pytest
+
+from fpga_builder import watchdog
+
+SLEEPER = [sys.executable, "-c", "import time; time.sleep(60)"]
+
+
+@pytest.fixture
+def processes():
+    started = []
+
+    def start(cmd, **kwargs):
+        process = subprocess.Popen(cmd, **kwargs)
+        started.append(process)
+        return process
+
+    yield start
+    for process in started:
+        process.kill()
+        process.wait()
+
+
+def test_kills_only_attached_tree(tmp_path, processes):
+    # A one-shot vivado in its own group, with a child of its own
+    vivado = processes(
+        [sys.executable, "-c", f"import subprocess; subprocess.run({SLEEPER!r})"],
+        start_new_session=True,
+    )
+    other = processes(SLEEPER)
+    time.sleep(0.5)
+    tree = watchdog.procmon.get_process_tree(vivado.pid)
+    assert len(tree) == 2
+    build_watchdog = watchdog.Watchdog(tmp_path, stall_seconds=60)
+    build_watchdog.attach(vivado.pid)
+
+    build_watchdog.trip("testing")
+
+    assert vivado.wait(timeout=10) != 0
+    for pid in tree[1:]:
+        with pytest.raises(ProcessLookupError):
+            for _ in range(100):
+                os.kill(pid, 0)
+                time.sleep(0.1)
+    assert other.poll() is None
+    with pytest.raises(watchdog.WatchdogError, match="testing"):
+        build_watchdog.raise_if_tripped()
+
+
+def test_kills_when_attached_after_trip(tmp_path, processes):
+    vivado = processes(SLEEPER)
+    build_watchdog = watchdog.Watchdog(tmp_path, stall_seconds=60)
+    build_watchdog.trip("testing")
+
+    build_watchdog.attach(vivado.pid)
+
+    assert vivado.wait(timeout=10) != 0
+
+
+def test_runme_logs_found_once_per_stage(tmp_path, monkeypatch):
+    calls = []
+    find_runme_logs = watchdog.find_runme_logs
+
+    def counting(run_dir):
+        calls.append(run_dir)
+        return find_runme_logs(run_dir)
+
+    monkeypatch.setattr(watchdog, "find_runme_logs", counting)
+    build_watchdog = watchdog.Watchdog(tmp_path, stall_seconds=60)
+    build_watchdog.feed("Starting synth", "synth")
+    # Nothing launched yet, keep looking
+    build_watchdog.get_last_activity()
+    log = tmp_path / "proj.runs" / "synth_1" / "runme.log"
+    log.parent.mkdir(parents=True)
+    log.write_text("running\n")
+    os.utime(log, (time.time() + 100, time.time() + 100))
+    assert build_watchdog.get_last_activity() == log.stat().st_mtime
+    assert build_watchdog.get_last_activity() == log.stat().st_mtime
+    assert len(calls) == 2
+
+    build_watchdog.feed("Starting impl", "impl")
+    build_watchdog.get_last_activity()
+    assert len(calls) == 3